@@ -0,0 +1,134 @@
+"""Circuit Breaker
+
+Stop calling a dependency that keeps failing, so an outage costs a quick
+error instead of a timeout per message."""
+import logging
+import os
+import threading
+import time
+
+
+class CircuitOpen(Exception):
+    """Raised when a call is refused because the circuit is open."""
+    pass
+
+
+class CircuitBreaker(object):
+    """Circuit breaker with half-open probing
+
+    The circuit opens after `failures` consecutive failures. While open every
+    call is refused. Once `reset_timeout` seconds have passed the circuit is
+    half-open and a single probe call is allowed through; its success closes
+    the circuit again, its failure opens it for another `reset_timeout`.
+
+    Settings are read from `<NAME>_BREAKER_FAILURES` and
+    `<NAME>_BREAKER_RESET` when not passed in.
+
+    Attributes:
+        name (str): Name of the protected dependency
+        failures (int): Consecutive failures that open the circuit
+        reset_timeout (float): Seconds to wait before probing an open circuit
+        consecutive_failures (int): Failures since the last success
+        opened (int): Number of times the circuit opened
+        rejected (int): Number of calls refused while open
+        logger (:obj: `logger`, optional): An instance of a python logger
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, name, failures=None, reset_timeout=None, logger=None):
+        self.logger = logger or logging.getLogger(self.__class__.__name__)
+        self.name = name
+        prefix = name.upper()
+        if failures is None:
+            failures = os.environ.get(
+                '{}_BREAKER_FAILURES'.format(prefix), 5)
+        if reset_timeout is None:
+            reset_timeout = os.environ.get(
+                '{}_BREAKER_RESET'.format(prefix), 30)
+        self.failures = int(failures)
+        self.reset_timeout = float(reset_timeout)
+        self.consecutive_failures = 0
+        self.opened = 0
+        self.rejected = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.__dict__)
+
+    def __str__(self):
+        return '<{} {} {}>'.format(self.__class__.__name__, self.name,
+                                   self.state)
+
+    @property
+    def state(self):
+        """Return the current state of the circuit"""
+        if self._opened_at is None:
+            return self.CLOSED
+        if time.time() - self._opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    @property
+    def healthy(self):
+        """Return True if the last call to the dependency succeeded"""
+        return self.consecutive_failures == 0
+
+    def allow(self):
+        """Return True if a call may be made now
+
+        In the half-open state only one caller is allowed to probe."""
+        with self._lock:
+            state = self.state
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                self.logger.info('probing {}'.format(self.name))
+                return True
+            self.rejected += 1
+            return False
+
+    def success(self):
+        """Record a successful call and close the circuit"""
+        with self._lock:
+            if self._opened_at is not None:
+                self.logger.info('circuit for {} closed'.format(self.name))
+            self.consecutive_failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def failure(self):
+        """Record a failed call, opening the circuit if needed"""
+        with self._lock:
+            self.consecutive_failures += 1
+            if self._probing or (
+                    self._opened_at is None and
+                    self.consecutive_failures >= self.failures):
+                self.opened += 1
+                self.logger.warning(
+                    'circuit for {} opened after {} failures'.format(
+                        self.name, self.consecutive_failures))
+                self._opened_at = time.time()
+            self._probing = False
+
+    def call(self, fn, *args, **kwargs):
+        """Return `fn(*args, **kwargs)` if the circuit allows it
+
+        Any exception raised by `fn` counts as a failure.
+
+        Raises:
+            CircuitOpen: If the circuit refuses the call.
+        """
+        if not self.allow():
+            raise CircuitOpen(self.name)
+        try:
+            result = fn(*args, **kwargs)
+        except Exception:
+            self.failure()
+            raise
+        self.success()
+        return result
@@ -0,0 +1,233 @@
+"""Cache
+
+In-memory caching helpers shared by the bot and its integrations."""
+import logging
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+def approximate_size(obj, seen=None):
+    """Return the approximate size in bytes of `obj` and its contents
+
+    Walks dictionaries, lists, tuples and sets; any other object is counted
+    with sys.getsizeof."""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += approximate_size(key, seen)
+            size += approximate_size(value, seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for item in obj:
+            size += approximate_size(item, seen)
+    return size
+
+
+class LRUCache(object):
+    """Bounded in-memory cache with per entry expiry
+
+    Once the cache holds more than `max_entries` entries, or more than
+    `max_bytes` bytes of values, the least recently used entries are evicted.
+    It is safe to share between threads.
+
+    Attributes:
+        max_entries (int): Maximum number of entries
+        max_bytes (int): Maximum approximate size of all values, None for
+            no limit
+        ttl (float): Default seconds an entry lives, None for no expiry
+        hits (int): Number of lookups answered from the cache
+        misses (int): Number of lookups that were not cached or expired
+        evictions (int): Number of entries evicted to respect the bounds
+        logger (:obj: `logger`, optional): An instance of a python logger
+    """
+    def __init__(self, max_entries=1024, max_bytes=None, ttl=None,
+                 logger=None):
+        self.logger = logger or logging.getLogger(self.__class__.__name__)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.stats)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False
+            if self._expired(entry):
+                self._remove(key)
+                return False
+            return True
+
+    def _expired(self, entry):
+        expires = entry[1]
+        return expires is not None and expires <= time.time()
+
+    def _remove(self, key):
+        value, expires, size = self._entries.pop(key)
+        self.size -= size
+
+    def get(self, key, default=None):
+        """Return the cached value for `key` or `default`"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self._expired(entry):
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, ttl=None):
+        """Cache `value` under `key`
+
+        Arguments:
+            key: Hashable cache key
+            value: Value to cache
+            ttl (float, optional): Seconds to keep the value, defaults to the
+                cache ttl
+        """
+        if ttl is None:
+            ttl = self.ttl
+        expires = time.time() + ttl if ttl is not None else None
+        size = approximate_size(value) if self.max_bytes else 0
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, expires, size)
+            self.size += size
+            self._evict()
+
+    def remove(self, key):
+        """Remove `key` from the cache if present"""
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        """Remove every entry from the cache"""
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def _evict(self):
+        """Evict least recently used entries until within bounds"""
+        while self._entries and (
+                len(self._entries) > self.max_entries or
+                (self.max_bytes and self.size > self.max_bytes)):
+            key = next(iter(self._entries))
+            self._remove(key)
+            self.evictions += 1
+            self.logger.debug('evicted {} from cache'.format(key))
+
+    @property
+    def hit_rate(self):
+        """Return the fraction of lookups answered from the cache"""
+        lookups = self.hits + self.misses
+        if not lookups:
+            return 0.0
+        return self.hits / lookups
+
+    @property
+    def stats(self):
+        """Return a dictionary of cache counters"""
+        return {
+            'entries': len(self._entries),
+            'bytes': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hit_rate,
+        }
+
+
+class CooldownLedger(object):
+    """Record of recently handled (scope, key) pairs
+
+    Used to avoid repeating work, e.g. posting the same Jira issue to the
+    same channel, inside a cooldown window. Checking the ledger costs a
+    single dictionary lookup.
+
+    Attributes:
+        window (float): Default cooldown in seconds
+        windows (dict): Cooldown in seconds per scope, overrides `window`
+    """
+    def __init__(self, window=60, windows=None, max_entries=4096):
+        self.window = window
+        self.windows = windows or {}
+        self._entries = LRUCache(max_entries=max_entries)
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.__dict__)
+
+    def cooling(self, scope, key):
+        """Return True if `key` is cooling off in `scope`"""
+        return (scope, key) in self._entries
+
+    def start(self, scope, key):
+        """Start the cooldown of `key` in `scope`"""
+        window = self.windows.get(scope, self.window)
+        if window > 0:
+            self._entries.set((scope, key), True, ttl=window)
+
+
+class SingleFlight(object):
+    """Coalesce concurrent calls for the same key
+
+    The first caller for a key runs the call. Callers arriving while it is
+    in flight wait for it and share its result, or its exception, instead of
+    making the same request again.
+
+    Attributes:
+        shared (int): Number of calls answered by another caller's request
+    """
+    def __init__(self):
+        self.shared = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.__dict__)
+
+    def do(self, key, fn, *args, **kwargs):
+        """Return `fn(*args, **kwargs)`, sharing in flight calls for `key`"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+            else:
+                self.shared += 1
+        if not leader:
+            return call.result()
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
@@ -0,0 +1,251 @@
+"""Dispatcher
+
+Run integration updates on a bounded pool of worker threads.
+
+Work is partitioned by key (normally the Slack channel) so everything for one
+channel is handled by the same worker, in the order it was submitted, while
+other channels carry on in parallel. Work that is cheaper in bulk can be
+grouped with a MicroBatcher."""
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class DispatchQueueFull(Exception):
+    """Raised when a worker queue stays full and work is dropped."""
+    pass
+
+
+class Dispatcher(object):
+    """Partitioned worker pool
+
+    Attributes:
+        workers (int): Number of worker threads, 0 runs work inline
+        queue_size (int): Maximum number of pending items per worker
+        timeout (float): Seconds to wait for room in a full queue before
+            the work is dropped
+        dropped (int): Number of work items dropped because of full queues
+        logger (:obj: `logger`, optional): An instance of a python logger
+    """
+    def __init__(self, workers=None, queue_size=None, timeout=None,
+                 logger=None):
+        self.logger = logger or logging.getLogger(self.__class__.__name__)
+        if workers is None:
+            workers = os.environ.get('EULERBOT_DISPATCH_WORKERS', 4)
+        if queue_size is None:
+            queue_size = os.environ.get('EULERBOT_DISPATCH_QUEUE_SIZE', 100)
+        if timeout is None:
+            timeout = os.environ.get('EULERBOT_DISPATCH_TIMEOUT', 5)
+        self.workers = int(workers)
+        self.queue_size = int(queue_size)
+        self.timeout = float(timeout)
+        self.dropped = 0
+        self._queues = []
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.__dict__)
+
+    def __str__(self):
+        return '<{} workers={}>'.format(self.__class__.__name__, self.workers)
+
+    def _start(self):
+        """Start the worker threads on first use"""
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                q = queue.Queue(maxsize=self.queue_size)
+                t = threading.Thread(target=self._work, args=(q,),
+                                     name='dispatcher-{}'.format(i),
+                                     daemon=True)
+                self._queues.append(q)
+                self._threads.append(t)
+                t.start()
+            self.logger.debug("started {} dispatcher workers".format(
+                self.workers))
+
+    def _work(self, q):
+        """Worker thread, run queued items until told to stop"""
+        while True:
+            item = q.get()
+            try:
+                if item is None:
+                    return
+                self._execute(*item)
+            finally:
+                q.task_done()
+
+    def _execute(self, future, fn, args):
+        """Run `fn` and resolve `future` with the outcome"""
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            self.logger.error("dispatched call {} failed: {}".format(fn, e))
+            future.set_exception(e)
+
+    def submit(self, key, fn, *args):
+        """Queue `fn(*args)` on the worker that owns `key`
+
+        Waits up to `timeout` seconds for room in a full queue.
+
+        Arguments:
+            key (str): Partition key, work with the same key runs in order
+            fn (callable): Function to run
+            args: Positional arguments for fn
+
+        Returns:
+            A concurrent.futures.Future for the result of the call.
+        """
+        return self._enqueue(key, fn, args, True)
+
+    def submit_nowait(self, key, fn, *args):
+        """Queue `fn(*args)` on the worker that owns `key` without blocking
+
+        Use this from the event loop: when the worker's queue is full the
+        work is dropped right away instead of stalling every channel.
+
+        Returns:
+            A concurrent.futures.Future for the result of the call.
+        """
+        return self._enqueue(key, fn, args, False)
+
+    def _enqueue(self, key, fn, args, block):
+        """Put the call on the queue of the worker that owns `key`"""
+        future = Future()
+        if self.workers < 1:
+            self._execute(future, fn, args)
+            return future
+
+        self._start()
+        q = self._queues[hash(key) % self.workers]
+        try:
+            q.put((future, fn, args), block=block, timeout=self.timeout)
+        except queue.Full:
+            self.dropped += 1
+            self.logger.warning("dispatch queue for {} is full, dropping "
+                                "{}".format(key, fn))
+            future.set_exception(DispatchQueueFull(key))
+        return future
+
+    def join(self):
+        """Block until all queued work has been processed"""
+        for q in self._queues:
+            q.join()
+
+    def shutdown(self):
+        """Stop the workers once their queues have drained"""
+        for q in self._queues:
+            q.put(None)
+        for t in self._threads:
+            t.join()
+        with self._lock:
+            del self._queues[:]
+            del self._threads[:]
+
+
+class MicroBatcher(object):
+    """Collect work submitted close together and process it as one batch
+
+    The first item starts a batch; items arriving within `window` seconds
+    join it, up to `max_batch` items. `fn` is then called once with the
+    list of items and must return one result per item, in order.
+
+    Attributes:
+        window (float): Seconds to wait for more items after the first
+        max_batch (int): Maximum number of items per batch
+        batches (int): Number of batches processed
+        processed (int): Number of items processed
+        logger (:obj: `logger`, optional): An instance of a python logger
+    """
+    def __init__(self, fn, window=0.005, max_batch=64, logger=None):
+        self.logger = logger or logging.getLogger(self.__class__.__name__)
+        self.fn = fn
+        self.window = window
+        self.max_batch = max_batch
+        self.batches = 0
+        self.processed = 0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.__dict__)
+
+    def _start(self):
+        """Start the batching thread on first use"""
+        with self._lock:
+            if self._thread:
+                return
+            self._thread = threading.Thread(target=self._work,
+                                            name='micro-batcher', daemon=True)
+            self._thread.start()
+
+    def _work(self):
+        """Batching thread, collect and process batches until stopped"""
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.time() + self.window
+            stop = False
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self._process(batch)
+            if stop:
+                return
+
+    def _process(self, batch):
+        """Run `fn` over a batch and resolve every item's future"""
+        futures = [future for future, item in batch]
+        try:
+            results = list(self.fn([item for future, item in batch]))
+            if len(results) != len(batch):
+                raise ValueError('{} results for {} items'.format(
+                    len(results), len(batch)))
+        except Exception as e:
+            self.logger.error("batch of {} failed: {}".format(len(batch), e))
+            for future in futures:
+                future.set_exception(e)
+            return
+        for future, result in zip(futures, results):
+            future.set_result(result)
+        self.batches += 1
+        self.processed += len(batch)
+        self.logger.debug("processed batch of {}".format(len(batch)))
+
+    def submit(self, item):
+        """Queue `item` for the next batch
+
+        Returns:
+            A concurrent.futures.Future for the item's result.
+        """
+        future = Future()
+        self._start()
+        self._queue.put((future, item))
+        return future
+
+    def shutdown(self):
+        """Process what is queued and stop the batching thread"""
+        if self._thread:
+            self._queue.put(None)
+            self._thread.join()
+            with self._lock:
+                self._thread = None
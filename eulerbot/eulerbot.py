@@ -4,9 +4,14 @@ EulerBot is a SlackBot designed to help and assist Systems Engineers operating
 in a Dev/Ops, SRE, or Infrastructure Engineering role.
 
 EulerBot runs a read/eval loop and passes messages to registered integrations.
+By default the loop runs on asyncio; the original polling loop is still
+available by setting EULERBOT_SYNC_LOOP.
 """
+import asyncio
 import logging
+import os
 import time
+from eulerbot.dispatcher import Dispatcher
 from eulerbot.slackbot import SlackBot
 from eulerbot.integrations import support
 from eulerbot.integrations import jira
@@ -27,7 +32,26 @@ class EulerBot(SlackBot):
         self.events_received = 0
 
         self.events_processed = 0
-        self._dms = []
+        self.sync_loop = os.environ.get(
+            'EULERBOT_SYNC_LOOP', '').lower() in ('1', 'true', 'yes')
+        self.warm_up = os.environ.get(
+            'EULERBOT_WARM_UP', '').lower() in ('1', 'true', 'yes')
+        self.queue_size = int(os.environ.get('EULERBOT_EVENT_QUEUE_SIZE',
+                                             1000))
+        self.read_timeout = 1
+        self.loop = None
+        self._queue = None
+        self._tasks = set()
+        self.dispatcher = Dispatcher()
+        self._dms = set()
+        self._dms_loaded = False
+        self._event_handlers = {
+            'im_created': self._im_opened,
+            'im_open': self._im_opened,
+            'im_close': self._im_closed,
+            'team_join': self._user_changed,
+            'user_change': self._user_changed,
+        }
         self._integrations = {
             'direct': [],
             'channel': [],
@@ -39,6 +63,8 @@ class EulerBot(SlackBot):
         self._integrations['channel'].append(
             jira.JiraManagement(self, 'channel')
         )
+        if self.warm_up:
+            self.warm_up_integrations()
         self.logger.info("Started {} with UID {}".format(
             self.name, self.uid))
 
@@ -47,14 +73,80 @@ class EulerBot(SlackBot):
         """Return a list of registered integration's"""
         return self._integrations
 
+    def warm_up_integrations(self):
+        """Let integrations load expensive resources in the background
+
+        Integrations opt in by providing a non blocking `warm_up` method."""
+        for integrations in self._integrations.values():
+            for integration in integrations:
+                warm_up = getattr(integration, 'warm_up', None)
+                if callable(warm_up):
+                    self.logger.debug("warming up {}".format(integration))
+                    warm_up()
+
+    def start_integrations(self):
+        """Start the background work of integrations once connected
+
+        Integrations opt in by providing a non blocking `start` method."""
+        for integrations in self._integrations.values():
+            for integration in integrations:
+                start = getattr(integration, 'start', None)
+                if callable(start):
+                    self.logger.debug("starting {}".format(integration))
+                    start()
+
     @property
     def dms(self):
-        """return a list of direct messages with the bot"""
-        del self._dms[:]
-        for dm in self._api_method("im.list").get('ims', {}):
-            self._dms.append(dm.get('id'))
+        """Return the set of direct message channels with the bot
+
+        The set is loaded from im.list on first use and then kept up to date
+        from im_* RTM events."""
+        if not self._dms_loaded:
+            self.load_dms()
         return self._dms
 
+    def load_dms(self):
+        """Load the direct message channels from the Slack API"""
+        result = self._api_method("im.list")
+        if not result:
+            self.logger.warning("could not load direct message channels")
+            return
+        self._dms.clear()
+        for dm in result.get('ims', []):
+            self._dms.add(dm.get('id'))
+        self._dms_loaded = True
+        self.logger.debug("loaded {} direct message channels".format(
+            len(self._dms)))
+
+    def _event_channel(self, event):
+        """Return the channel id of an RTM event
+
+        Some events carry the channel id, others the channel object."""
+        channel = event.get('channel')
+        if isinstance(channel, dict):
+            return channel.get('id')
+        return channel
+
+    def _im_opened(self, event):
+        """Track a newly created or reopened direct message channel"""
+        channel = self._event_channel(event)
+        if channel:
+            self._dms.add(channel)
+
+    def _im_closed(self, event):
+        """Stop tracking a closed direct message channel"""
+        self._dms.discard(self._event_channel(event))
+
+    def _user_changed(self, event):
+        """Patch the user directory from team_join and user_change events"""
+        self.update_user(event.get('user'))
+
+    def handle_event(self, event):
+        """Update bot state from non-message RTM events"""
+        handler = self._event_handlers.get(event.get('type'))
+        if handler:
+            handler(event)
+
     def _get_event_type(self, event):
         """Return the type of event received from rtm_read()
 
@@ -78,25 +170,145 @@ class EulerBot(SlackBot):
     def process_event(self, event, event_type):
         """Process each message type event
 
-        Pass the event on to any registered integration for that event type."""
+        Pass the event on to any registered integration for that event type.
+        Integrations run on the dispatcher, in order per channel. Those that
+        provide a `dispatch` method queue their own work."""
         if event.get('user', '') == self.uid:  # Don't process bot traffic
             return
 
         self.logger.debug("Received {} event".format(event_type))
         for integration in self.integrations.get(event_type, []):
-            integration.update(event)
+            dispatch = getattr(integration, 'dispatch', None)
+            if callable(dispatch):
+                dispatch(event)
+            else:
+                self.dispatcher.submit(event.get('channel'),
+                                       integration.update, event)
+
+    @asyncio.coroutine
+    def process_event_async(self, event, event_type):
+        """Process each message type event without blocking the event loop
+
+        Integrations that provide an `async_update` coroutine are awaited,
+        everything else is run on the dispatcher. Work for a channel whose
+        queue is full is dropped rather than stalling the loop."""
+        if event.get('user', '') == self.uid:  # Don't process bot traffic
+            return
+
+        self.logger.debug("Received {} event".format(event_type))
+        integrations = self.integrations.get(event_type, [])
+        calls = []
+        for integration in integrations:
+            update = getattr(integration, 'async_update', None)
+            if asyncio.iscoroutinefunction(update):
+                calls.append(update(event))
+            else:
+                calls.append(asyncio.wrap_future(
+                    self.dispatcher.submit_nowait(
+                        event.get('channel'), integration.update, event)))
+        results = yield from asyncio.gather(*calls, return_exceptions=True)
+        for integration, result in zip(integrations, results):
+            if isinstance(result, Exception):
+                self.logger.error("{} failed to process event: {}".format(
+                    integration, result))
+
+    @asyncio.coroutine
+    def _wait_readable(self, timeout):
+        """Wait until the RTM websocket has data or `timeout` expires
+
+        If there is no websocket to watch, this is a plain sleep."""
+        websocket = getattr(self.sc.server, 'websocket', None)
+        sock = getattr(websocket, 'sock', None)
+        if sock is None:
+            yield from asyncio.sleep(timeout)
+            return
+
+        readable = asyncio.Future()
+
+        def ready():
+            if not readable.done():
+                readable.set_result(True)
+
+        self.loop.add_reader(sock.fileno(), ready)
+        try:
+            yield from asyncio.wait_for(readable, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self.loop.remove_reader(sock.fileno())
+
+    @asyncio.coroutine
+    def _rtm_reader(self):
+        """Read events from the Slack firehose onto the event queue"""
+        while self.running:
+            for event in self.sc.rtm_read():
+                self.events_received += 1
+                self.handle_event(event)
+                yield from self._queue.put(event)
+            if self.running:
+                yield from self._wait_readable(self.read_timeout)
+        yield from self._queue.put(None)
+
+    @asyncio.coroutine
+    def _event_consumer(self):
+        """Take events off the event queue and hand them to integrations
+
+        Each message is processed in its own task so a slow integration
+        does not hold up the events queued behind it."""
+        while True:
+            event = yield from self._queue.get()
+            if event is None:
+                break
+            if event.get('type') != 'message':
+                continue
+            if event.get('user') == 'USLACKBOT':
+                continue
+            _type = self._get_event_type(event)
+            task = self.loop.create_task(
+                self.process_event_async(event, _type))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            self.events_processed += 1
+
+        if self._tasks:
+            yield from asyncio.wait(self._tasks)
+
+    def run_async(self):
+        """Asyncio Read/Eval loop
+
+        A reader coroutine wakes up as soon as the websocket has data and
+        queues every event; a consumer coroutine dispatches the queued
+        messages to integrations."""
+        if not self.sc.rtm_connect():
+            self.logger.error("Could not connect to Slack Real Time "
+                              "Messaging API")
+            return
+
+        self.logger.info("connected to the Slack Real Time Messaging API.")
+        self.start_integrations()
+        self.loop = asyncio.get_event_loop()
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self.loop.run_until_complete(asyncio.gather(
+            self._rtm_reader(),
+            self._event_consumer()))
 
     def run(self):
         """Read/Eval loop
 
-        Get the next event from the Slack firehose as long as we are running
+        Get the next event from the Slack firehose as long as we are running.
+        Unless EULERBOT_SYNC_LOOP is set this hands off to `run_async`.
         """
+        if not self.sync_loop:
+            return self.run_async()
+
         if self.sc.rtm_connect():
             self.logger.info("connected to the Slack Real Time Messaging API.")
+            self.start_integrations()
 
             while self.running:
                 for event in self.sc.rtm_read():
                     self.events_received += 1
+                    self.handle_event(event)
                     if event.get('type') == 'message':
                         if event.get('user') == 'USLACKBOT':
                             return
@@ -4,23 +4,34 @@
 Integration to support retrieving and manipulating Jira Issues, Epics, and
 Boards."""
 import re
+import json
 import logging
 import uuid
 import requests
 import os
 import jira
 import hashlib
+import sqlite3
+import threading
+import time
 import urllib
 import dateutil.parser
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timezone
 from beaker.cache import Cache
 from jira import JIRA
+from jira.resources import Issue
+from eulerbot.breaker import CircuitBreaker, CircuitOpen
+from eulerbot.cache import CooldownLedger, LRUCache, SingleFlight
+from eulerbot.slackbot import UserDirectory
 
 
 class IssueLink(object):
     """IssueLink
 
-    Object to represent a Jira Issue Link."""
+    Object to represent a Jira Issue Link. `degraded` is set when part of the
+    attachment could not be built because Jira did not answer."""
 
     def __init__(self, issue, jira=None, users=[], logger=None):
         self.logger = logger or logging.getLogger(self.__class__.__name__)
@@ -29,6 +40,7 @@ class IssueLink(object):
         self._attachment = {}
         self._attachment['fields'] = []
         self.attachment_built = False
+        self.degraded = False
         self.users = users
         self.jira = jira
 
@@ -40,6 +52,18 @@ class IssueLink(object):
             self.__class__.__name__,
             self.issue.key)
 
+    @property
+    def users(self):
+        """Return the UserDirectory used to match Jira users to Slack"""
+        return self._users
+
+    @users.setter
+    def users(self, users):
+        """Set the users, indexing them if they are a plain list"""
+        if not isinstance(users, UserDirectory):
+            users = UserDirectory(users)
+        self._users = users
+
     @property
     def attachment(self):
         """Return a completed attachment
@@ -107,12 +131,15 @@ class IssueLink(object):
         try:
             epic_key = self.issue.fields.customfield_10751
             if epic_key:
-                epic = self.jira.issue(epic_key)
+                summary = self.jira.epic(epic_key)
+                if summary is None:
+                    self.degraded = True
+                    return
                 field = {
                     'title': 'Epic',
                     'value': '<{}|{}>'.format(
-                        epic.permalink(),
-                        epic.fields.summary),
+                        self.jira.permalink(epic_key),
+                        summary),
                     'short': True
                 }
                 self._attachment['fields'].append(field)
@@ -157,13 +184,10 @@ class IssueLink(object):
 
     def _email_to_slack(self, email, default="Mystery Man"):
         """Try and find email in slack users or return default username"""
-        u = None
-        for user in self.users:
-            if email == user.profile.get('email', ''):
-                u = '<@{}>'.format(user.uid)
-        if not u:
-            u = default
-        return u
+        user = self.users.by_email(email)
+        if user:
+            return '<@{}>'.format(user.uid)
+        return default
 
     def _add_reporter(self):
         """If the ticket has a reporter field, add to our attachment"""
@@ -251,11 +275,65 @@ class IssueLink(object):
                 self, e))
 
 
+class IssueStore(object):
+    """Persistent Jira issue store
+
+    Keeps the raw JSON of issues in a SQLite database together with the
+    issue's `updated` timestamp and the time it was last checked against
+    Jira, so a restarted bot starts with warm data."""
+
+    def __init__(self, path, logger=None):
+        self.logger = logger or logging.getLogger(self.__class__.__name__)
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS issues ('
+                'key TEXT PRIMARY KEY, updated TEXT, raw TEXT, checked REAL)')
+        self.logger.debug("Opened Jira issue store {}".format(path))
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.path)
+
+    def get(self, key):
+        """Return (raw, updated, checked) for issue `key` or None"""
+        with self._lock:
+            row = self._db.execute(
+                'SELECT raw, updated, checked FROM issues WHERE key = ?',
+                (key,)).fetchone()
+        if row:
+            return json.loads(row[0]), row[1], row[2]
+
+    def put(self, key, raw, updated):
+        """Store the raw JSON of issue `key`"""
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO issues VALUES (?, ?, ?, ?)',
+                (key, updated, json.dumps(raw), time.time()))
+
+    def touch(self, key):
+        """Record that issue `key` was just checked and is unchanged"""
+        with self._lock, self._db:
+            self._db.execute('UPDATE issues SET checked = ? WHERE key = ?',
+                             (time.time(), key))
+
+
 class JiraManager(object):
     """Jira Manager for issues
 
     Uses the python-jira dependency to manage issues and other settings of
-    jira."""
+    jira.
+
+    Issue keys Jira reports as missing or forbidden are kept in a separate,
+    bounded negative cache for `JIRA_INVALID_CACHE_TTL` seconds so repeated
+    mentions of them do not hit Jira again."""
+
+    #: Jira status codes that mean the issue key itself is unusable
+    invalid_status = (403, 404)
+
+    #: Errors raised when Jira can not be reached or refused by the breaker
+    unavailable = (CircuitOpen, requests.exceptions.RequestException)
 
     def __init__(self, cache, logger=None):
         self.logger = logger or logging.getLogger(self.__class__.__name__)
@@ -284,6 +362,26 @@ class JiraManager(object):
             'customfield_10003'
         ]
         self._jira = None
+        self.timeout = float(os.getenv('JIRA_TIMEOUT', 5))
+        self.breaker = CircuitBreaker('jira')
+        self.revalidate_after = int(os.getenv('JIRA_ISSUE_REVALIDATE', 60))
+        self.store_max_age = int(os.getenv('JIRA_ISSUE_STORE_MAX_AGE', 86400))
+        self.soft_ttl = int(os.getenv('JIRA_ISSUE_SOFT_TTL', 60))
+        self.hard_ttl = int(os.getenv('JIRA_ISSUE_HARD_TTL', 600))
+        self.flights = SingleFlight()
+        self._refresher = None
+        self._refreshing = set()
+        self._refresh_lock = threading.Lock()
+        self.epics = LRUCache(
+            max_entries=int(os.getenv('JIRA_EPIC_CACHE_SIZE', 1024)),
+            ttl=int(os.getenv('JIRA_EPIC_CACHE_TTL', 3600)))
+        self.invalid = LRUCache(
+            max_entries=int(os.getenv('JIRA_INVALID_CACHE_SIZE', 1024)),
+            ttl=int(os.getenv('JIRA_INVALID_CACHE_TTL', 300)))
+        self.store = None
+        store_path = os.getenv('JIRA_ISSUE_CACHE_PATH')
+        if store_path:
+            self.store = IssueStore(store_path)
         self.logger.debug("Loaded JiraManager for {}".format(self.server))
 
     def __repr__(self):
@@ -292,21 +390,371 @@ class JiraManager(object):
     def __str__(self):
         return 'Jira Manager'
 
+    def _cached(self, _id):
+        """Return issue `_id` from the cache or None
+
+        Issues older than the soft TTL are still returned, but a background
+        refresh is scheduled. After the hard TTL they are gone."""
+        key = 'jira.issue.{}'.format(_id)
+        if key not in self.cache:
+            return
+        issue, fetched = self.cache.get_value(key)
+        if time.time() - fetched > self.soft_ttl:
+            self.refresh(_id)
+        return issue
+
+    def _cache(self, _id, issue):
+        """Put issue `_id` in the cache"""
+        key = 'jira.issue.{}'.format(_id)
+        self.cache.set_value(key, (issue, time.time()),
+                             expiretime=self.hard_ttl)
+
+    def _invalidate(self, _id, status):
+        """Remember that issue `_id` does not exist or is forbidden"""
+        self.invalid.set(_id, status)
+        self.cache.remove_value('jira.issue.{}'.format(_id))
+        self.logger.debug('negative cache: {}'.format(self.invalid.stats))
+
+    def is_invalid(self, _id):
+        """Return True if issue `_id` is known to be missing or forbidden"""
+        return self.invalid.get(_id) is not None
+
+    def refresh(self, _id):
+        """Fetch issue `_id` again in the background
+
+        Only one refresh per issue is scheduled at a time."""
+        with self._refresh_lock:
+            if _id in self._refreshing:
+                return
+            self._refreshing.add(_id)
+            if not self._refresher:
+                self._refresher = ThreadPoolExecutor(max_workers=2)
+        self.logger.debug('refreshing stale issue {}'.format(_id))
+        future = self._refresher.submit(self._fetch, _id)
+        future.add_done_callback(lambda f: self._refreshing.discard(_id))
+        return future
+
+    def revalidate(self, ids):
+        """Check stored issues `ids` against Jira in the background
+
+        Issues that are already being refreshed are skipped, the rest are
+        checked together."""
+        with self._refresh_lock:
+            ids = [_id for _id in ids if _id not in self._refreshing]
+            if not ids:
+                return
+            self._refreshing.update(ids)
+            if not self._refresher:
+                self._refresher = ThreadPoolExecutor(max_workers=2)
+        self.logger.debug('revalidating stored issues {}'.format(ids))
+        future = self._refresher.submit(self._revalidate, ids)
+        future.add_done_callback(
+            lambda f: self._refreshing.difference_update(ids))
+        return future
+
+    def _revalidate(self, ids):
+        """Check stored issues `ids` and fetch the ones that changed"""
+        try:
+            found, changed = self._stored(ids, block=True)
+            if changed:
+                self._search_jira(changed)
+        except self.unavailable + (jira.exceptions.JIRAError,) as e:
+            self.logger.warning("could not revalidate issues {}: {}".format(
+                ids, e))
+
+    def _from_store(self, record):
+        """Return an Issue built from a stored record
+
+        Works without a Jira client so stored issues can be served while
+        Jira is unavailable."""
+        client = self._jira
+        if client:
+            return Issue(client._options, client._session, raw=record[0])
+        options = dict(JIRA.DEFAULT_OPTIONS, **self.options)
+        return Issue(options, None, raw=record[0])
+
+    def _call(self, method, *args, **kwargs):
+        """Call `method` of the Jira client through the circuit breaker
+
+        Jira errors other than server errors, e.g. a missing issue, mean
+        Jira is answering. Everything else raised, e.g. connection errors,
+        timeouts or an unparsable response, counts as a failure.
+
+        Raises:
+            CircuitOpen: If the breaker refuses the call.
+            requests.exceptions.RequestException: If Jira can't be reached.
+            jira.exceptions.JIRAError: If Jira returns an error.
+        """
+        if not self.breaker.allow():
+            raise CircuitOpen(self.breaker.name)
+        try:
+            client = self.jira
+            if client is None:
+                raise requests.exceptions.ConnectionError(
+                    'no connection to {}'.format(self.server))
+            result = getattr(client, method)(*args, **kwargs)
+        except requests.exceptions.RequestException:
+            self.breaker.failure()
+            raise
+        except jira.exceptions.JIRAError as e:
+            if isinstance(e.status_code, int) and e.status_code >= 500:
+                self.breaker.failure()
+            else:
+                self.breaker.success()
+            raise
+        except Exception:
+            self.breaker.failure()
+            raise
+        self.breaker.success()
+        return result
+
+    @property
+    def available(self):
+        """Return True unless recent calls to Jira failed"""
+        return self.breaker.healthy
+
+    def _save(self, _id, issue):
+        """Put issue `_id` in the cache and the persistent store"""
+        self._cache(_id, issue)
+        if self.store:
+            self.store.put(_id, issue.raw, issue.fields.updated)
+
+    def _stored(self, ids, block=False):
+        """Split `ids` by what the persistent store knows about them
+
+        Stored issues that were checked recently are returned as they are.
+        Stored issues due a check are returned as well and revalidated in
+        the background, so a restarted bot answers from warm data at once.
+        Only issues older than `store_max_age`, or every issue due a check
+        when `block` is set, are compared to Jira's `updated` field in one
+        request first and returned if unchanged. If Jira can't be asked they
+        are returned as they are.
+
+        Returns:
+            A tuple of a dict of issue id to issue, and the list of ids that
+            still have to be fetched from Jira.
+        """
+        found = {}
+        stale = {}
+        due = []
+        if not self.store:
+            return found, list(ids)
+
+        for _id in ids:
+            record = self.store.get(_id)
+            if not record:
+                continue
+            age = time.time() - record[2]
+            if age < self.revalidate_after:
+                found[_id] = self._from_store(record)
+            elif not block and age < self.store_max_age:
+                found[_id] = self._from_store(record)
+                due.append(_id)
+            else:
+                stale[_id] = record
+        if due:
+            self.revalidate(due)
+
+        try:
+            if len(stale) == 1:
+                _id = next(iter(stale))
+                current = [self._call('issue', _id, fields='updated')]
+            elif stale:
+                current = self._call(
+                    'search_issues', 'key in ({})'.format(','.join(stale)),
+                    maxResults=len(stale), validate_query=False,
+                    fields='updated')
+            else:
+                current = []
+        except self.unavailable as e:
+            self.logger.warning('serving stale stored issues {}: {}'.format(
+                list(stale), e))
+            current = []
+            for _id, record in stale.items():
+                found[_id] = self._from_store(record)
+        for issue in current:
+            record = stale.get(issue.key)
+            if record and record[1] == issue.fields.updated:
+                self.store.touch(issue.key)
+                found[issue.key] = self._from_store(record)
+
+        for _id, issue in found.items():
+            self._cache(_id, issue)
+        return found, [_id for _id in ids if _id not in found]
+
     def issue(self, _id):
         """Return a copy of the requested issue"""
-        key = 'jira.issue.{}'.format(_id)
-        if key in self.cache:
+        issue = self._cached(_id)
+        if issue:
             self.logger.debug('returning cached issue...')
-            return self.cache.get_value(key)
+            return issue
+        if self.is_invalid(_id):
+            self.logger.debug('issue {} is known to be invalid'.format(_id))
+            return
+        return self._fetch(_id)
 
+    def _fetch(self, _id):
+        """Fetch issue `_id`, sharing the request with concurrent fetches"""
+        return self.flights.do(('issue', _id), self._fetch_issue, _id)
+
+    def _fetch_issue(self, _id):
+        """Fetch issue `_id` from the store or Jira and cache it"""
         try:
-            f = ','.join(self.issue_fields)
-            issue = self.jira.issue(_id, fields=f)
-            self.cache.set_value(key, issue, expiretime=60)
-            return issue
+            found, missing = self._stored([_id])
+            if found:
+                self.logger.debug('returning stored issue...')
+                return found[_id]
+            return self._fetch_jira(_id)
+        except self.unavailable as e:
+            self.logger.warning("Jira unavailable for issue {}: {}".format(
+                _id, e))
+
+    def _fetch_jira(self, _id):
+        """Fetch and save issue `_id` with a single issue request
+
+        Jira follows moved and renamed issues here, so the issue returned
+        can have a different key than `_id`. Issues Jira reports as missing
+        or forbidden are negatively cached.
+
+        Returns:
+            The issue, or None if Jira returned an error for it.
+        """
+        try:
+            issue = self._call('issue', _id,
+                               fields=','.join(self.issue_fields))
         except jira.exceptions.JIRAError as e:
             self.logger.warning("Error retrieving issue {}: {}".format(
                 _id, e))
+            if e.status_code in self.invalid_status:
+                self._invalidate(_id, e.status_code)
+            return
+        self._save(_id, issue)
+        return issue
+
+    def issues(self, ids):
+        """Return the requested issues
+
+        Cached issues are served from the cache, all others are fetched with
+        a single JQL search. Issues known to be invalid are skipped.
+
+        Arguments:
+            ids (list): Jira issue ids
+
+        Returns:
+            An ordered dictionary of issue id to issue for every issue found.
+        """
+        found = OrderedDict()
+        missing = []
+        for _id in ids:
+            issue = self._cached(_id)
+            if issue:
+                found[_id] = issue
+            elif not self.is_invalid(_id):
+                missing.append(_id)
+
+        if len(missing) == 1:
+            issue = self.issue(missing[0])
+            if issue:
+                found[missing[0]] = issue
+        elif missing:
+            found.update(self.flights.do(('search', tuple(missing)),
+                                         self._search, missing))
+        return OrderedDict((_id, found[_id]) for _id in ids if _id in found)
+
+    def _search(self, ids):
+        """Fetch `ids` with one `key in (...)` JQL search
+
+        Issues in the persistent store are only fetched if they changed.
+
+        Returns:
+            A dict of issue id to issue for every issue found.
+        """
+        issues = {}
+        try:
+            found, missing = self._stored(ids)
+            issues.update(found)
+            if missing:
+                issues.update(self._search_jira(missing))
+        except self.unavailable as e:
+            self.logger.warning("Jira unavailable for issues {}: {}".format(
+                ids, e))
+        except jira.exceptions.JIRAError as e:
+            self.logger.warning("Error searching issues {}: {}".format(
+                ids, e))
+        return issues
+
+    def _search_jira(self, ids):
+        """Fetch and save `ids` with one JQL search
+
+        The search returns moved and renamed issues under their new key, so
+        every key it does not return is fetched on its own instead.
+
+        Returns:
+            A dict of issue id to issue for every issue found.
+        """
+        fetched = self._call(
+            'search_issues',
+            'key in ({})'.format(','.join(ids)),
+            maxResults=len(ids),
+            validate_query=False,
+            fields=','.join(self.issue_fields))
+        found = {}
+        for issue in fetched:
+            self._save(issue.key, issue)
+            found[issue.key] = issue
+        for _id in ids:
+            if _id not in found:
+                issue = self._fetch_jira(_id)
+                if issue:
+                    found[_id] = issue
+        return dict((_id, found[_id]) for _id in ids if _id in found)
+
+    def permalink(self, _id):
+        """Return the browse link of issue `_id`"""
+        return '{}/browse/{}'.format(self.server.rstrip('/'), _id)
+
+    def epic(self, _id):
+        """Return the summary of epic `_id`
+
+        Epic summaries are cached for a long time and only the summary field
+        is requested from Jira."""
+        summary = self.epics.get(_id)
+        if summary is not None:
+            return summary
+
+        try:
+            epic = self.flights.do(('epic', _id), self._call, 'issue', _id,
+                                   fields='summary')
+            summary = epic.fields.summary
+            self.epics.set(_id, summary)
+            return summary
+        except self.unavailable + (jira.exceptions.JIRAError,) as e:
+            self.logger.warning("Error retrieving epic {}: {}".format(
+                _id, e))
+
+    def prefetch_epics(self, ids):
+        """Load the summaries of epics `ids` into the epic cache
+
+        Epics that are not cached yet are fetched with one JQL search."""
+        missing = [_id for _id in OrderedDict.fromkeys(ids)
+                   if _id and _id not in self.epics]
+        if len(missing) == 1:
+            self.epic(missing[0])
+        elif missing:
+            try:
+                epics = self._call(
+                    'search_issues',
+                    'key in ({})'.format(','.join(missing)),
+                    maxResults=len(missing),
+                    validate_query=False,
+                    fields='summary')
+            except self.unavailable + (jira.exceptions.JIRAError,) as e:
+                self.logger.warning("Error retrieving epics {}: {}".format(
+                    missing, e))
+                return
+            for epic in epics:
+                self.epics.set(epic.key, epic.fields.summary)
+        self.logger.debug("epic cache: {}".format(self.epics.stats))
 
     @property
     def jira(self):
@@ -319,7 +767,8 @@ class JiraManager(object):
                 self.options,
                 basic_auth=(self.user, self.password),
                 async=True,
-                max_retries=1,
+                max_retries=0,
+                timeout=self.timeout,
             )
             return self._jira
         except requests.exceptions.ConnectionError as e:
@@ -341,7 +790,16 @@ class JiraManagement(object):
                            lock_dir='/tmp/slackbot.cache.d/{}'.format(
                                self.uuid), type='memory')
         self.key = os.getenv('JIRA_PROJECT_KEY', 'SDO')
+        self._pattern = None
+        self._pattern_key = None
         self.manager = JiraManager(self.cache)
+        self.renders = LRUCache(
+            max_entries=int(os.getenv('JIRA_RENDER_CACHE_SIZE', 512)),
+            ttl=self.manager.epics.ttl)
+        self.cooldown = CooldownLedger(
+            window=int(os.getenv('JIRA_LINK_COOLDOWN', 60)),
+            windows=self._channel_windows(
+                os.getenv('JIRA_LINK_COOLDOWN_CHANNELS', '')))
         self.logger.info('Loaded Jira Management Integration for {}'.format(
             self.message_type))
 
@@ -351,46 +809,128 @@ class JiraManagement(object):
     def __str__(self):
         return 'Jira Management Integration'
 
+    def _channel_windows(self, setting):
+        """Parse per channel cooldowns from 'CHANNEL:seconds,...'"""
+        windows = {}
+        for item in setting.split(','):
+            channel, _, seconds = item.partition(':')
+            try:
+                windows[channel.strip()] = int(seconds)
+            except ValueError:
+                if item.strip():
+                    self.logger.warning(
+                        'invalid channel cooldown {}'.format(item))
+        return windows
+
     def has_jira_key(self, text):
         """Check if the text contains the Jira project key"""
         if '{}-'.format(self.key) in text.upper():
             return True
 
+    @property
+    def pattern(self):
+        """Return the compiled issue id pattern for the project key"""
+        if self._pattern_key != self.key:
+            self._pattern = re.compile(
+                '{}-[0-9]+'.format(re.escape(self.key)), re.IGNORECASE)
+            self._pattern_key = self.key
+        return self._pattern
+
+    def extract_issue_ids(self, text):
+        """Extract every JIRA issue id from text
+
+        Returns:
+            A list of upper case issue ids in the order they were first
+            mentioned, without duplicates.
+        """
+        ids = OrderedDict()
+        for match in self.pattern.finditer(text):
+            ids[match.group(0).upper()] = True
+        return list(ids)
+
     def extract_issue_id(self, text):
         """Extract JIRA issue from text and return issue id."""
+        ids = self.extract_issue_ids(text)
+        if ids:
+            return ids[0]
         if self.has_jira_key(text):
-            pattern = '{}-[0-9]+'.format(self.key)
-            try:
-                found = re.search(pattern, text.upper()).group(0)
-                return found
-            except AttributeError:
-                self.logger.warning(
-                    "Jira key found in text, but could not extract")
+            self.logger.warning(
+                "Jira key found in text, but could not extract")
+
+    def render(self, issue):
+        """Return the Slack attachment for `issue`
+
+        Rendered attachments are cached by issue key, the issue's updated
+        timestamp and the user directory version, so an issue is only
+        rendered again once it or the known users change, or the epic cache
+        TTL passes. Attachments missing parts because Jira did not answer
+        are not cached."""
+        directory = self.bot.directory
+        key = (issue.key,
+               getattr(issue.fields, 'updated', None),
+               directory.version)
+        attachment = self.renders.get(key)
+        if attachment is None:
+            il = IssueLink(issue, jira=self.manager, users=directory)
+            attachment = il.attachment
+            if il.degraded:
+                self.logger.debug('not caching degraded render of {}'.format(
+                    issue.key))
+            else:
+                self.renders.set(key, attachment)
+        return attachment
 
     def post_issue_link(self, channel, user, text):
-        """If text contains an issue id, post a link to it."""
+        """If text contains issue ids, post links to them.
+
+        All issues found are posted together in one message. Issues that
+        could not be found are only reported while Jira is answering, so an
+        outage is not mistaken for invalid issue ids, and only when they are
+        first found to be invalid, not while they are negatively cached."""
         if not channel or not text:
             return
 
-        _id = self.extract_issue_id(text)
-        if _id:
-            issue = self.manager.issue(_id)
-            if issue:
-                key = 'jira.issue.link.{}'.format(issue.key)
-                if key in self.cache:
-                    self.logger.debug(
-                        'issue {} cooling off...'.format(issue.key))
-                    return
-                il = IssueLink(issue,
-                               jira=self.manager,
-                               users=self.bot.users)
-                print("ISSUE LINK: {}".format(il.attachment))
-                self.bot.post_message(channel, '', attachments=il.attachment)
-                self.cache.set_value(key, '', expiretime=60)
+        ids = []
+        for _id in self.extract_issue_ids(text):
+            if self.cooldown.cooling(channel, _id):
+                self.logger.debug('issue {} cooling off in {}...'.format(
+                    _id, channel))
             else:
-                message = "<@{}>, are you sure {} is a valid Jira issue? "\
-                    "I couldn't find it.".format(user, _id)
-                self.bot.post_message(channel, message)
+                ids.append(_id)
+        if not ids:
+            return
+
+        known_invalid = set(_id for _id in ids if self.manager.is_invalid(_id))
+        issues = self.manager.issues(ids)
+        if len(issues) > 1:
+            self.manager.prefetch_epics([
+                getattr(issue.fields, 'customfield_10751', None)
+                for issue in issues.values()])
+        if issues:
+            attachments = []
+            for issue in issues.values():
+                attachments.extend(self.render(issue))
+            self.logger.debug("ISSUE LINKS: {}".format(attachments))
+            self.bot.post_message(channel, '', attachments=attachments)
+            for _id in issues:
+                self.cooldown.start(channel, _id)
+
+        missing = [_id for _id in ids
+                   if _id not in issues and _id not in known_invalid]
+        if missing and not self.manager.available:
+            self.logger.warning('Jira unavailable, not reporting {}'.format(
+                missing))
+            return
+        for _id in missing:
+            self.cooldown.start(channel, _id)
+        if len(missing) == 1:
+            message = "<@{}>, are you sure {} is a valid Jira issue? "\
+                "I couldn't find it.".format(user, missing[0])
+            self.bot.post_message(channel, message)
+        elif missing:
+            message = "<@{}>, are you sure {} are valid Jira issues? "\
+                "I couldn't find them.".format(user, ', '.join(missing))
+            self.bot.post_message(channel, message)
 
     def update(self, event):
         """Update Jira Integration.
@@ -2,36 +2,123 @@
 
 This integration module provides channel support for all channels that
 EulerBot is listening in."""
+import asyncio
+import bisect
+import multiprocessing
 import re
 import logging
+import math
 import os
 import requests
 import string
 import spacy
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from eulerbot.breaker import CircuitBreaker
+from eulerbot.cache import SingleFlight
+from eulerbot.dispatcher import MicroBatcher
+from eulerbot.sessions import pooled_session
 
 
 class LanguageParser(object):
     """Language Parser
 
-    Object to parse and deal with Natural Language Processing."""
+    Object to parse and deal with Natural Language Processing.
+
+    With `SLACKBOT_SUPPORT_NLP_SLIM` set only the tagger and dependency
+    parser that `noun_chunks` needs are loaded, without the entity
+    recognizer or word vectors. Pair it with a small model such as
+    en_core_web_sm in `SLACKBOT_SUPPORT_NLP_MODEL` to save the most.
+
+    The model loads on first use, or ahead of time in a background thread
+    with `start_warm_up`."""
+
+    #: Text parsed once after loading so the first real parse is fast
+    warm_up_text = 'Can someone help me restart the web servers?'
+
     def __init__(self, logger=None):
         self.logger = logger or logging.getLogger(self.__class__.__name__)
         self._parser = None
         self._doc = None
+        self._load_lock = threading.Lock()
+        self._warm_up_thread = None
         self.model = os.environ.get('SLACKBOT_SUPPORT_NLP_MODEL',
                                     'en_core_web_md')
+        self.slim = os.environ.get('SLACKBOT_SUPPORT_NLP_SLIM', '').lower() \
+            in ('1', 'true', 'yes')
+        self.batch_size = int(
+            os.environ.get('SLACKBOT_SUPPORT_NLP_BATCH_SIZE', 32))
+        self.workers = int(os.environ.get('SLACKBOT_SUPPORT_NLP_WORKERS', 1))
         self.logger.info(
-            "Loaded LanguageParser with {} spacy model.".format(
-                self.model))
+            "Loaded LanguageParser with {} spacy model{}.".format(
+                self.model, ' (slim)' if self.slim else ''))
+
+    @property
+    def load_options(self):
+        """Return the spacy.load keyword arguments for the pipeline
+
+        spaCy 1.x takes the components to leave out as keywords, later
+        versions take a list of pipes to disable."""
+        if not self.slim:
+            return {}
+        if spacy.about.__version__.startswith('1.'):
+            return {'entity': False, 'matcher': False, 'add_vectors': False}
+        return {'disable': ['ner', 'textcat']}
+
+    @property
+    def pipe_options(self):
+        """Return the keyword arguments for the parser's pipe
+
+        spaCy before 2.2 parallelises `pipe` with threads (n_threads), later
+        versions with processes (n_process)."""
+        version = tuple(int(v) for v in
+                        spacy.about.__version__.split('.')[:2])
+        workers = 'n_process' if version >= (2, 2) else 'n_threads'
+        return {'batch_size': self.batch_size, workers: self.workers}
 
     @property
     def parser(self):
         """Load and return NLP parser"""
         if self._parser:
             return self._parser
-        self._parser = spacy.load(self.model)
+        with self._load_lock:
+            if self._parser is None:
+                self._parser = spacy.load(self.model, **self.load_options)
         return self._parser
 
+    @property
+    def ready(self):
+        """Return True once the model is loaded"""
+        return self._parser is not None
+
+    @property
+    def loading(self):
+        """Return True while a warm-up is loading the model"""
+        thread = self._warm_up_thread
+        return not self.ready and thread is not None and thread.is_alive()
+
+    def warm_up(self):
+        """Load the model and run a first parse"""
+        start = time.time()
+        try:
+            self.parser(self.warm_up_text)
+        except Exception as e:
+            self.logger.error("could not warm up spacy model {}: {}".format(
+                self.model, e))
+            return
+        self.logger.info("warmed up spacy model {} in {:.1f}s".format(
+            self.model, time.time() - start))
+
+    def start_warm_up(self):
+        """Warm up the model in a background thread"""
+        if self.ready or self.loading:
+            return
+        self._warm_up_thread = threading.Thread(
+            target=self.warm_up, name='nlp-warm-up', daemon=True)
+        self._warm_up_thread.start()
+
     @property
     def doc(self):
         """Return the parsed document."""
@@ -39,10 +126,35 @@ class LanguageParser(object):
 
     @doc.setter
     def doc(self, text):
-        """parse text and set the document."""
+        """parse text and set the document.
+
+        The document is kept on the instance for `subject()` and
+        `sobject()`; use `analyze` to parse without keeping any state."""
+        self._doc = self.parser(self.clean(text))
+
+    def analyze(self, text):
+        """Parse `text` and return its (subject, object)
+
+        Nothing is stored on the instance, so this is safe to call from
+        several threads at once and the document is freed once it returns.
+        """
+        doc = self.parser(self.clean(text))
+        return self.subject(doc), self.sobject(doc)
+
+    def clean(self, text):
+        """Return text without URLs and punctuation, ready to parse"""
         text = self.remove_urls(text)
-        text = self.remove_punctuation(text)
-        self._doc = self.parser(text)
+        return self.remove_punctuation(text)
+
+    def parse_many(self, texts):
+        """Parse `texts` together with the parser's pipe
+
+        Returns:
+            A list with a (subject, object) tuple per text.
+        """
+        docs = self.parser.pipe([self.clean(t) for t in texts],
+                                **self.pipe_options)
+        return [(self.subject(doc), self.sobject(doc)) for doc in docs]
 
     def remove_punctuation(self, text):
         """Strip punctuation from text and return."""
@@ -61,27 +173,30 @@ class LanguageParser(object):
         urls = re.findall(r"http\S+?(?=\||>)", text)
         return urls
 
-    def noun_chunks(self):
-        """Return noun chunks from parsed doc"""
-        if not self.doc:
+    def noun_chunks(self, doc=None):
+        """Return noun chunks from `doc` or the parsed doc"""
+        if doc is None:
+            doc = self.doc
+        if not doc:
             return []
-        return self.doc.noun_chunks
+        return doc.noun_chunks
 
-    def subject(self):
-        """Return the subject of the doc
+    def subject(self, doc=None):
+        """Return the subject of `doc` or the parsed doc
 
         If more than one subject is found, return the longest subject."""
         subject = set()
-        for word in self.noun_chunks():
+        for word in self.noun_chunks(doc):
             if word.root.dep_ == 'nsubj':
                 subject.add(word.text)
         if subject:
             return max(subject, key=len)
         return 'No subject found'
 
-    def sobject(self):
+    def sobject(self, doc=None):
+        """Return the longest object of `doc` or the parsed doc"""
         objects = set()
-        for word in self.noun_chunks():
+        for word in self.noun_chunks(doc):
             root = word.root.dep_
             if root == 'dobj' or root == 'pobj':
                 objects.add(word.text)
@@ -89,14 +204,163 @@ class LanguageParser(object):
             return max(objects, key=len)
 
 
+#: LanguageParser inherited by NLPPool worker processes when they fork
+_pool_parser = None
+
+
+def _pool_analyze(text):
+    """Return (subject, object) of `text`, run in an NLPPool worker"""
+    return _pool_parser.analyze(text)
+
+
+class NLPPool(object):
+    """Pool of worker processes sharing a preloaded language model
+
+    The model is loaded before the workers are forked, so they share its
+    memory copy-on-write instead of each loading their own copy. Texts are
+    sent to the workers and (subject, object) tuples come back, so parsing
+    uses more than one core and does not hold the bot's GIL.
+
+    Attributes:
+        nlp (:obj: `LanguageParser`): Parser whose model the workers use
+        processes (int): Number of worker processes
+        logger (:obj: `logger`, optional): An instance of a python logger
+    """
+    def __init__(self, nlp, processes=None, logger=None):
+        self.logger = logger or logging.getLogger(self.__class__.__name__)
+        if processes is None:
+            processes = os.environ.get('SLACKBOT_SUPPORT_NLP_PROCESSES', 2)
+        self.nlp = nlp
+        self.processes = int(processes)
+        self._executor = None
+        self._lock = threading.Lock()
+        self._warm_up_thread = None
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.__dict__)
+
+    @property
+    def ready(self):
+        """Return True once the workers are running"""
+        return self._executor is not None
+
+    @property
+    def loading(self):
+        """Return True while a warm-up is starting the workers"""
+        thread = self._warm_up_thread
+        return not self.ready and thread is not None and thread.is_alive()
+
+    def start(self):
+        """Load the model and fork the workers"""
+        global _pool_parser
+        with self._lock:
+            if self._executor:
+                return
+            start = time.time()
+            self.nlp.parser
+            _pool_parser = self.nlp
+            options = {}
+            if sys.version_info >= (3, 7):
+                options['mp_context'] = multiprocessing.get_context('fork')
+            executor = ProcessPoolExecutor(max_workers=self.processes,
+                                           **options)
+            warm = [executor.submit(_pool_analyze, self.nlp.warm_up_text)
+                    for i in range(self.processes)]
+            for future in warm:
+                future.result()
+            self._executor = executor
+            self.logger.info("started {} NLP workers in {:.1f}s".format(
+                self.processes, time.time() - start))
+
+    def start_warm_up(self):
+        """Start the workers in a background thread"""
+        if self.ready or self.loading:
+            return
+        self._warm_up_thread = threading.Thread(
+            target=self.start, name='nlp-pool-warm-up', daemon=True)
+        self._warm_up_thread.start()
+
+    def submit(self, text):
+        """Parse `text` in a worker
+
+        Returns:
+            A concurrent.futures.Future for the (subject, object) tuple.
+        """
+        if not self._executor:
+            self.start()
+        return self._executor.submit(_pool_analyze, text)
+
+    def shutdown(self):
+        """Stop the workers"""
+        with self._lock:
+            if self._executor:
+                self._executor.shutdown()
+                self._executor = None
+
+
+class OnCallTimeline(object):
+    """Interval index of who is on call when
+
+    The on-call periods are split at every handover into consecutive,
+    non-overlapping intervals, each with the participants on call for its
+    whole length, so finding who is on call at a time is a bisection.
+
+    Attributes:
+        start (float): Epoch seconds the timeline starts, None if empty
+        end (float): Epoch seconds the timeline ends, None if empty
+    """
+    def __init__(self, periods=()):
+        periods = list(periods)
+        self._bounds = sorted(set(t for p in periods for t in p[:2]))
+        self._on_call = []
+        for start, end in zip(self._bounds, self._bounds[1:]):
+            names = []
+            for p_start, p_end, name in periods:
+                if p_start <= start and p_end >= end and name not in names:
+                    names.append(name)
+            self._on_call.append(names)
+        self.start = self._bounds[0] if self._bounds else None
+        self.end = self._bounds[-1] if self._bounds else None
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.__dict__)
+
+    def __len__(self):
+        return len(self._on_call)
+
+    def covers(self, t):
+        """Return True if the timeline knows who is on call at `t`"""
+        return bool(self._bounds) and self.start <= t < self.end
+
+    def at(self, t):
+        """Return the participants on call at epoch seconds `t`"""
+        i = bisect.bisect_right(self._bounds, t) - 1
+        if 0 <= i < len(self._on_call):
+            return self._on_call[i]
+        return []
+
+
 class OpsGenieSchedule(object):
     """OpsGenieOnCall
 
-    Retrieve current schedule information from OpsGenie"""
+    Retrieve current schedule information from OpsGenie
+
+    Requests share a pooled keep-alive session, time out after
+    `OPSGENIE_TIMEOUT` seconds and go through a circuit breaker, so an
+    OpsGenie outage fails fast."""
     def __init__(self, logger=None):
         self.logger = logger or logging.getLogger(self.__class__.__name__)
         self.url = 'https://api.opsgenie.com/v1.1/json/schedule'
         self.apiKey = os.environ.get('OPSGENIE_API_KEY', '')
+        self.timeout = float(os.environ.get('OPSGENIE_TIMEOUT', 5))
+        self.breaker = CircuitBreaker('opsgenie')
+        self.session = pooled_session('opsgenie')
+        self.schedules = {}
+
+    @property
+    def available(self):
+        """Return True unless recent requests to OpsGenie failed"""
+        return self.breaker.healthy
 
     def _request(self, call, payload):
         """Retrieve call from the OpsGenie API."""
@@ -108,7 +372,21 @@ class OpsGenieSchedule(object):
             call, payload))
         url = "{}/{}".format(self.url, call)
         payload['apiKey'] = self.apiKey
-        r = requests.get(url, payload)
+        if not self.breaker.allow():
+            self.logger.warning('OpsGenie circuit open, skipping {}'.format(
+                call))
+            return
+        try:
+            r = self.session.get(url, params=payload, timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            self.breaker.failure()
+            self.logger.error('OpsGenie request {} failed: {}'.format(
+                call, e))
+            return
+        if r.status_code >= 500:
+            self.breaker.failure()
+        else:
+            self.breaker.success()
         if r.status_code == 200:
             return r.json()
 
@@ -118,19 +396,101 @@ class OpsGenieSchedule(object):
         if result:
             return result.get('oncalls')
 
+    def _index(self, result):
+        """Index a whoIsOnCall result by schedule name
+
+        Accepts the answer for every schedule ('oncalls') as well as the
+        answer for a single schedule ('oncall').
+
+        Returns:
+            A dictionary of schedule name to a list of participant names.
+        """
+        if not result:
+            return {}
+        schedules = result.get('oncalls')
+        if schedules is None:
+            schedule = result.get('oncall', result)
+            schedules = [schedule] if 'name' in schedule else []
+        index = {}
+        for schedule in schedules:
+            index[schedule.get('name')] = [
+                p.get('name', 'unknown')
+                for p in schedule.get('participants') or []]
+        return index
+
+    def team_on_calls(self, team):
+        """Return the participants on call for schedule `team`
+
+        Only the schedule of `team` is requested from OpsGenie. The result
+        is kept in `schedules`.
+
+        Returns:
+            A list of participant names, or None if the lookup failed.
+        """
+        index = self._index(self._request('whoIsOnCall', {'name': team}))
+        if team in index:
+            self.schedules[team] = index[team]
+        return index.get(team)
+
+    def timeline(self, team, hours):
+        """Return the on-call timeline of `team` for the next `hours`
+
+        The timeline API only takes whole days, weeks or months, so enough
+        days are requested and the periods are trimmed to `hours` here.
+
+        Returns:
+            An OnCallTimeline, or None if the lookup failed.
+        """
+        result = self._request('timeline', {
+            'name': team,
+            'intervalUnit': 'days',
+            'interval': int(math.ceil(hours / 24)),
+        })
+        if not result:
+            return
+        timeline = result.get('timeline', result)
+        start = timeline.get('startTime')
+        start = start / 1000 if start else time.time()
+        until = start + hours * 3600
+        final = timeline.get('finalSchedule') or {}
+        periods = []
+        for rotation in final.get('rotations') or []:
+            for period in rotation.get('periods') or []:
+                recipients = period.get('recipients')
+                if recipients is None and period.get('recipient'):
+                    recipients = [period.get('recipient')]
+                p_start = period.get('startTime') / 1000
+                p_end = min(period.get('endTime') / 1000, until)
+                if p_start >= p_end:
+                    continue
+                for recipient in recipients or []:
+                    periods.append((p_start, p_end,
+                                    recipient.get('name', 'unknown')))
+        self.logger.debug('{} on-call periods for {}'.format(
+            len(periods), team))
+        return OnCallTimeline(periods)
+
     def on_call(self, team):
         """Retrieve the current on-call for `team`"""
-        oncalls = self.on_calls()
-        email = 'unknown'
-        if oncalls:
-            for t in oncalls:
-                if t.get('name') == team:
-                    email = t.get('participants')[0].get('name', 'unknown')
-        return email
+        participants = self.team_on_calls(team)
+        if participants:
+            return participants[0]
+        return 'unknown'
 
 
 class ChannelSupport(object):
-    """Provide infrastructure engineering support for active channels."""
+    """Provide infrastructure engineering support for active channels.
+
+    Each channel is routed to an OpsGenie schedule with
+    `OPSGENIE_CHANNEL_SCHEDULES` ('CHANNEL:schedule,...'), other channels
+    use `OPSGENIE_ONCALL_SCHEDULE`.
+
+    The on-call engineer is looked up in timelines of the next
+    `OPSGENIE_TIMELINE_HOURS` hours. A background thread refreshes the
+    timelines of all routed schedules in one cycle,
+    `OPSGENIE_TIMELINE_MARGIN` seconds before the first of them runs out.
+    The thread is started with the bot. Until a schedule's timeline arrives
+    its current on-call is asked for directly."""
 
     def __init__(self, bot, message_type, logger=None):
         self.logger = logger or logging.getLogger(__name__)
@@ -138,6 +498,32 @@ class ChannelSupport(object):
         self.message_type = message_type
         self.ogschedule = OpsGenieSchedule()
         self.nlp = LanguageParser()
+        self.pool = None
+        processes = int(os.environ.get('SLACKBOT_SUPPORT_NLP_PROCESSES', 0))
+        if processes > 0:
+            self.pool = NLPPool(self.nlp, processes)
+        self.batcher = None
+        window = float(os.environ.get('SLACKBOT_SUPPORT_NLP_BATCH_WINDOW', 0))
+        if window > 0:
+            self.batcher = MicroBatcher(self.nlp.parse_many,
+                                        window=window / 1000,
+                                        max_batch=self.nlp.batch_size)
+        self.flights = SingleFlight()
+        self.last_on_calls = {}
+        self.schedule = os.environ.get('OPSGENIE_ONCALL_SCHEDULE',
+                                       'OpsEng_OnCall_Pri')
+        self.routes = self._channel_schedules(
+            os.environ.get('OPSGENIE_CHANNEL_SCHEDULES', ''))
+        self.timelines = {}
+        self.timeline_hours = int(
+            os.environ.get('OPSGENIE_TIMELINE_HOURS', 24))
+        self.timeline_margin = int(
+            os.environ.get('OPSGENIE_TIMELINE_MARGIN', 3600))
+        self.timeline_retry = int(
+            os.environ.get('OPSGENIE_TIMELINE_RETRY', 60))
+        self._timeline_thread = None
+        self._timeline_lock = threading.Lock()
+        self._timeline_stop = threading.Event()
         self.events_received = 0
         self.events_processed = 0
         self.trigger_words = [
@@ -157,23 +543,148 @@ class ChannelSupport(object):
     def __str__(self):
         return 'Channel Support Integration'
 
-    def on_call(self):
-        """Return the current on-call engineer"""
+    def start(self):
+        """Start the background on-call timeline refresh"""
+        self.start_timeline()
+
+    def warm_up(self):
+        """Load the language model, or start the NLP pool, in the
+        background"""
+        if self.pool:
+            self.pool.start_warm_up()
+        else:
+            self.nlp.start_warm_up()
+
+    @property
+    def nlp_loading(self):
+        """Return True while the language model is warming up"""
+        return self.nlp.loading or bool(self.pool and self.pool.loading)
+
+    def _channel_schedules(self, setting):
+        """Parse channel routes from 'CHANNEL:schedule,...'"""
+        routes = {}
+        for item in setting.split(','):
+            channel, _, schedule = item.partition(':')
+            if channel.strip() and schedule.strip():
+                routes[channel.strip()] = schedule.strip()
+            elif item.strip():
+                self.logger.warning(
+                    'invalid channel schedule {}'.format(item))
+        return routes
+
+    def schedule_for(self, channel):
+        """Return the OpsGenie schedule that supports `channel`"""
+        return self.routes.get(channel, self.schedule)
+
+    @property
+    def teams(self):
+        """Return every routed schedule"""
+        return sorted(set(self.routes.values()) | {self.schedule})
+
+    def on_call(self, channel=None):
+        """Return the current on-call engineer for `channel`
+
+        The timeline refresh is restarted here if it is not running."""
+        self.start_timeline()
+        team = self.schedule_for(channel)
+        timeline = self.timelines.get(team)
+        now = time.time()
+        if timeline and timeline.covers(now):
+            participants = timeline.at(now)
+            if participants:
+                u = self._slack_id(participants[0])
+                self.last_on_calls[team] = u
+                return u
+
         key = 'og.schedule.oncall'
+        if team != self.schedule:
+            key = '{}.{}'.format(key, team)
         if key in self.bot.cache:
             return self.bot.cache.get_value(key)
+        return self.flights.do(key, self._lookup_on_call, key, team)
+
+    def start_timeline(self):
+        """Start the background timeline refresh if it is not running"""
+        if self.timeline_hours < 1:
+            return
+        with self._timeline_lock:
+            if self._timeline_thread and self._timeline_thread.is_alive():
+                return
+            self._timeline_stop.clear()
+            self._timeline_thread = threading.Thread(
+                target=self._refresh_timeline_loop, name='oncall-timeline',
+                daemon=True)
+            self._timeline_thread.start()
+
+    def stop_timeline(self):
+        """Stop the background timeline refresh"""
+        self._timeline_stop.set()
+        if self._timeline_thread:
+            self._timeline_thread.join()
+
+    def refresh_timelines(self):
+        """Fetch the timelines of every routed schedule
+
+        The new timelines replace the map in one step. A schedule whose
+        timeline could not be fetched keeps its previous one.
+
+        Returns:
+            True if every timeline was fetched.
+        """
+        timelines = dict(self.timelines)
+        complete = True
+        for team in self.teams:
+            timeline = self.ogschedule.timeline(team, self.timeline_hours)
+            if timeline is not None:
+                timelines[team] = timeline
+            else:
+                complete = False
+        self.timelines = timelines
+        return complete
+
+    def _refresh_timeline_loop(self):
+        """Refresh the timelines before they run out until stopped"""
+        while not self._timeline_stop.is_set():
+            try:
+                complete = self.refresh_timelines()
+            except Exception as e:
+                self.logger.error('on-call timeline refresh failed: '
+                                  '{}'.format(e))
+                complete = False
+            wait = self.timeline_retry
+            ends = [t.end for t in self.timelines.values() if t.end]
+            if complete and ends:
+                wait = max(min(ends) - self.timeline_margin - time.time(),
+                           self.timeline_retry)
+            self.logger.debug('next on-call timeline refresh in {:.0f}s'
+                              .format(wait))
+            self._timeline_stop.wait(wait)
+
+    def _slack_id(self, email):
+        """Return the Slack uid of `email`, or the email if not a user"""
+        user = self.bot.directory.by_email(email)
+        if user:
+            self.logger.debug("On Call email {} matches {} email".format(
+                email, user.name))
+            return user.uid
+        return email
 
-        email = self.ogschedule.on_call('OpsEng_OnCall_Pri')
+    def _lookup_on_call(self, key, team):
+        """Look up the on-call engineer of `team` in OpsGenie and cache it
+
+        If OpsGenie is unavailable the last known on-call is used and the
+        lookup is retried after a minute."""
+        email = self.ogschedule.on_call(team)
+        last = self.last_on_calls.get(team)
+        if not self.ogschedule.available and last:
+            self.logger.warning("OpsGenie unavailable, using last known "
+                                "on-call {}".format(last))
+            self.bot.cache.set_value(key, last, expiretime=60)
+            return last
         self.logger.debug("on-call email: {}".format(email))
-        u = None
-        for user in self.bot.users:
-            if email == user.profile.get('email', ''):
-                self.logger.debug("On Call email {} matches {} email".format(
-                    email, user.name))
-                u = user.uid
-        if not u:
-            u = email
+        u = self._slack_id(email)
         self.bot.cache.set_value(key, u, expiretime=300)
+        self.last_on_calls[team] = u
         return u
 
     def has_trigger_word(self, text):
@@ -182,17 +693,37 @@ class ChannelSupport(object):
             return any(trigger in text for trigger in self.trigger_words)
 
     def parse_query(self, text):
-        """Parse the text and return a tuple of subject, objects"""
-        self.nlp.doc = text
-        subject = self.nlp.subject()
-        obj = self.nlp.sobject()
+        """Parse the text and return a tuple of subject, objects
+
+        With `SLACKBOT_SUPPORT_NLP_PROCESSES` set the text is parsed in the
+        NLP worker pool. With `SLACKBOT_SUPPORT_NLP_BATCH_WINDOW`
+        (milliseconds) set, texts arriving within the window are parsed
+        together in one batch. `dispatch` hands texts over as they arrive,
+        so a burst of requests shares one batch."""
+        if self.pool:
+            subject, obj = self.pool.submit(text).result()
+        elif self.batcher:
+            subject, obj = self.batcher.submit(text).result()
+        else:
+            subject, obj = self.nlp.analyze(text)
         self.logger.debug('Subject: {} -> {}'.format(subject, obj))
         return (subject, obj)
 
-    def generate_response(self, text):
-        """Generate a help response"""
-        subject, obj = self.parse_query(text)
-        hitman = self.on_call()
+    def generate_response(self, text, channel=None):
+        """Generate a help response
+
+        While the language model is still warming up the text is not parsed
+        and the plain response is sent right away."""
+        obj = None
+        if self.nlp_loading:
+            self.logger.info('language model still loading, skipping parse')
+        else:
+            subject, obj = self.parse_query(text)
+        return self.compose_response(obj, channel)
+
+    def compose_response(self, obj, channel=None):
+        """Return the help response for the parsed object `obj`"""
+        hitman = self.on_call(channel)
         if obj:
             return "Our hitman, [<@{}>] is guaranteed to eliminate _{}_ " \
                 "problem(s)".format(hitman, obj)
@@ -209,8 +740,77 @@ class ChannelSupport(object):
         if not text:
             return
         if self.has_trigger_word(text):
-            response = "<@{}>, {}".format(
-                event.get('user'), self.generate_response(text))
-            self.logger.debug(response)
-            self.bot.post_message(event.get('channel'), response)
+            self.post_response(
+                event, self.generate_response(text, event.get('channel')))
         self.events_processed += 1
+
+    def post_response(self, event, response):
+        """Post `response` to the user and channel of `event`"""
+        response = "<@{}>, {}".format(event.get('user'), response)
+        self.logger.debug(response)
+        self.bot.post_message(event.get('channel'), response)
+
+    def _respond(self, event, obj):
+        """Compose and post the response for a parsed `event`"""
+        self.post_response(
+            event, self.compose_response(obj, event.get('channel')))
+
+    def _answer(self, event, parsed):
+        """Answer a help request once `parsed` has its (subject, object)
+
+        Runs on the channel's dispatcher worker, so answers keep the order
+        the requests arrived in even though they are parsed elsewhere."""
+        self.events_received += 1
+        subject, obj = parsed.result()
+        self.logger.debug('Subject: {} -> {}'.format(subject, obj))
+        self._respond(event, obj)
+        self.events_processed += 1
+
+    def parse_later(self, text):
+        """Start parsing `text` away from the dispatcher
+
+        Returns:
+            A concurrent.futures.Future for the (subject, object) of `text`
+            from the NLP pool or batcher, or None if it is parsed by
+            `update` on the dispatcher.
+        """
+        if self.pool:
+            if self.pool.ready:
+                return self.pool.submit(text)
+            self.pool.start_warm_up()
+            return None
+        if self.batcher and not self.nlp_loading:
+            return self.batcher.submit(text)
+
+    def dispatch(self, event, block=True):
+        """Queue the update for `event` on the bot's dispatcher
+
+        Help requests are handed to the NLP pool or batcher as they arrive,
+        so a burst of requests is parsed together, and the channel's place
+        on the dispatcher is taken at the same time to answer them in order
+        once parsed. Everything else, including requests arriving while the
+        pool starts, runs `update` on the dispatcher.
+
+        Arguments:
+            event (dict): Slack message event
+            block (bool): Wait for room in a full dispatcher queue
+
+        Returns:
+            A concurrent.futures.Future for the queued update.
+        """
+        dispatcher = self.bot.dispatcher
+        submit = dispatcher.submit if block else dispatcher.submit_nowait
+        channel = event.get('channel')
+        parsed = None
+        if self.has_trigger_word(event.get('text')):
+            parsed = self.parse_later(event.get('text'))
+        if parsed is None:
+            return submit(channel, self.update, event)
+        return submit(channel, self._answer, event, parsed)
+
+    @asyncio.coroutine
+    def async_update(self, event):
+        """Update Integration without blocking the event loop
+
+        The update is queued with `dispatch` and awaited."""
+        yield from asyncio.wrap_future(self.dispatch(event, block=False))
@@ -0,0 +1,60 @@
+"""HTTP Sessions
+
+Shared keep-alive HTTP sessions with connection pools and retries, so calls
+to the same API reuse their TCP and TLS connections."""
+import logging
+import os
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+
+def pooled_session(name, pool_connections=None, pool_maxsize=None,
+                   retries=None, backoff=None):
+    """Return a requests Session with a pooled, retrying adapter
+
+    Settings are read from `<NAME>_POOL_CONNECTIONS`, `<NAME>_POOL_SIZE`,
+    `<NAME>_RETRIES` and `<NAME>_RETRY_BACKOFF` when not passed in.
+
+    Connection errors are retried for every method. 502, 503 and 504
+    responses are only retried for idempotent methods, so a POST is never
+    sent twice. Read errors are never retried, so a request that times out
+    takes no longer than the caller's timeout.
+
+    Arguments:
+        name (str): Name of the API, used as the environment prefix
+        pool_connections (int): Number of hosts to keep pools for
+        pool_maxsize (int): Maximum connections kept per host
+        retries (int): Number of retries per request
+        backoff (float): Retry backoff factor in seconds
+
+    Returns:
+        A requests.Session.
+    """
+    prefix = name.upper()
+    if pool_connections is None:
+        pool_connections = os.environ.get(
+            '{}_POOL_CONNECTIONS'.format(prefix), 4)
+    if pool_maxsize is None:
+        pool_maxsize = os.environ.get('{}_POOL_SIZE'.format(prefix), 10)
+    if retries is None:
+        retries = os.environ.get('{}_RETRIES'.format(prefix), 2)
+    if backoff is None:
+        backoff = os.environ.get('{}_RETRY_BACKOFF'.format(prefix), 0.2)
+
+    retry = Retry(total=int(retries),
+                  read=0,
+                  backoff_factor=float(backoff),
+                  status_forcelist=(502, 503, 504),
+                  raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=int(pool_connections),
+                          pool_maxsize=int(pool_maxsize),
+                          max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    logger.debug('created {} session with {} connections per host'.format(
+        name, pool_maxsize))
+    return session
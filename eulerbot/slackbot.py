@@ -1,28 +1,43 @@
 """SlackBot generic slack bot
 
 This module contains components necessary for a basic Slack Bot."""
+import json
 import logging
 import os
+import threading
+import time
 import uuid
 from beaker.cache import Cache
 from slackclient import SlackClient
+from slackclient._slackrequest import SlackRequest
+from eulerbot.cache import LRUCache, SingleFlight
+from eulerbot.sessions import pooled_session
+
+logger = logging.getLogger(__name__)
 
 
 class SlackUser(object):
     """Representation of a Slack User
 
-    This class is used as a data structure to represent an individual user
-    connected to Slack."""
+    This class is used as a compact data structure to represent an individual
+    user connected to Slack. Only the profile fields named in `profile_fields`
+    (SLACKBOT_USER_PROFILE_FIELDS) are kept from the Slack profile."""
 
-    def __init__(self, logger=None):
-        self.logger = logger or logging.getLogger(__name__)
+    __slots__ = ('uid', 'admin', 'name', 'username', '_profile')
+    profile_fields = tuple(
+        os.environ.get('SLACKBOT_USER_PROFILE_FIELDS',
+                       'email,real_name').split(','))
+
+    def __init__(self):
         self.uid = None
         self.admin = False
         self.name = None
+        self.username = None
         self._profile = {}
 
     def __repr__(self):
-        return '%s(%r)' % (self.__class__.__name__, self.__dict__)
+        return '%s(%r)' % (self.__class__.__name__, {
+            attr: getattr(self, attr) for attr in self.__slots__})
 
     def __str__(self):
         return '(%s, %s)' % (self.uid, self.name)
@@ -36,13 +51,184 @@ class SlackUser(object):
     def profile(self, user_profile):
         """Set the users profile
 
-        If the SlackUser has been passed a valid profile, then set it."""
+        If the SlackUser has been passed a valid profile, then keep the
+        projected profile fields."""
         if isinstance(user_profile, dict):
-            self._profile = user_profile
+            self._profile = {field: user_profile[field]
+                             for field in self.profile_fields
+                             if field in user_profile}
         else:
-            self.logger.warning("could not set profile for {}."
-                                " The profile passed was not valid: {}".format(
-                                    self.name, user_profile))
+            logger.warning("could not set profile for {}."
+                           " The profile passed was not valid: {}".format(
+                               self.name, user_profile))
+
+
+class SlackAPIError(Exception):
+    """Raised when a Slack API call needed as a whole fails."""
+    pass
+
+
+class PooledSlackRequest(SlackRequest):
+    """Slack Web API requester using a shared pooled session
+
+    slackclient posts every Web API call with a bare `requests.post`, which
+    opens a new connection each time. This requester sends the same request
+    through `session` so connections to Slack are kept alive and reused.
+
+    Attributes:
+        session (:obj: `requests.Session`): Session used for every call
+        retry_after (dict): Seconds Slack asked to wait, per rate limited
+            API method
+    """
+    def __init__(self, session):
+        super().__init__()
+        self.session = session
+        self.retry_after = {}
+
+    def do(self, token, request="?", post_data=None, domain="slack.com",
+           timeout=None):
+        """Perform a POST request to the Slack Web API
+
+        Arguments:
+            token (str): Slack authentication token
+            request (str): Slack API method, e.g. 'channels.list'
+            post_data (dict): Arguments of the API method
+            domain (str): Domain to send the request to
+            timeout (float): Seconds to wait for a response
+
+        Returns:
+            The requests.Response of the call.
+        """
+        post_data = post_data or {}
+        files = None
+        if request == 'files.upload' and 'file' in post_data:
+            files = {'file': post_data.pop('file')}
+
+        for k, v in post_data.items():
+            if not isinstance(v, str):
+                post_data[k] = json.dumps(v)
+
+        url = 'https://{}/api/{}'.format(domain, request)
+        post_data['token'] = token
+        headers = {'user-agent': self.get_user_agent()}
+        response = self.session.post(url, headers=headers, data=post_data,
+                                     files=files, timeout=timeout)
+        if response.status_code == 429:
+            try:
+                self.retry_after[request] = float(
+                    response.headers.get('Retry-After', 1))
+            except ValueError:
+                self.retry_after[request] = 1.0
+        return response
+
+
+class UserDirectory(object):
+    """Indexed collection of SlackUsers
+
+    Keeps hash indexes of users by uid, email and name so that lookups do not
+    need to scan every known user. The indexes are rebuilt as a whole each
+    time the directory is refreshed, and patched one user at a time from
+    Slack events in between.
+
+    Attributes:
+        version (int): Incremented every time the directory changes
+        logger (:obj: `logger`, optional): An instance of a python logger
+    """
+
+    def __init__(self, users=None, logger=None):
+        self.logger = logger or logging.getLogger(self.__class__.__name__)
+        self.version = 0
+        self._by_uid = {}
+        self._by_email = {}
+        self._by_name = {}
+        if users:
+            self.rebuild(users)
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.__dict__)
+
+    def __len__(self):
+        return len(self._by_uid)
+
+    def __iter__(self):
+        return iter(list(self._by_uid.values()))
+
+    def __contains__(self, uid):
+        return uid in self._by_uid
+
+    def _index(self, user, by_uid, by_email, by_name):
+        """Add `user` to the passed indexes"""
+        by_uid[user.uid] = user
+        email = user.profile.get('email')
+        if email:
+            by_email[email] = user
+        for name in (user.name, user.username):
+            if name:
+                by_name[name] = user
+
+    def _unindex(self, user):
+        """Remove index entries that point to `user`"""
+        if self._by_uid.get(user.uid) is user:
+            del self._by_uid[user.uid]
+        email = user.profile.get('email')
+        if email and self._by_email.get(email) is user:
+            del self._by_email[email]
+        for name in (user.name, user.username):
+            if name and self._by_name.get(name) is user:
+                del self._by_name[name]
+
+    def rebuild(self, users):
+        """Replace the directory with `users` and rebuild the indexes
+
+        Arguments:
+            users (list): SlackUser objects
+        """
+        by_uid = {}
+        by_email = {}
+        by_name = {}
+        for user in users:
+            self._index(user, by_uid, by_email, by_name)
+        self._by_uid = by_uid
+        self._by_email = by_email
+        self._by_name = by_name
+        self.version += 1
+        self.logger.debug("indexed {} users".format(len(by_uid)))
+
+    def _identity(self, user):
+        """Return the indexed attributes of `user`"""
+        return (user.uid, user.profile.get('email'), user.name,
+                user.username)
+
+    def upsert(self, user):
+        """Add `user` to the directory, replacing any user with its uid
+
+        The version only changes if an indexed attribute changed, Slack
+        sends user_change for every status update."""
+        old = self._by_uid.get(user.uid)
+        if old:
+            self._unindex(old)
+        self._index(user, self._by_uid, self._by_email, self._by_name)
+        if not old or self._identity(old) != self._identity(user):
+            self.version += 1
+
+    def remove(self, uid):
+        """Remove the user with Slack id `uid` from the directory"""
+        user = self._by_uid.get(uid)
+        if user:
+            self._unindex(user)
+            self.version += 1
+
+    def by_uid(self, uid):
+        """Return the SlackUser with Slack id `uid` or None"""
+        return self._by_uid.get(uid)
+
+    def by_email(self, email):
+        """Return the SlackUser with profile email `email` or None"""
+        return self._by_email.get(email)
+
+    def by_name(self, name):
+        """Return the SlackUser with real name or user name `name` or None"""
+        return self._by_name.get(name)
 
 
 class SlackBot(object):
@@ -55,8 +241,27 @@ class SlackBot(object):
         name (str): The name of the bot
         token (str): Slack Bot Token
         sc (:obj: `slackclient`): SlackClient instance
+        api_cache (:obj: `LRUCache`): Cache of Slack API results
         logger (:obj: `logger', optional): An instance of a python logger
     """
+
+    #: Seconds the results of an API method are cached. Only these read
+    #: methods are cached, every other method may change state and is always
+    #: sent to Slack.
+    api_cache_ttl = {
+        'users.list': 3600,
+        'users.info': 600,
+        'users.lookupByEmail': 600,
+        'im.list': 600,
+        'channels.list': 600,
+        'channels.info': 600,
+        'groups.list': 600,
+        'groups.info': 600,
+        'team.info': 3600,
+        'bots.info': 3600,
+        'emoji.list': 3600,
+    }
+
     def __init__(self, logger=None):
         self.name = os.environ.get('SLACKBOT_BOT_NAME', 'SlackBot')
         self.token = os.environ.get('SLACKBOT_TOKEN')
@@ -66,10 +271,26 @@ class SlackBot(object):
         self.cache = Cache('slackbot-{}'.format(self.uuid),
                            lock_dir='/tmp/slackbot.cache.d/{}'.format(
                                self.uuid), type='memory')
-        self.expiretime = 120
         self.cache.clear()
-        self._users = []
+        self.api_cache = LRUCache(
+            max_entries=int(os.environ.get('SLACKBOT_API_CACHE_ENTRIES',
+                                           256)),
+            max_bytes=int(os.environ.get('SLACKBOT_API_CACHE_BYTES',
+                                         32 * 2 ** 20)))
+        self.api_flights = SingleFlight()
+        self._users_loaded = False
+        self._users_requested = False
+        self._directory = UserDirectory()
+        self.user_resync = int(os.environ.get('SLACKBOT_USER_RESYNC', 3600))
+        self.user_retry = int(os.environ.get('SLACKBOT_USER_RETRY', 60))
+        self.user_page_size = 200
+        self.user_page_retries = int(
+            os.environ.get('SLACKBOT_USER_PAGE_RETRIES', 3))
+        self._resync_lock = threading.Lock()
+        self._resync_thread = None
         self.sc = SlackClient(self.token)
+        self.sc.server.api_requester = PooledSlackRequest(
+            pooled_session('slackbot'))
         self.logger.debug("SlackBot initialized as {}".format(self.name))
 
     def __repr__(self):
@@ -78,11 +299,22 @@ class SlackBot(object):
     def __str__(self):
         return '%s (%s)' % (self.name, self.uid)
 
+    def _api_ttl(self, method):
+        """Return the number of seconds to cache results of `method`"""
+        return self.api_cache_ttl.get(method, 0)
+
+    def _api_key(self, method, kwargs):
+        """Return the cache key for `method` called with `kwargs`"""
+        args = {k: v for k, v in kwargs.items() if k != 'Cache'}
+        return 'slackclient.api.{}:{}'.format(
+            method, json.dumps(args, sort_keys=True, default=str))
+
     def _api_method(self, method, **kwargs):
         """Call method of slackclient
 
-        All methods are cached for self.cache_refresh time Cache=False is
-        passed.
+        Successful results are cached per method and arguments for the
+        method's TTL (see `api_cache_ttl`) unless Cache=False is passed.
+        Concurrent cache misses for the same call share one request.
 
         Arguments:
             method (str): method of the SlackClient API to call
@@ -91,67 +323,236 @@ class SlackBot(object):
         Returns:
             A dictionary representation of the JSON output from the API call.
         """
-        key = 'slackclient.api.{}'.format(method)
-        should_cache = kwargs.get('Cache', True)
-        if key in self.cache and should_cache:
-            self.logger.debug('{} api call is cached, returning the cached'
-                              ' data'.format(key))
-            return self.cache.get_value(key)
+        ttl = self._api_ttl(method)
+        should_cache = kwargs.get('Cache', True) and ttl > 0
+        if should_cache:
+            key = self._api_key(method, kwargs)
+            result = self.api_cache.get(key)
+            if result is not None:
+                self.logger.debug('{} api call is cached, returning the cached'
+                                  ' data'.format(key))
+                return result
 
-        result = self.sc.api_call(method, **kwargs)
+        if should_cache:
+            result = self.api_flights.do(key, self.sc.api_call, method,
+                                         **kwargs)
+        else:
+            result = self.sc.api_call(method, **kwargs)
         self.logger.debug("SlackClient API Call: {}".format(method))
         self.logger.debug("API Results: {}".format(result))
         if result.get('ok'):
-            self.cache.set_value(key, result, expiretime=self.expiretime)
+            if should_cache:
+                self.api_cache.set(key, result, ttl=ttl)
             return result
         return {}
 
     @property
     def uid(self):
-        """Return the slack UID of the SlackBot"""
+        """Return the slack UID of the SlackBot
+
+        The id Slack reports for the bot when the RTM session starts is used
+        when there is one. Otherwise the bot is looked up by name, first
+        exactly and then as any user whose user name contains the bot's
+        name."""
         key = 'slackbot.uid'
         if key in self.cache:
             return self.cache.get_value(key)
         self.logger.info("{} UID is unknown, trying to find".format(self.name))
-        for user in self.slack_users():
-            if self.name in user.get('name'):
-                self._uid = user.get('id')
-                self.cache.set_value(key, self._uid)
+        uid = self._login_uid() or self._find_uid()
+        if uid:
+            self._uid = uid
+            self.cache.set_value(key, self._uid)
+        else:
+            self.logger.error("could not find the UID of {}, the bot's own "
+                              "messages will not be ignored".format(self.name))
         return self._uid
 
+    def _login_uid(self):
+        """Return the bot's id from the RTM login data, if connected"""
+        login_data = getattr(self.sc.server, 'login_data', None)
+        if isinstance(login_data, dict):
+            return (login_data.get('self') or {}).get('id')
+
+    def _find_uid(self):
+        """Return the uid of the user named like the bot, or None"""
+        user = self.directory.by_name(self.name)
+        if user:
+            return user.uid
+        uid = None
+        for user in self.directory:
+            if user.username and self.name in user.username:
+                uid = user.uid
+        return uid
+
+    @property
+    def directory(self):
+        """Return the indexed UserDirectory of all known slack users
+
+        The users are loaded from Slack on first use and kept up to date from
+        RTM events with `update_user`. After `user_resync` seconds, or
+        `user_retry` seconds after a failed load, a full resync is started in
+        the background and the current directory is returned. Only the first
+        load waits for Slack."""
+        if 'slackbot.users' not in self.cache:
+            if not self._users_requested:
+                self.logger.debug('no users loaded, requesting from slack')
+            self.resync_users(background=self._users_requested)
+        return self._directory
+
     @property
     def users(self):
         """Slack user list.
 
-        Return or generate a list of all known slack users as SlackUser
-        objects."""
-        self.logger.info("Retrieving all SlackBots known users")
-        key = 'slackbot.users'
-        if key in self.cache:
-            self.logger.debug('returning cached value for {}'.format(key))
-            return self._users
-        self.logger.debug('no valid cache data, requesting from slack')
-        del self._users[:]
-        users = self.slack_users()
-        for user in users:
-            u = SlackUser()
-            u.uid = user.get('id')
-            u.profile = user.get('profile')
-            if u.profile:
-                u.name = u.profile.get('real_name', u.uid)
+        Return a list of all known slack users as SlackUser objects, taken
+        from the user directory."""
+        return list(self.directory)
+
+    def _make_user(self, member):
+        """Return a SlackUser from a users.list member"""
+        u = SlackUser()
+        u.uid = member.get('id')
+        u.profile = member.get('profile')
+        if u.profile:
+            u.name = u.profile.get('real_name', u.uid)
+        else:
+            u.name = member.get('real_name', u.uid)
+        u.username = member.get('name')
+        u.admin = member.get('is_admin')
+        return u
+
+    def resync_users(self, background=False):
+        """Reload every user from Slack and rebuild the user directory
+
+        Only one resync runs at a time. If any page of users fails, or Slack
+        returns no users, the current users are kept.
+
+        Arguments:
+            background (bool): run the resync in a background thread
+        """
+        if not self._resync_lock.acquire(blocking=False):
+            self.logger.debug('user resync already running')
+            return
+        if background:
+            self._resync_thread = threading.Thread(
+                target=self._resync_users, name='slackbot-user-resync',
+                daemon=True)
+            self._resync_thread.start()
+        else:
+            self._resync_users()
+
+    def _resync_users(self):
+        """Reload every user from Slack, the resync lock must be held
+
+        A failed resync is retried after `user_retry` seconds."""
+        try:
+            self._users_requested = True
+            self.logger.info("Retrieving all SlackBots known users")
+            users = []
+            try:
+                for member in self.iter_slack_users():
+                    if not member.get('deleted'):
+                        users.append(self._make_user(member))
+            except SlackAPIError as e:
+                self.logger.warning("user resync failed, keeping {} known "
+                                    "users: {}".format(len(self._directory),
+                                                       e))
+                users = []
+            if users:
+                self._directory.rebuild(users)
+                self._users_loaded = True
+                self.cache.set_value('slackbot.users', '',
+                                     expiretime=self.user_resync)
+                self.logger.debug('loaded {} users'.format(len(users)))
             else:
-                u.name = user.get('real_name', u.uid)
-            u.admin = user.get('is_admin')
-            self.logger.debug('Created {} user'.format(u))
-            self._users.append(u)
-        self.cache.set_value(key, '', expiretime=60)
-        return self._users
+                self.cache.set_value('slackbot.users', '',
+                                     expiretime=self.user_retry)
+        finally:
+            self._resync_lock.release()
+
+    def update_user(self, member):
+        """Add, update or remove a single user
+
+        Used to apply team_join and user_change events without reloading
+        every user. Deleted users are removed. Events received before the
+        users are first loaded are ignored, the load will include them.
+
+        Arguments:
+            member (dict): user object as returned by users.list
+        """
+        if not isinstance(member, dict) or not member.get('id'):
+            return
+        if not self._users_loaded:
+            return
+        uid = member.get('id')
+        if member.get('deleted'):
+            self.logger.debug('removing deactivated user {}'.format(uid))
+            self._directory.remove(uid)
+        else:
+            user = self._make_user(member)
+            self.logger.debug('updating user {}'.format(user))
+            self._directory.upsert(user)
+
+    def _retry_after(self, method):
+        """Return the seconds Slack asked to wait before calling `method`"""
+        retry_after = getattr(self.sc.server.api_requester, 'retry_after',
+                              None)
+        if isinstance(retry_after, dict):
+            return retry_after.pop(method, 1.0)
+        return 1.0
+
+    def _users_page(self, **kwargs):
+        """Return one users.list page
+
+        A rate limited page is retried after the wait Slack asked for, up to
+        `user_page_retries` times.
+
+        Raises:
+            SlackAPIError: If the page could not be loaded.
+        """
+        for attempt in range(self.user_page_retries + 1):
+            result = self.sc.api_call("users.list", **kwargs)
+            self.logger.debug("SlackClient API Call: users.list")
+            if result.get('ok'):
+                return result
+            error = result.get('error')
+            if error != 'ratelimited' or attempt == self.user_page_retries:
+                break
+            wait = self._retry_after('users.list')
+            self.logger.info("users.list is rate limited, retrying in "
+                             "{}s".format(wait))
+            time.sleep(wait)
+        raise SlackAPIError('users.list failed: {}'.format(error))
+
+    def iter_slack_users(self):
+        """Yield data for all known slack users
+
+        users.list is requested one cursor page at a time.
+
+        Raises:
+            SlackAPIError: If a page could not be loaded.
+        """
+        cursor = None
+        while True:
+            kwargs = {'limit': self.user_page_size}
+            if cursor:
+                kwargs['cursor'] = cursor
+            result = self._users_page(**kwargs)
+            for member in result.get('members', []):
+                yield member
+            metadata = result.get('response_metadata') or {}
+            next_cursor = metadata.get('next_cursor')
+            if not isinstance(next_cursor, str) or next_cursor in ('', cursor):
+                return
+            cursor = next_cursor
 
     def slack_users(self):
         """Return data for all known slack users"""
         self.logger.debug('Asking slack for all known users.')
-        result = self._api_method("users.list")
-        return result.get('members', [])
+        try:
+            return list(self.iter_slack_users())
+        except SlackAPIError as e:
+            self.logger.warning(e)
+            return []
 
     def post_message(self, tid, text, **kwargs):
         """Post a message to a channel or user.
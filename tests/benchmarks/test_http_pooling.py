@@ -0,0 +1,79 @@
+"""HTTP connection pooling benchmark
+
+Compare the latency of cold requests, each opening a new connection, with
+requests sent through a pooled keep-alive session, against a local stub
+HTTP server."""
+import json
+import pytest
+import requests
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from eulerbot.sessions import pooled_session
+
+pytestmark = [pytest.mark.benchmark, pytest.mark.slow]
+
+REQUESTS = 200
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answer every GET with a small JSON document over HTTP/1.1."""
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    body = json.dumps({'oncalls': []}).encode('utf-8')
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    connections = 0
+
+
+@pytest.fixture(scope='module')
+def Stub():
+    """Run the stub server on a free local port."""
+    server = StubServer(('127.0.0.1', 0), StubHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def measure(Stub, get):
+    """Return (seconds per request, connections opened) for `get`."""
+    url = 'http://127.0.0.1:{}/whoIsOnCall'.format(Stub.server_address[1])
+    connections = Stub.connections
+    start = time.perf_counter()
+    for i in range(REQUESTS):
+        assert get(url, timeout=5).status_code == 200
+    elapsed = time.perf_counter() - start
+    return elapsed / REQUESTS, Stub.connections - connections
+
+
+def test_pooled_session_reuses_connections(Stub):
+    """Report and compare cold and pooled request latency."""
+    cold, cold_connections = measure(Stub, requests.get)
+    session = pooled_session('benchmark')
+    pooled, pooled_connections = measure(Stub, session.get)
+    print("\n{} requests: cold {:.2f} ms/req ({} connections), pooled "
+          "{:.2f} ms/req ({} connections)".format(
+              REQUESTS, cold * 1000, cold_connections, pooled * 1000,
+              pooled_connections))
+    assert cold_connections == REQUESTS
+    assert pooled_connections == 1
+    assert pooled < cold
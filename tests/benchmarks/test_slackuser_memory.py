@@ -0,0 +1,77 @@
+"""SlackUser memory benchmark
+
+Compare the memory held by SlackUser objects for a large organisation with
+the previous dict based layout that kept the whole Slack profile."""
+import copy
+import logging
+import pytest
+import tracemalloc
+import testing_data as TD
+import eulerbot.slackbot
+
+pytestmark = [pytest.mark.benchmark, pytest.mark.slow]
+
+MEMBERS = 50000
+
+
+class DictSlackUser(object):
+    """SlackUser as it was before it was slotted and projected."""
+    def __init__(self, logger=None):
+        self.logger = logger or logging.getLogger(__name__)
+        self.uid = None
+        self.admin = False
+        self.name = None
+        self._profile = {}
+
+
+@pytest.fixture(scope='module')
+def Members():
+    """Return the user list test data scaled up to MEMBERS users."""
+    template = TD.slackbot.get('user_list')['members']
+    members = []
+    for i in range(MEMBERS):
+        member = copy.deepcopy(template[i % len(template)])
+        member['id'] = 'U{:08d}'.format(i)
+        member['name'] = 'user{}'.format(i)
+        member['profile']['email'] = 'user{}@dom'.format(i)
+        member['profile']['real_name'] = 'User {}'.format(i)
+        members.append(member)
+    return members
+
+
+def build_dict_users(members):
+    users = []
+    for member in members:
+        u = DictSlackUser()
+        u.uid = member.get('id')
+        u._profile = member.get('profile')
+        u.name = u._profile.get('real_name', u.uid)
+        u.admin = member.get('is_admin')
+        users.append(u)
+    return users
+
+
+def build_slotted_users(members):
+    bot = eulerbot.slackbot.SlackBot()
+    return [bot._make_user(member) for member in members]
+
+
+def measure(build, members):
+    """Return the bytes still allocated by the objects `build` returns."""
+    tracemalloc.start()
+    snapshot = tracemalloc.take_snapshot()
+    users = build(copy.deepcopy(members))
+    size = sum(stat.size_diff for stat in
+               tracemalloc.take_snapshot().compare_to(snapshot, 'filename'))
+    tracemalloc.stop()
+    assert len(users) == len(members)
+    return size
+
+
+def test_slotted_users_use_less_memory(Members):
+    """Report and compare SlackUser memory for MEMBERS users."""
+    before = measure(build_dict_users, Members)
+    after = measure(build_slotted_users, Members)
+    print("\n{} users: dict layout {:.1f} MiB, slotted {:.1f} MiB".format(
+        MEMBERS, before / 2 ** 20, after / 2 ** 20))
+    assert after < before / 2
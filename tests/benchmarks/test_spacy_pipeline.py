@@ -0,0 +1,101 @@
+"""spaCy pipeline benchmark
+
+Report load time, resident memory and per document parse latency of the
+LanguageParser for the full and the slim pipeline over the support text
+blobs. Every configuration runs in its own interpreter so its memory is
+measured in isolation."""
+import importlib.util
+import json
+import os
+import pytest
+import subprocess
+import sys
+import time
+from eulerbot.integrations.support import LanguageParser
+
+pytestmark = [pytest.mark.benchmark, pytest.mark.slow, pytest.mark.spacy]
+
+CONFIGURATIONS = [
+    ('en_core_web_md', False),
+    ('en_core_web_md', True),
+    ('en_core_web_sm', True),
+]
+
+SCRIPT = '''
+import json
+import resource
+import time
+import spacy
+from eulerbot.integrations.support import LanguageParser
+
+def rss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+with open('tests/data/support_text_blobs.txt') as f:
+    blobs = [line.strip() for line in f if line.strip()]
+
+before = rss()
+start = time.perf_counter()
+lp = LanguageParser()
+lp.parser
+load = time.perf_counter() - start
+loaded = rss()
+
+start = time.perf_counter()
+for blob in blobs:
+    lp.analyze(blob)
+parse = (time.perf_counter() - start) / len(blobs)
+print(json.dumps({'load': load, 'rss': loaded - before, 'parse': parse}))
+'''
+
+
+def model_installed(model):
+    """Return True if the spacy model package `model` is installed."""
+    return importlib.util.find_spec(model) is not None
+
+
+def run(model, slim):
+    """Return the measurements of one configuration."""
+    env = dict(os.environ, SLACKBOT_SUPPORT_NLP_MODEL=model,
+               SLACKBOT_SUPPORT_NLP_SLIM='true' if slim else '')
+    out = subprocess.check_output([sys.executable, '-c', SCRIPT], env=env)
+    return json.loads(out.decode('utf-8').strip().splitlines()[-1])
+
+
+@pytest.mark.parametrize("model, slim", CONFIGURATIONS,
+                         ids=['md full', 'md slim', 'sm slim'])
+def test_pipeline_configuration(model, slim):
+    """Report the cost of loading and using one pipeline configuration."""
+    if not model_installed(model):
+        pytest.skip('spacy model {} is not installed'.format(model))
+    r = run(model, slim)
+    print("\n{} {}: load {:.2f}s, rss {:.0f} MiB, parse {:.2f} ms/doc".format(
+        model, 'slim' if slim else 'full', r['load'], r['rss'] / 2 ** 20,
+        r['parse'] * 1000))
+    assert r['parse'] > 0
+
+
+BURST = 10
+
+
+@pytest.mark.parametrize("model", ['en_core_web_sm', 'en_core_web_md'])
+def test_batched_parsing_throughput(model, monkeypatch):
+    """Report one by one against batched parsing of a burst of requests."""
+    if not model_installed(model):
+        pytest.skip('spacy model {} is not installed'.format(model))
+    monkeypatch.setenv('SLACKBOT_SUPPORT_NLP_MODEL', model)
+    with open('tests/data/support_text_blobs.txt') as f:
+        blobs = [line.strip() for line in f if line.strip()] * BURST
+    lp = LanguageParser()
+    lp.warm_up()
+
+    start = time.perf_counter()
+    single = [lp.analyze(blob) for blob in blobs]
+    one_by_one = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batched = lp.parse_many(blobs)
+    together = time.perf_counter() - start
+    print("\n{} x{}: one by one {:.0f} docs/s, batched {:.0f} docs/s".format(
+        model, len(blobs), len(blobs) / one_by_one, len(blobs) / together))
+    assert batched == single
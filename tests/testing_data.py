@@ -67,6 +67,8 @@ SupportChannel = {
             'tests/data/opsgenie_oncall.json'),
         'error': load_json(
             'tests/data/opsgenie_oncall_error.json'),
+        'timeline': load_json(
+            'tests/data/opsgenie_timeline.json'),
     },
 }
 
@@ -149,6 +151,7 @@ class MockIssueLink(object):
         self.issue = issue
         self.jira = jira
         self.users = users
+        self.degraded = False
 
     @property
     def attachment(self):
@@ -0,0 +1,86 @@
+"""Circuit breaker unit tests
+
+Test the circuit breaker protecting Jira and OpsGenie."""
+import pytest
+import time
+from eulerbot.breaker import CircuitBreaker, CircuitOpen
+
+pytestmark = pytest.mark.breaker
+
+
+def fail():
+    raise ValueError('boom')
+
+
+@pytest.fixture
+def CB():
+    """Return a breaker that opens after two failures."""
+    return CircuitBreaker('testing', failures=2, reset_timeout=10)
+
+
+@pytest.mark.parametrize("var, attr, value", [
+    ('TESTING_BREAKER_FAILURES', 'failures', 3),
+    ('TESTING_BREAKER_RESET', 'reset_timeout', 1.5),
+])
+def test_environment_configures_breaker(monkeypatch, var, attr, value):
+    """Test that the breaker is configurable from the environment."""
+    monkeypatch.setenv(var, str(value))
+    assert getattr(CircuitBreaker('testing'), attr) == value
+
+
+def test_breaker_opens_after_consecutive_failures(CB):
+    """Test that the circuit opens and refuses calls."""
+    for i in range(2):
+        with pytest.raises(ValueError):
+            CB.call(fail)
+    assert CB.state == CB.OPEN
+    with pytest.raises(CircuitOpen):
+        CB.call(lambda: 'ok')
+    assert CB.rejected == 1
+    assert CB.opened == 1
+
+
+def test_success_resets_failures(CB):
+    """Test that only consecutive failures open the circuit."""
+    with pytest.raises(ValueError):
+        CB.call(fail)
+    assert not CB.healthy
+    assert CB.call(lambda: 'ok') == 'ok'
+    assert CB.healthy
+    with pytest.raises(ValueError):
+        CB.call(fail)
+    assert CB.state == CB.CLOSED
+
+
+def test_half_open_allows_one_probe(CB, monkeypatch):
+    """Test that an open circuit lets a single probe through."""
+    CB.failure()
+    CB.failure()
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 11)
+    assert CB.state == CB.HALF_OPEN
+    assert CB.allow()
+    assert not CB.allow()
+
+
+def test_successful_probe_closes_circuit(CB, monkeypatch):
+    """Test that a successful probe closes the circuit."""
+    CB.failure()
+    CB.failure()
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 11)
+    assert CB.call(lambda: 'ok') == 'ok'
+    assert CB.state == CB.CLOSED
+    assert CB.healthy
+
+
+def test_failed_probe_opens_circuit_again(CB, monkeypatch):
+    """Test that a failed probe opens the circuit for another timeout."""
+    CB.failure()
+    CB.failure()
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 11)
+    with pytest.raises(ValueError):
+        CB.call(fail)
+    assert CB.state == CB.OPEN
+    assert CB.opened == 2
@@ -0,0 +1,173 @@
+"""Cache unit tests
+
+Test the in-memory caching helpers."""
+import pytest
+import threading
+import time
+from eulerbot.cache import (CooldownLedger, LRUCache, SingleFlight,
+                            approximate_size)
+
+pytestmark = pytest.mark.cache
+
+
+def test_lru_cache_get_and_set():
+    """Test that cached values are returned and counted."""
+    c = LRUCache()
+    assert c.get('a') is None
+    c.set('a', 1)
+    assert c.get('a') == 1
+    assert 'a' in c
+    assert c.hits == 1
+    assert c.misses == 1
+
+
+def test_lru_cache_default():
+    """Test that get returns the default for missing keys."""
+    assert LRUCache().get('a', 'default') == 'default'
+
+
+def test_lru_cache_expiry(monkeypatch):
+    """Test that entries expire after their ttl."""
+    now = time.time()
+    c = LRUCache(ttl=10)
+    c.set('a', 1)
+    c.set('b', 2, ttl=100)
+    monkeypatch.setattr(time, 'time', lambda: now + 11)
+    assert 'a' not in c
+    assert c.get('a') is None
+    assert c.get('b') == 2
+
+
+def test_lru_cache_evicts_least_recently_used():
+    """Test that the least recently used entry is evicted first."""
+    c = LRUCache(max_entries=2)
+    c.set('a', 1)
+    c.set('b', 2)
+    c.get('a')
+    c.set('c', 3)
+    assert 'b' not in c
+    assert 'a' in c
+    assert 'c' in c
+    assert c.evictions == 1
+
+
+def test_lru_cache_respects_memory_cap():
+    """Test that entries are evicted to stay under max_bytes."""
+    c = LRUCache(max_bytes=approximate_size('x' * 1000) * 2)
+    for key in 'abcd':
+        c.set(key, key * 1000)
+    assert len(c) == 2
+    assert c.size <= c.max_bytes
+    assert 'd' in c
+
+
+def test_lru_cache_remove_and_clear():
+    """Test that entries can be removed."""
+    c = LRUCache(max_bytes=1024)
+    c.set('a', 1)
+    c.set('b', 2)
+    c.remove('a')
+    c.remove('missing')
+    assert 'a' not in c
+    c.clear()
+    assert len(c) == 0
+    assert c.stats['bytes'] == 0
+
+
+def test_approximate_size_counts_contents():
+    """Test that nested containers are counted."""
+    flat = approximate_size({})
+    nested = approximate_size({'key': ['value' * 100]})
+    assert nested > flat + 500
+
+
+def test_cooldown_ledger_is_scoped():
+    """Test that cooldowns are tracked per scope and key."""
+    c = CooldownLedger(window=60)
+    assert not c.cooling('C1', 'TID-1')
+    c.start('C1', 'TID-1')
+    assert c.cooling('C1', 'TID-1')
+    assert not c.cooling('C2', 'TID-1')
+    assert not c.cooling('C1', 'TID-2')
+
+
+def test_cooldown_ledger_windows(monkeypatch):
+    """Test that cooldowns expire and windows can be set per scope."""
+    now = time.time()
+    c = CooldownLedger(window=60, windows={'C2': 300, 'C3': 0})
+    for scope in ('C1', 'C2', 'C3'):
+        c.start(scope, 'TID-1')
+    assert not c.cooling('C3', 'TID-1')
+    monkeypatch.setattr(time, 'time', lambda: now + 61)
+    assert not c.cooling('C1', 'TID-1')
+    assert c.cooling('C2', 'TID-1')
+
+
+def concurrent_calls(flight, key, fn, count):
+    """Call flight.do from `count` threads and return their results."""
+    results = []
+    threads = [threading.Thread(
+        target=lambda: results.append(flight.do(key, fn)))
+        for i in range(count)]
+    for t in threads:
+        t.start()
+    return threads, results
+
+
+def test_single_flight_shares_in_flight_call():
+    """Test that concurrent calls for one key share one call."""
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        release.wait(5)
+        return 'result'
+
+    threads, results = concurrent_calls(flight, 'key', fetch, 5)
+    while flight.shared < 4:
+        time.sleep(0.01)
+    release.set()
+    for t in threads:
+        t.join()
+    assert results == ['result'] * 5
+    assert len(calls) == 1
+    assert not flight._calls
+
+
+def test_single_flight_shares_exceptions():
+    """Test that waiting callers see the leader's exception."""
+    flight = SingleFlight()
+    release = threading.Event()
+    errors = []
+
+    def fetch():
+        release.wait(5)
+        raise ValueError('boom')
+
+    def call():
+        try:
+            flight.do('key', fetch)
+        except ValueError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for i in range(3)]
+    for t in threads:
+        t.start()
+    while flight.shared < 2:
+        time.sleep(0.01)
+    release.set()
+    for t in threads:
+        t.join()
+    assert len(errors) == 3
+
+
+def test_single_flight_sequential_calls_are_not_shared():
+    """Test that a finished call is not reused."""
+    flight = SingleFlight()
+    calls = []
+    for i in range(3):
+        flight.do('key', calls.append, i)
+    assert calls == [0, 1, 2]
+    assert flight.shared == 0
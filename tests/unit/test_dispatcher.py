@@ -0,0 +1,177 @@
+"""Dispatcher unit tests
+
+Test the partitioned worker pool used to run integrations."""
+import pytest
+import threading
+import time
+from eulerbot.dispatcher import Dispatcher, DispatchQueueFull, MicroBatcher
+
+pytestmark = pytest.mark.dispatcher
+
+
+@pytest.fixture
+def D():
+    """Return a small dispatcher and shut it down afterwards."""
+    d = Dispatcher(workers=2, queue_size=10, timeout=1)
+    yield d
+    d.shutdown()
+
+
+@pytest.mark.parametrize("var, attr, value", [
+    ('EULERBOT_DISPATCH_WORKERS', 'workers', 8),
+    ('EULERBOT_DISPATCH_QUEUE_SIZE', 'queue_size', 5),
+    ('EULERBOT_DISPATCH_TIMEOUT', 'timeout', 0.5),
+])
+def test_environment_configures_dispatcher(monkeypatch, var, attr, value):
+    """Test that the dispatcher is configurable from the environment."""
+    monkeypatch.setenv(var, str(value))
+    assert getattr(Dispatcher(), attr) == value
+
+
+def test_submit_returns_result(D):
+    """Test that submitted work resolves its future."""
+    assert D.submit('C1', lambda a, b: a + b, 1, 2).result(timeout=1) == 3
+
+
+def test_submit_propagates_exceptions(D):
+    """Test that exceptions are set on the future, not raised."""
+    def fail():
+        raise ValueError('boom')
+    future = D.submit('C1', fail)
+    with pytest.raises(ValueError):
+        future.result(timeout=1)
+
+
+def test_work_is_ordered_per_key(D):
+    """Test that work for the same key runs in submission order."""
+    seen = []
+    for i in range(50):
+        D.submit('C1', seen.append, i)
+    D.join()
+    assert seen == list(range(50))
+
+
+def test_slow_key_does_not_block_other_keys():
+    """Test that a blocked channel does not hold up another channel."""
+    d = Dispatcher(workers=2, queue_size=10, timeout=1)
+    release = threading.Event()
+    keys = ['a', 'b']
+    while hash(keys[0]) % 2 == hash(keys[1]) % 2:
+        keys[1] += 'b'
+    d.submit(keys[0], release.wait, 5)
+    assert d.submit(keys[1], lambda: 'done').result(timeout=1) == 'done'
+    release.set()
+    d.shutdown()
+
+
+def test_full_queue_drops_work():
+    """Test that work is dropped once a worker queue is full."""
+    d = Dispatcher(workers=1, queue_size=1, timeout=0.01)
+    release = threading.Event()
+    started = threading.Event()
+
+    def block():
+        started.set()
+        release.wait(5)
+
+    d.submit('C1', block)
+    started.wait(1)
+    d.submit('C1', lambda: None)
+    future = d.submit('C1', lambda: None)
+    with pytest.raises(DispatchQueueFull):
+        future.result(timeout=1)
+    assert d.dropped == 1
+    release.set()
+    d.shutdown()
+
+
+def test_submit_nowait_does_not_wait_for_room():
+    """Test that a full queue drops non-blocking work immediately."""
+    d = Dispatcher(workers=1, queue_size=1, timeout=5)
+    release = threading.Event()
+    started = threading.Event()
+
+    def block():
+        started.set()
+        release.wait(5)
+
+    d.submit_nowait('C1', block)
+    started.wait(1)
+    d.submit_nowait('C1', lambda: None)
+    start = time.time()
+    future = d.submit_nowait('C1', lambda: None)
+    assert time.time() - start < 1
+    with pytest.raises(DispatchQueueFull):
+        future.result(timeout=1)
+    assert d.dropped == 1
+    release.set()
+    d.shutdown()
+
+
+def test_zero_workers_runs_inline():
+    """Test that a dispatcher without workers runs work immediately."""
+    d = Dispatcher(workers=0)
+    seen = []
+    d.submit('C1', seen.append, 1)
+    assert seen == [1]
+    assert not d._threads
+
+
+@pytest.fixture
+def MB():
+    """Return a micro batcher that upper cases its items."""
+    calls = []
+
+    def upper(items):
+        calls.append(items)
+        return [item.upper() for item in items]
+
+    b = MicroBatcher(upper, window=0.2, max_batch=3)
+    b.calls = calls
+    yield b
+    b.shutdown()
+
+
+def test_micro_batcher_groups_items_in_window(MB):
+    """Test that items submitted together are processed as one batch."""
+    futures = [MB.submit(item) for item in ('a', 'b')]
+    assert [f.result(timeout=1) for f in futures] == ['A', 'B']
+    assert MB.calls == [['a', 'b']]
+    assert MB.batches == 1
+    assert MB.processed == 2
+
+
+def test_micro_batcher_respects_max_batch(MB):
+    """Test that a full batch is processed without waiting."""
+    futures = [MB.submit(item) for item in 'abcde']
+    assert ''.join(f.result(timeout=1) for f in futures) == 'ABCDE'
+    assert MB.calls == [['a', 'b', 'c'], ['d', 'e']]
+
+
+def test_micro_batcher_failure_reaches_every_item():
+    """Test that a failed batch fails every item's future."""
+    def fail(items):
+        raise ValueError('boom')
+    b = MicroBatcher(fail, window=0.05)
+    futures = [b.submit(i) for i in range(2)]
+    for future in futures:
+        with pytest.raises(ValueError):
+            future.result(timeout=1)
+    b.shutdown()
+
+
+def test_micro_batcher_checks_result_count():
+    """Test that a batch function dropping results is an error."""
+    b = MicroBatcher(lambda items: items[1:], window=0.05)
+    futures = [b.submit(i) for i in range(2)]
+    with pytest.raises(ValueError):
+        futures[0].result(timeout=1)
+    b.shutdown()
+
+
+def test_micro_batcher_shutdown_processes_pending(MB):
+    """Test that shutdown finishes queued work."""
+    future = MB.submit('z')
+    MB.shutdown()
+    assert future.result(timeout=0) == 'Z'
+    assert MB._thread is None
@@ -1,9 +1,13 @@
 """Support Integration Tests
 
 Unit test the support integration module."""
+import asyncio
 import pytest
 import testing_data as TD
-from eulerbot.integrations.support import ChannelSupport
+import threading
+import time
+from eulerbot.integrations.support import ChannelSupport, OnCallTimeline
+from concurrent.futures import Future
 from unittest.mock import MagicMock
 
 pytestmark = pytest.mark.support_integration
@@ -18,7 +22,9 @@ def Module(MockEulerBot):
     cs.nlp._parser = MagicMock(autospec=True)
     cs.ogschedule.on_call = MagicMock(autospec=True)
     cs.ogschedule.on_call.return_value = 'testinggoat@slack.com'
-    return cs
+    cs.ogschedule.timeline = MagicMock(autospec=True, return_value=None)
+    yield cs
+    cs.stop_timeline()
 
 
 @pytest.mark.parametrize("word, boolean", TD.SupportChannel.get('word_bag'))
@@ -53,11 +59,172 @@ def test_oncall_caches_value(Module):
     Module.ogschedule.on_call.call_count == 1
 
 
+def test_oncall_uses_last_known_during_outage(Module):
+    """Test that the last known on-call is used when OpsGenie is down."""
+    Module.ogschedule.on_call.return_value = 'citest'
+    Module.on_call()
+    Module.bot.cache.remove_value('og.schedule.oncall')
+    Module.ogschedule.on_call.return_value = 'unknown'
+    Module.ogschedule.breaker.failure()
+    assert Module.on_call() == 'citest'
+
+
+def set_timeline(Module, periods, team=None):
+    """Give `team`, or the default schedule, a timeline of `periods`"""
+    timeline = OnCallTimeline(periods)
+    Module.timelines[team or Module.schedule] = timeline
+    return timeline
+
+
+def test_oncall_uses_timeline(Module):
+    """Test that a covering timeline answers without asking OpsGenie."""
+    now = time.time()
+    set_timeline(Module, [(now - 60, now + 60, 'citest')])
+    assert Module.on_call() == 'citest'
+    assert Module.ogschedule.on_call.call_count == 0
+
+
+def test_oncall_timeline_handover_is_exact(Module, monkeypatch):
+    """Test that the on-call changes at the handover, not on expiry."""
+    now = time.time()
+    set_timeline(Module, [(now - 60, now + 60, 'first'),
+                          (now + 60, now + 120, 'second')])
+    assert Module.on_call() == 'first'
+    monkeypatch.setattr(time, 'time', lambda: now + 60)
+    assert Module.on_call() == 'second'
+
+
+def test_oncall_falls_back_without_timeline(Module):
+    """Test that an expired timeline falls back to whoIsOnCall."""
+    now = time.time()
+    set_timeline(Module, [(now - 120, now - 60, 'old')])
+    assert Module.on_call() == 'testinggoat@slack.com'
+    Module.ogschedule.on_call.assert_called_once_with(Module.schedule)
+
+
+def test_start_fetches_timeline_before_any_request(Module):
+    """Test that starting the integration loads the timelines."""
+    ready = threading.Event()
+    Module.ogschedule.timeline.side_effect = lambda *a: ready.set()
+    Module.start()
+    assert ready.wait(5)
+    Module.ogschedule.timeline.assert_called_with(Module.schedule,
+                                                  Module.timeline_hours)
+    assert Module.ogschedule.on_call.call_count == 0
+
+
+def test_oncall_starts_timeline_refresh(Module):
+    """Test that a stopped background refresh is restarted by a lookup."""
+    Module.on_call()
+    Module.stop_timeline()
+    Module.ogschedule.timeline.assert_called_with(Module.schedule,
+                                                  Module.timeline_hours)
+
+
+def test_timeline_refreshes_before_it_runs_out(Module):
+    """Test that the next refresh is scheduled inside the margin."""
+    now = time.time()
+    Module.ogschedule.timeline.return_value = OnCallTimeline(
+        [(now, now + 7200, 'citest')])
+    waits = []
+
+    def wait(seconds):
+        waits.append(seconds)
+        Module._timeline_stop.set()
+
+    Module._timeline_stop.wait = wait
+    Module._refresh_timeline_loop()
+    assert Module.timelines[Module.schedule].at(now) == ['citest']
+    assert 3500 < waits[0] <= 7200 - Module.timeline_margin
+
+
+def test_timeline_failure_is_retried(Module):
+    """Test that a failed refresh keeps the old timeline and retries."""
+    old = set_timeline(Module, [(0, 1, 'old')])
+    waits = []
+
+    def wait(seconds):
+        waits.append(seconds)
+        Module._timeline_stop.set()
+
+    Module._timeline_stop.wait = wait
+    Module._refresh_timeline_loop()
+    assert Module.timelines[Module.schedule] is old
+    assert waits == [Module.timeline_retry]
+
+
+def test_channel_schedules_are_parsed(Module):
+    """Test parsing of the channel to schedule routing table."""
+    assert Module._channel_schedules('C1:TeamA, C2:TeamB,bad,') == {
+        'C1': 'TeamA', 'C2': 'TeamB'}
+
+
+def test_oncall_is_routed_by_channel(Module):
+    """Test that each channel gets the on-call of its own schedule."""
+    now = time.time()
+    Module.routes = {'C1': 'TeamA'}
+    set_timeline(Module, [(now - 60, now + 60, 'default')])
+    set_timeline(Module, [(now - 60, now + 60, 'team-a')], 'TeamA')
+    assert Module.on_call('C1') == 'team-a'
+    assert Module.on_call('C2') == 'default'
+    assert Module.ogschedule.on_call.call_count == 0
+
+
+def test_routed_fallback_is_cached_per_team(Module):
+    """Test that direct lookups are cached per schedule."""
+    Module.routes = {'C1': 'TeamA'}
+    Module.on_call('C1')
+    Module.ogschedule.on_call.assert_called_once_with('TeamA')
+    assert Module.bot.cache.get_value('og.schedule.oncall.TeamA')
+
+
+def test_refresh_timelines_fetches_every_team(Module):
+    """Test that one cycle refreshes every routed schedule."""
+    Module.routes = {'C1': 'TeamA', 'C2': 'TeamB', 'C3': 'TeamA'}
+    Module.ogschedule.timeline.side_effect = \
+        lambda team, hours: OnCallTimeline([(0, 10, team)])
+    assert Module.refresh_timelines()
+    assert sorted(Module.timelines) == sorted(
+        ['TeamA', 'TeamB', Module.schedule])
+    assert Module.ogschedule.timeline.call_count == 3
+
+
+def test_refresh_timelines_keeps_failed_teams(Module):
+    """Test that a failed schedule keeps its previous timeline."""
+    Module.routes = {'C1': 'TeamA'}
+    old = set_timeline(Module, [(0, 1, 'old')], 'TeamA')
+    Module.ogschedule.timeline.side_effect = \
+        lambda team, hours: None if team == 'TeamA' else OnCallTimeline()
+    assert not Module.refresh_timelines()
+    assert Module.timelines['TeamA'] is old
+
+
+def test_refresh_timelines_keeps_empty_timelines(Module):
+    """Test that an empty timeline is a successful refresh."""
+    set_timeline(Module, [(0, 1, 'old')])
+    empty = OnCallTimeline()
+    Module.ogschedule.timeline.side_effect = None
+    Module.ogschedule.timeline.return_value = empty
+    assert Module.refresh_timelines()
+    assert Module.timelines[Module.schedule] is empty
+
+
+def test_generate_response_while_model_loads(Module, mocker):
+    """Test that help is answered without parsing during warm up."""
+    mocker.patch.object(type(Module.nlp), 'loading', True)
+    Module.parse_query = MagicMock()
+    r = Module.generate_response('help with the frobnicator')
+    assert r == "Our hitman [<@testinggoat@slack.com>] should be able to " \
+        "help you."
+    assert Module.parse_query.call_count == 0
+
+
 def test_oncall_returns_user_if_email_match(Module):
     """Test that method returns the user ID on oncall email match."""
-    Module.bot.slack_users = MagicMock(autospec=True)
-    Module.bot.slack_users.return_value = \
+    Module.bot.iter_slack_users = MagicMock(autospec=True)
+    Module.bot.iter_slack_users.return_value = \
         TD.slackbot.get('user_list')['members']
+    Module.bot.resync_users()
     assert Module.on_call() == 'U023BECGF'
 
 
@@ -68,6 +235,132 @@ def test_parse_query_returns_subject_and_object(Module):
     assert isinstance(r, tuple)
 
 
+def test_parse_query_keeps_no_document(Module):
+    """Test parse query does not keep the parsed document around."""
+    Module.parse_query('foo')
+    assert Module.nlp.doc is None
+
+
+def test_parse_query_is_batched(MockEulerBot, monkeypatch):
+    """Test that concurrent queries are parsed in one batch."""
+    monkeypatch.setenv('SLACKBOT_SUPPORT_NLP_BATCH_WINDOW', '200')
+    cs = ChannelSupport(MockEulerBot, 'channel')
+    cs.nlp.parse_many = MagicMock(
+        side_effect=lambda texts: [(t, 'object') for t in texts])
+    cs.batcher.fn = cs.nlp.parse_many
+    results = []
+    threads = [threading.Thread(
+        target=lambda t=t: results.append(cs.parse_query(t)))
+        for t in ('first', 'second')]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    cs.batcher.shutdown()
+    assert sorted(results) == [('first', 'object'), ('second', 'object')]
+    assert cs.nlp.parse_many.call_count == 1
+
+
+def test_dispatch_batches_a_burst_in_one_channel(MockEulerBot, monkeypatch):
+    """Test that help requests in one channel are parsed in one batch and
+    answered in order."""
+    monkeypatch.setenv('SLACKBOT_SUPPORT_NLP_BATCH_WINDOW', '100')
+    cs = ChannelSupport(MockEulerBot, 'channel')
+    cs.nlp.parse_many = MagicMock(
+        side_effect=lambda texts: [('s', t.split()[-1]) for t in texts])
+    cs.batcher.fn = cs.nlp.parse_many
+    cs.on_call = MagicMock(return_value='U0')
+    cs.bot.post_message = MagicMock(autospec=True)
+    futures = [cs.dispatch({'channel': 'C1', 'user': 'U1',
+                            'text': 'help with thing{}'.format(i)})
+               for i in range(20)]
+    for future in futures:
+        future.result(timeout=5)
+    cs.batcher.shutdown()
+    assert cs.nlp.parse_many.call_count == 1
+    answers = [c[0][1] for c in cs.bot.post_message.call_args_list]
+    assert len(answers) == 20
+    for i, answer in enumerate(answers):
+        assert '_thing{}_'.format(i) in answer
+    assert cs.events_processed == 20
+
+
+def test_dispatch_without_trigger_word_runs_update(Module):
+    """Test that other messages are updated on the dispatcher."""
+    Module.update = MagicMock()
+    event = {'channel': 'C1', 'user': 'U1', 'text': 'hello'}
+    Module.dispatch(event).result(timeout=5)
+    Module.update.assert_called_once_with(event)
+
+
+def run_async_update(Module, event):
+    """Run the integration's async_update on a new event loop."""
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(Module.async_update(event))
+    finally:
+        loop.close()
+
+
+def test_async_update_parses_in_pool(Module):
+    """Test that help requests are parsed by the NLP pool."""
+    parsed = Future()
+    parsed.set_result(('subject', 'frobnicator'))
+    Module.pool = MagicMock(ready=True, loading=False)
+    Module.pool.submit.return_value = parsed
+    Module.parse_query = MagicMock()
+    Module.bot.post_message = MagicMock(autospec=True)
+    event = {'channel': 'C1', 'user': 'U1', 'text': 'help with frobnicator'}
+    run_async_update(Module, event)
+    Module.pool.submit.assert_called_once_with(event['text'])
+    assert Module.parse_query.call_count == 0
+    Module.bot.post_message.assert_called_once_with(
+        'C1', "<@U1>, Our hitman, [<@testinggoat@slack.com>] is guaranteed "
+        "to eliminate _frobnicator_ problem(s)")
+    assert Module.events_processed == 1
+
+
+def test_async_update_answers_in_order(Module):
+    """Test that a slow parse does not let later requests in the same
+    channel be answered first."""
+    slow, fast = Future(), Future()
+    fast.set_result(('subject', 'second'))
+    Module.pool = MagicMock(ready=True, loading=False)
+    Module.pool.submit.side_effect = [slow, fast]
+    Module.bot.post_message = MagicMock(autospec=True)
+    events = [{'channel': 'C1', 'user': 'U1', 'text': 'help with first'},
+              {'channel': 'C1', 'user': 'U1', 'text': 'help with second'}]
+    threading.Timer(0.2, slow.set_result, [('subject', 'first')]).start()
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(asyncio.gather(
+            *[Module.async_update(event) for event in events], loop=loop))
+    finally:
+        loop.close()
+    answers = [c[0][1] for c in Module.bot.post_message.call_args_list]
+    assert '_first_' in answers[0]
+    assert '_second_' in answers[1]
+
+
+def test_async_update_without_pool_uses_dispatcher(Module):
+    """Test that without a pool the update runs on the dispatcher."""
+    Module.update = MagicMock()
+    event = {'channel': 'C1', 'user': 'U1', 'text': 'help'}
+    run_async_update(Module, event)
+    Module.update.assert_called_once_with(event)
+
+
+def test_async_update_starts_pool_in_background(Module):
+    """Test that a pool that is not running yet is started off the loop."""
+    Module.pool = MagicMock(ready=False)
+    Module.update = MagicMock()
+    event = {'channel': 'C1', 'user': 'U1', 'text': 'help'}
+    run_async_update(Module, event)
+    Module.pool.start_warm_up.assert_called_once_with()
+    assert Module.pool.submit.call_count == 0
+    Module.update.assert_called_once_with(event)
+
+
 def test_generate_repsponse_without_obj(Module):
     """Test generate response when no object exists."""
     assert 'should be able to help you' in Module.generate_response('test')
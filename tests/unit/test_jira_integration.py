@@ -7,11 +7,17 @@ import pytest
 import testing_data as TD
 import eulerbot.integrations.jira
 from eulerbot.integrations.jira import JiraManagement
+from jira.exceptions import JIRAError
 from unittest.mock import MagicMock
 
 pytestmark = pytest.mark.jira
 
 
+def jira_error(status):
+    """Return a JIRAError with the given HTTP status"""
+    return JIRAError(status_code=status, text='error')
+
+
 @pytest.fixture
 def JiraInt(MockEulerBot):
     """Return an instance of the JiraManagement integration."""
@@ -21,6 +27,7 @@ def JiraInt(MockEulerBot):
     eulerbot.integrations.jira.IssueLink.side_effect = TD.MockIssueLink
     j = JiraManagement(MockEulerBot, 'channel')
     j.key = 'TID'
+    j.manager._jira = MagicMock(autospec=True)
     return j
 
 
@@ -50,6 +57,86 @@ def test_extract_key_extracts_the_right_key(JiraInt, text, expected):
             assert issue_id == 'TID-123'
 
 
+def test_extract_issue_ids_returns_every_key_once(JiraInt):
+    """Test that all keys are extracted in order without duplicates."""
+    text = 'TID-2 blocks tid-1, see TID-2 and <http://j/browse/TID-30|x>'
+    assert JiraInt.extract_issue_ids(text) == ['TID-2', 'TID-1', 'TID-30']
+    assert JiraInt.extract_issue_ids('no keys here') == []
+
+
+def test_pattern_follows_project_key(JiraInt):
+    """Test that the compiled pattern is rebuilt when the key changes."""
+    pattern = JiraInt.pattern
+    assert JiraInt.pattern is pattern
+    JiraInt.key = 'ABC'
+    assert JiraInt.extract_issue_ids('TID-1 ABC-2') == ['ABC-2']
+
+
+def test_post_issue_link_with_several_issues(JiraInt):
+    """Test that all issues mentioned are posted in one message."""
+    JiraInt.manager._search = MagicMock(autospec=True, return_value={
+        'TID-1': TD.MockJiraIssue('TID-1'),
+        'TID-2': TD.MockJiraIssue('TID-2')})
+    JiraInt.bot.post_message = MagicMock(autospec=True)
+    JiraInt.post_issue_link('CHANNEL', 'USER1', 'TID-1, TID-2 and TID-1')
+    JiraInt.manager._search.assert_called_once_with(['TID-1', 'TID-2'])
+    attachment = TD.load_json('tests/data/issuelink_attachment.json')
+    JiraInt.bot.post_message.assert_called_once_with(
+        'CHANNEL',
+        '',
+        attachments=attachment + attachment
+    )
+
+
+def test_post_issue_link_with_several_invalid_issues(JiraInt):
+    """Test that every issue not found is reported in one message."""
+    JiraInt.manager._search = MagicMock(autospec=True, return_value={
+        'TID-1': TD.MockJiraIssue('TID-1')})
+    JiraInt.bot.post_message = MagicMock(autospec=True)
+    JiraInt.post_issue_link('CHANNEL', 'USER1', 'TID-1 TID-8 TID-9')
+    assert JiraInt.bot.post_message.call_count == 2
+    JiraInt.bot.post_message.assert_called_with(
+        'CHANNEL',
+        "<@USER1>, are you sure TID-8, TID-9 are valid Jira issues? "
+        "I couldn't find them."
+    )
+
+
+def test_render_is_cached(JiraInt):
+    """Test that an unchanged issue is only rendered once."""
+    issue = TD.MockJiraIssue('TID-1')
+    first = JiraInt.render(issue)
+    assert JiraInt.render(issue) is first
+    assert eulerbot.integrations.jira.IssueLink.call_count == 1
+
+
+def test_render_follows_directory_version(JiraInt):
+    """Test that a changed user directory renders the issue again."""
+    issue = TD.MockJiraIssue('TID-1')
+    JiraInt.render(issue)
+    JiraInt.bot._directory.version += 1
+    JiraInt.render(issue)
+    assert eulerbot.integrations.jira.IssueLink.call_count == 2
+
+
+def test_degraded_render_is_not_cached(JiraInt):
+    """Test that an attachment built while Jira is down is rendered again."""
+    degraded = TD.MockIssueLink(None, None, None)
+    degraded.degraded = True
+    eulerbot.integrations.jira.IssueLink.side_effect = [
+        degraded, TD.MockIssueLink(None, None, None)]
+    issue = TD.MockJiraIssue('TID-1')
+    JiraInt.render(issue)
+    JiraInt.render(issue)
+    JiraInt.render(issue)
+    assert eulerbot.integrations.jira.IssueLink.call_count == 2
+
+
+def test_render_cache_expires_with_epics(JiraInt):
+    """Test that renders expire no later than cached epic summaries."""
+    assert JiraInt.renders.ttl == JiraInt.manager.epics.ttl
+
+
 def test_post_issue_link_with_valid_issue(JiraInt):
     JiraInt.manager.issue = MagicMock(autospec=True)
     JiraInt.manager.issue.side_effect = TD.MockJiraIssue
@@ -77,6 +164,59 @@ def test_post_issue_link_with_invalid_issue(JiraInt):
     )
 
 
+def test_post_issue_link_cooldown_skips_lookup(JiraInt):
+    """Test that a repeated mention in the same channel costs no lookup."""
+    JiraInt.manager.issue = MagicMock(autospec=True)
+    JiraInt.manager.issue.side_effect = TD.MockJiraIssue
+    JiraInt.bot.post_message = MagicMock(autospec=True)
+    text = 'This line of text has a valid TID-123 project key'
+    for i in range(5):
+        JiraInt.post_issue_link('CHANNEL', 'USER1', text)
+    assert JiraInt.manager.issue.call_count == 1
+    assert JiraInt.bot.post_message.call_count == 1
+    JiraInt.post_issue_link('OTHER', 'USER1', text)
+    assert JiraInt.bot.post_message.call_count == 2
+
+
+def test_post_issue_link_invalid_issue_is_reported_once(JiraInt):
+    """Test that a repeated invalid issue is only reported once."""
+    JiraInt.manager.issue = MagicMock(autospec=True, return_value=None)
+    JiraInt.bot.post_message = MagicMock(autospec=True)
+    for i in range(3):
+        JiraInt.post_issue_link('CHANNEL', 'USER1', 'see TID-0')
+    assert JiraInt.manager.issue.call_count == 1
+    assert JiraInt.bot.post_message.call_count == 1
+
+
+def test_post_issue_link_negatively_cached_issue_is_not_reported(JiraInt):
+    """Test that a known invalid issue costs no post once the channel
+    cooldown has passed."""
+    JiraInt.manager._jira.issue.side_effect = jira_error(404)
+    JiraInt.bot.post_message = MagicMock(autospec=True)
+    JiraInt.cooldown.window = 0
+    for i in range(3):
+        JiraInt.post_issue_link('CHANNEL', 'USER1', 'see TID-0')
+    assert JiraInt.manager.is_invalid('TID-0')
+    assert JiraInt.manager._jira.issue.call_count == 1
+    assert JiraInt.bot.post_message.call_count == 1
+
+
+def test_post_issue_link_outage_is_not_reported_as_invalid(JiraInt):
+    """Test that issues are not called invalid while Jira is down."""
+    JiraInt.manager.issue = MagicMock(autospec=True, return_value=None)
+    JiraInt.manager.breaker.failure()
+    JiraInt.bot.post_message = MagicMock(autospec=True)
+    JiraInt.post_issue_link('CHANNEL', 'USER1', 'see TID-1')
+    assert JiraInt.bot.post_message.call_count == 0
+    assert not JiraInt.cooldown.cooling('CHANNEL', 'TID-1')
+
+
+def test_channel_cooldown_windows(JiraInt):
+    """Test parsing of per channel cooldown windows."""
+    assert JiraInt._channel_windows('C1:300, C2:0,bad,') == {
+        'C1': 300, 'C2': 0}
+
+
 def test_update_returns_if_event_has_no_text(JiraInt):
     event = {'channel': 'CHANNEL'}
     JiraInt.post_issue_link = MagicMock(autospec=True)
@@ -3,11 +3,13 @@
 Test the JiraManager object."""
 import pytest
 import testing_data as TD
+import threading
+import time
 import uuid
 import jira
 import requests
 from beaker.cache import Cache
-from eulerbot.integrations.jira import JiraManager
+from eulerbot.integrations.jira import IssueStore, JiraManager
 from unittest.mock import MagicMock
 
 pytestmark = pytest.mark.jira
@@ -92,3 +94,387 @@ def test_jm_connection_error_is_graceful(mocker):
     JM.jira
     assert JM._jira is None
     assert JM.logger.error.call_count == 1
+
+
+def test_jm_issues_uses_one_search_for_misses(JM):
+    """Test that uncached issues are fetched with a single JQL search."""
+    JM.jira.search_issues.return_value = [TD.MockJiraIssue('TID-2'),
+                                          TD.MockJiraIssue('TID-3')]
+    JM.jira.issue.side_effect = jira_error(404)
+    JM._cache('TID-1', TD.MockJiraIssue('TID-1'))
+    issues = JM.issues(['TID-1', 'TID-2', 'TID-3', 'TID-4'])
+    assert list(issues) == ['TID-1', 'TID-2', 'TID-3']
+    JM.jira.search_issues.assert_called_once_with(
+        'key in (TID-2,TID-3,TID-4)', maxResults=3, validate_query=False,
+        fields=','.join(JM.issue_fields))
+    assert 'jira.issue.TID-2' in JM.cache
+    JM.jira.issue.assert_called_once_with(
+        'TID-4', fields=','.join(JM.issue_fields))
+
+
+def test_jm_issues_single_miss_uses_issue(JM):
+    """Test that a single uncached issue is fetched directly."""
+    JM.jira.issue.side_effect = TD.MockJiraIssue
+    issues = JM.issues(['TID-1'])
+    assert list(issues) == ['TID-1']
+    assert JM.jira.search_issues.call_count == 0
+
+
+def test_jm_issues_search_error_returns_cached(JM):
+    """Test that a failed search still returns cached issues."""
+    JM.logger.warning = MagicMock(autospec=True)
+    JM.jira.search_issues.side_effect = jira.exceptions.JIRAError('error')
+    JM._cache('TID-1', TD.MockJiraIssue('TID-1'))
+    issues = JM.issues(['TID-1', 'TID-2', 'TID-3'])
+    assert list(issues) == ['TID-1']
+    JM.logger.warning.assert_called_once()
+
+
+def stored_issue(key, updated):
+    """Return a mock Jira issue with raw JSON"""
+    issue = MagicMock()
+    issue.key = key
+    issue.fields.updated = updated
+    issue.raw = {'key': key, 'fields': {'summary': 'Stored',
+                                        'updated': updated}}
+    return issue
+
+
+@pytest.fixture
+def JMS(JM, tmpdir):
+    """Return a JiraManager with a persistent issue store."""
+    JM.store = IssueStore(str(tmpdir.join('issues.db')))
+    JM.jira.issue.side_effect = lambda _id, fields: stored_issue(_id, 'v1')
+    return JM
+
+
+def test_issue_store_round_trip(tmpdir):
+    """Test that issues survive reopening the store."""
+    path = str(tmpdir.join('issues.db'))
+    IssueStore(path).put('TID-1', {'key': 'TID-1'}, 'v1')
+    raw, updated, checked = IssueStore(path).get('TID-1')
+    assert raw == {'key': 'TID-1'}
+    assert updated == 'v1'
+    assert IssueStore(path).get('TID-2') is None
+
+
+def test_jm_issue_is_stored(JMS):
+    """Test that fetched issues are written to the store."""
+    JMS.issue('TID-1')
+    assert JMS.store.get('TID-1')[1] == 'v1'
+
+
+def test_jm_issue_served_from_store_after_restart(JMS, BeakerCache):
+    """Test that a new manager serves recently checked stored issues."""
+    JMS.issue('TID-1')
+    BeakerCache.clear()
+    jm = JiraManager(BeakerCache)
+    jm._jira = MagicMock(autospec=True)
+    jm.store = JMS.store
+    issue = jm.issue('TID-1')
+    assert issue.key == 'TID-1'
+    assert issue.fields.summary == 'Stored'
+    assert jm.jira.issue.call_count == 0
+
+
+def test_jm_stale_unchanged_issue_is_revalidated(JMS):
+    """Test that an unchanged issue past the store's max age only costs an
+    updated lookup."""
+    JMS.issue('TID-1')
+    JMS.cache.clear()
+    JMS.revalidate_after = 0
+    JMS.store_max_age = 0
+    JMS.jira.issue.reset_mock()
+    issue = JMS.issue('TID-1')
+    assert issue.fields.summary == 'Stored'
+    JMS.jira.issue.assert_called_once_with('TID-1', fields='updated')
+
+
+def test_jm_stale_changed_issue_is_refetched(JMS):
+    """Test that a changed issue past the store's max age is fetched in
+    full."""
+    JMS.issue('TID-1')
+    JMS.cache.clear()
+    JMS.revalidate_after = 0
+    JMS.store_max_age = 0
+    JMS.jira.issue.reset_mock()
+    JMS.jira.issue.side_effect = lambda _id, fields: stored_issue(_id, 'v2')
+    JMS.issue('TID-1')
+    assert JMS.jira.issue.call_count == 2
+    JMS.jira.issue.assert_called_with('TID-1',
+                                      fields=','.join(JMS.issue_fields))
+    assert JMS.store.get('TID-1')[1] == 'v2'
+
+
+def test_jm_issues_revalidates_stored_issues_in_one_search(JMS):
+    """Test that stored issues past the max age are revalidated with one
+    search."""
+    for key in ('TID-1', 'TID-2'):
+        JMS.store.put(key, stored_issue(key, 'v1').raw, 'v1')
+    JMS.revalidate_after = 0
+    JMS.store_max_age = 0
+    JMS.jira.search_issues.side_effect = [
+        [stored_issue('TID-1', 'v1'), stored_issue('TID-2', 'v2')],
+        [stored_issue('TID-2', 'v2'), stored_issue('TID-3', 'v1')],
+    ]
+    issues = JMS.issues(['TID-1', 'TID-2', 'TID-3'])
+    assert list(issues) == ['TID-1', 'TID-2', 'TID-3']
+    calls = JMS.jira.search_issues.call_args_list
+    assert calls[0][0][0] == 'key in (TID-1,TID-2)'
+    assert calls[0][1]['fields'] == 'updated'
+    assert calls[1][0][0] == 'key in (TID-2,TID-3)'
+
+
+def test_jm_stored_issue_is_served_then_revalidated(JMS):
+    """Test that a stored issue due a check is served at once and
+    revalidated in the background."""
+    JMS.issue('TID-1')
+    JMS.cache.clear()
+    JMS.revalidate_after = 0
+    JMS.jira.issue.reset_mock()
+    JMS.jira.issue.side_effect = lambda _id, fields: stored_issue(_id, 'v2')
+    JMS.jira.search_issues.return_value = [stored_issue('TID-1', 'v2')]
+    issue = JMS.issue('TID-1')
+    assert issue.fields.updated == 'v1'
+    JMS._refresher.shutdown(wait=True)
+    JMS.jira.issue.assert_called_once_with('TID-1', fields='updated')
+    JMS.jira.search_issues.assert_called_once_with(
+        'key in (TID-1)', maxResults=1, validate_query=False,
+        fields=','.join(JMS.issue_fields))
+    assert not JMS._refreshing
+
+
+def test_jm_stored_issues_are_revalidated_together(JMS):
+    """Test that stored issues due a check are revalidated with one
+    background search."""
+    for key in ('TID-1', 'TID-2'):
+        JMS.store.put(key, stored_issue(key, 'v1').raw, 'v1')
+    JMS.revalidate_after = 0
+    JMS.jira.search_issues.return_value = [stored_issue('TID-1', 'v1'),
+                                           stored_issue('TID-2', 'v1')]
+    issues = JMS.issues(['TID-1', 'TID-2'])
+    assert list(issues) == ['TID-1', 'TID-2']
+    JMS._refresher.shutdown(wait=True)
+    JMS.jira.search_issues.assert_called_once_with(
+        'key in (TID-1,TID-2)', maxResults=2, validate_query=False,
+        fields='updated')
+    assert JMS.jira.issue.call_count == 0
+
+
+def test_jm_epic_fetches_summary_once(JM):
+    """Test that epic summaries are fetched with one field and cached."""
+    JM.jira.issue.side_effect = TD.MockJiraIssue
+    assert JM.epic('EPIC-01') == 'Ticket Summary'
+    assert JM.epic('EPIC-01') == 'Ticket Summary'
+    JM.jira.issue.assert_called_once_with('EPIC-01', fields='summary')
+    assert JM.epics.hit_rate == 0.5
+
+
+def test_jm_epic_error_returns_none(JM):
+    """Test that a missing epic returns None and is not cached."""
+    JM.logger.warning = MagicMock(autospec=True)
+    JM.jira.issue.side_effect = jira.exceptions.JIRAError('error')
+    assert JM.epic('EPIC-01') is None
+    assert 'EPIC-01' not in JM.epics
+
+
+def test_jm_prefetch_epics_uses_one_search(JM):
+    """Test that uncached epics are prefetched with one search."""
+    JM.epics.set('EPIC-01', 'Cached')
+    JM.jira.search_issues.return_value = [TD.MockJiraIssue('EPIC-02'),
+                                          TD.MockJiraIssue('EPIC-03')]
+    JM.prefetch_epics(['EPIC-01', 'EPIC-02', None, 'EPIC-03', 'EPIC-02'])
+    JM.jira.search_issues.assert_called_once_with(
+        'key in (EPIC-02,EPIC-03)', maxResults=2, validate_query=False,
+        fields='summary')
+    assert JM.epic('EPIC-03') == 'Ticket Summary'
+    assert JM.jira.issue.call_count == 0
+
+
+def test_jm_permalink(JM):
+    """Test that permalinks are built from the server setting."""
+    JM.server = 'https://jira.dom/'
+    assert JM.permalink('TID-1') == 'https://jira.dom/browse/TID-1'
+
+
+def test_jm_stale_issue_is_served_and_refreshed(JM, monkeypatch):
+    """Test that an issue past its soft TTL is returned immediately and
+    refreshed in the background."""
+    JM.jira.issue.side_effect = TD.MockJiraIssue
+    first = JM.issue('TID-1')
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + JM.soft_ttl + 1)
+    JM.jira.issue.side_effect = lambda _id, fields: TD.MockJiraIssue(_id)
+    assert JM.issue('TID-1') is first
+    JM._refresher.shutdown(wait=True)
+    assert JM.jira.issue.call_count == 2
+    assert JM.issue('TID-1') is not first
+
+
+def test_jm_refresh_is_scheduled_once(JM):
+    """Test that concurrent refreshes of one issue are not duplicated."""
+    release = threading.Event()
+    JM.jira.issue.side_effect = lambda _id, fields: release.wait(5)
+    JM.refresh('TID-1')
+    assert JM.refresh('TID-1') is None
+    release.set()
+    JM._refresher.shutdown(wait=True)
+    assert JM.jira.issue.call_count == 1
+    assert not JM._refreshing
+
+
+def test_jm_cache_uses_hard_ttl(JM):
+    """Test that cached issues expire after the hard TTL."""
+    JM.cache.set_value = MagicMock(autospec=True)
+    JM._cache('TID-1', 'issue')
+    assert JM.cache.set_value.call_args[1]['expiretime'] == JM.hard_ttl
+
+
+def test_jm_concurrent_misses_share_one_request(JM):
+    """Test that concurrent misses for one issue make one Jira request."""
+    release = threading.Event()
+
+    def fetch(_id, fields):
+        release.wait(5)
+        return TD.MockJiraIssue(_id)
+
+    JM.jira.issue.side_effect = fetch
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(
+        JM.issue('TID-1'))) for i in range(5)]
+    for t in threads:
+        t.start()
+    while JM.flights.shared < 4:
+        time.sleep(0.01)
+    release.set()
+    for t in threads:
+        t.join()
+    assert JM.jira.issue.call_count == 1
+    assert len(set(id(r) for r in results)) == 1
+
+
+def jira_error(status):
+    """Return a JIRAError with `status`"""
+    return jira.exceptions.JIRAError(status_code=status, text='error')
+
+
+@pytest.mark.parametrize('status', [403, 404])
+def test_jm_invalid_issue_is_negatively_cached(JM, status):
+    """Test that a missing or forbidden issue is not requested again."""
+    JM.jira.issue.side_effect = jira_error(status)
+    for i in range(3):
+        assert JM.issue('TID-0') is None
+    assert JM.jira.issue.call_count == 1
+    assert JM.invalid.hits == 2
+    assert 'jira.issue.TID-0' not in JM.cache
+
+
+def test_jm_server_error_is_not_negatively_cached(JM):
+    """Test that other Jira errors are retried on the next lookup."""
+    JM.jira.issue.side_effect = jira_error(500)
+    JM.issue('TID-0')
+    JM.issue('TID-0')
+    assert JM.jira.issue.call_count == 2
+    assert not JM.is_invalid('TID-0')
+
+
+def test_jm_negative_cache_expires(JM, monkeypatch):
+    """Test that invalid issues are looked up again after the TTL."""
+    JM.jira.issue.side_effect = jira_error(404)
+    JM.issue('TID-0')
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + JM.invalid.ttl + 1)
+    JM.issue('TID-0')
+    assert JM.jira.issue.call_count == 2
+
+
+def test_jm_issues_negatively_caches_missing_search_misses(JM):
+    """Test that keys Jira reports missing are not searched again."""
+    JM.jira.search_issues.return_value = [TD.MockJiraIssue('TID-1')]
+    JM.jira.issue.side_effect = jira_error(404)
+    JM.issues(['TID-1', 'TID-0'])
+    assert JM.is_invalid('TID-0')
+    assert list(JM.issues(['TID-1', 'TID-0'])) == ['TID-1']
+    assert JM.jira.search_issues.call_count == 1
+    assert JM.jira.issue.call_count == 1
+
+
+def test_jm_issues_finds_moved_issues(JM):
+    """Test that an issue the search returns under a new key is still
+    returned for the key asked for."""
+    JM.jira.search_issues.return_value = [TD.MockJiraIssue('TID-1'),
+                                          TD.MockJiraIssue('NEW-9')]
+    JM.jira.issue.return_value = TD.MockJiraIssue('NEW-9')
+    issues = JM.issues(['TID-1', 'OLD-9'])
+    assert list(issues) == ['TID-1', 'OLD-9']
+    assert issues['OLD-9'].key == 'NEW-9'
+    assert not JM.is_invalid('OLD-9')
+    assert 'jira.issue.OLD-9' in JM.cache
+
+
+def test_jm_client_has_timeout(BeakerCache, mocker, monkeypatch):
+    """Test that the Jira client is built with a deadline."""
+    monkeypatch.setenv('JIRA_TIMEOUT', '2.5')
+    jm = JiraManager(BeakerCache)
+    JIRA = mocker.patch('eulerbot.integrations.jira.JIRA', autospec=True)
+    jm.jira
+    assert JIRA.call_args[1]['timeout'] == 2.5
+    assert JIRA.call_args[1]['max_retries'] == 0
+
+
+def test_jm_outage_opens_breaker_and_fails_fast(JM):
+    """Test that repeated timeouts stop further requests to Jira."""
+    JM.jira.issue.side_effect = requests.exceptions.Timeout('slow')
+    for i in range(JM.breaker.failures):
+        assert JM.issue('TID-{}'.format(i)) is None
+    assert JM.breaker.state == JM.breaker.OPEN
+    assert not JM.available
+    JM.issue('TID-99')
+    assert JM.jira.issue.call_count == JM.breaker.failures
+    assert not JM.is_invalid('TID-0')
+
+
+def test_jm_unexpected_probe_error_reopens_breaker(JM):
+    """Test that any failed probe reopens the circuit instead of leaving it
+    stuck half-open."""
+    JM.breaker.failures = 1
+    JM.breaker.reset_timeout = 0
+    JM.breaker.failure()
+    assert JM.breaker.state == JM.breaker.HALF_OPEN
+    JM.jira.issue.side_effect = ValueError('not json')
+    with pytest.raises(ValueError):
+        JM._call('issue', 'TID-1')
+    assert JM.breaker.opened == 2
+    assert not JM.breaker._probing
+    JM.jira.issue.side_effect = None
+    JM.jira.issue.return_value = 'issue'
+    assert JM._call('issue', 'TID-1') == 'issue'
+    assert JM.breaker.state == JM.breaker.CLOSED
+
+
+def test_jm_missing_issue_keeps_breaker_closed(JM):
+    """Test that a 404 does not count as a Jira failure."""
+    JM.jira.issue.side_effect = jira_error(404)
+    for i in range(JM.breaker.failures + 1):
+        JM.issue('TID-{}'.format(i))
+    assert JM.breaker.state == JM.breaker.CLOSED
+    assert JM.available
+
+
+def test_jm_stale_stored_issue_is_served_during_outage(JMS):
+    """Test that stored issues are served when Jira can't revalidate."""
+    JMS.issue('TID-1')
+    JMS.cache.clear()
+    JMS.revalidate_after = 0
+    JMS.jira.issue.side_effect = requests.exceptions.ConnectionError('down')
+    issue = JMS.issue('TID-1')
+    assert issue.fields.summary == 'Stored'
+
+
+def test_jm_search_outage_returns_cached(JM):
+    """Test that a search that can't reach Jira still returns cached."""
+    JM.jira.search_issues.side_effect = requests.exceptions.Timeout('slow')
+    JM._cache('TID-1', TD.MockJiraIssue('TID-1'))
+    issues = JM.issues(['TID-1', 'TID-2', 'TID-3'])
+    assert list(issues) == ['TID-1']
+    assert not JM.is_invalid('TID-2')
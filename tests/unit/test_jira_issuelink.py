@@ -150,7 +150,9 @@ def test_add_epic_with_no_epic_on_issue(ILM):
 
 def test_add_epic_creates_epic_field(IL):
     """Test that epic field is added if issue has valid epic id"""
-    IL.jira.issue = MagicMock(side_effect=TD.MockJiraIssue)
+    IL.jira.epic = MagicMock(return_value='Ticket Summary')
+    IL.jira.permalink = MagicMock(
+        side_effect=lambda key: TD.MockJiraIssue(key).permalink())
     IL._add_epic()
     epic = IL._attachment['fields'][0]
     epic_url = '<{}|{}>'.format(
@@ -159,6 +161,16 @@ def test_add_epic_creates_epic_field(IL):
     assert epic['title'] == 'Epic'
     assert epic['value'] == epic_url
     assert epic['short'] is True
+    assert not IL.degraded
+
+
+def test_add_epic_skipped_if_epic_not_found(IL):
+    """Test that no epic field is added if the epic can not be fetched"""
+    IL.jira.epic = MagicMock(return_value=None)
+    IL._add_epic()
+    assert len(IL._attachment['fields']) == 0
+    assert IL.jira.issue.call_count == 0
+    assert IL.degraded
 
 
 def test_add_story_points_with_no_field(ILM):
@@ -0,0 +1,51 @@
+"""HTTP session unit tests
+
+Test the pooled sessions shared by the Slack and OpsGenie clients."""
+import pytest
+from eulerbot.sessions import pooled_session
+from requests.packages.urllib3.exceptions import (MaxRetryError,
+                                                  ReadTimeoutError)
+
+pytestmark = pytest.mark.sessions
+
+
+def adapter(session):
+    return session.get_adapter('https://api.opsgenie.com')
+
+
+def test_pooled_session_defaults():
+    """Test the default pool and retry settings."""
+    s = pooled_session('testing')
+    a = adapter(s)
+    assert a._pool_connections == 4
+    assert a._pool_maxsize == 10
+    assert a.max_retries.total == 2
+    assert 503 in a.max_retries.status_forcelist
+    assert s.get_adapter('http://127.0.0.1') is a
+
+
+@pytest.mark.parametrize("var, value, attr", [
+    ('TESTING_POOL_CONNECTIONS', 2, lambda a: a._pool_connections),
+    ('TESTING_POOL_SIZE', 20, lambda a: a._pool_maxsize),
+    ('TESTING_RETRIES', 5, lambda a: a.max_retries.total),
+    ('TESTING_RETRY_BACKOFF', 1.5, lambda a: a.max_retries.backoff_factor),
+])
+def test_environment_configures_session(monkeypatch, var, value, attr):
+    """Test that pool settings are configurable from the environment."""
+    monkeypatch.setenv(var, str(value))
+    assert attr(adapter(pooled_session('testing'))) == value
+
+
+def test_post_is_not_retried_on_status():
+    """Test that non idempotent requests are not retried on 5xx."""
+    retry = adapter(pooled_session('testing')).max_retries
+    assert retry.is_retry('GET', 503)
+    assert not retry.is_retry('POST', 503)
+
+
+def test_read_timeout_is_not_retried():
+    """Test that a timed out request is not sent again."""
+    retry = adapter(pooled_session('testing')).max_retries
+    error = ReadTimeoutError(None, '/', 'Read timed out.')
+    with pytest.raises(MaxRetryError):
+        retry.increment('GET', '/', error=error)
@@ -1,8 +1,10 @@
 """EulerBot unit tests
 
 This module unit tests the EulerBot object."""
+import asyncio
 import testing_data as TD
 import pytest
+import eulerbot.eulerbot
 import eulerbot.slackbot
 from unittest.mock import patch, MagicMock
 
@@ -13,9 +15,46 @@ pytestmark = pytest.mark.eulerbot
 def EulerBotMockedRTM(MockEulerBot):
     MockEulerBot.sc.rtm_connect = MagicMock(autospec=True)
     MockEulerBot.sc.rtm_read = MagicMock(autospec=True)
+    MockEulerBot.sync_loop = True
     return MockEulerBot
 
 
+@pytest.fixture
+def EulerBotAsyncRTM(MockEulerBot):
+    """EulerBot running the asyncio loop against a mocked RTM API that
+    returns one batch of events and then stops the bot."""
+    b = MockEulerBot
+    b.sc.rtm_connect = MagicMock(autospec=True, return_value=True)
+    b.sc.rtm_read = MagicMock(autospec=True)
+    b.read_timeout = 0
+    b.iter_slack_users = MagicMock(autospec=True)
+    b.iter_slack_users.return_value = \
+        TD.slackbot.get('user_list')['members']
+    b.events = []
+
+    def read():
+        b.running = False
+        return b.events
+
+    b.sc.rtm_read.side_effect = read
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    yield b
+    asyncio.get_event_loop().close()
+
+
+class MockAsyncIntegration(object):
+    """Mock EulerBot integration providing an async_update coroutine"""
+    def __init__(self):
+        self.call_count = 0
+
+    @asyncio.coroutine
+    def async_update(self, event):
+        self.call_count += 1
+
+    def update(self, event):
+        raise AssertionError("update called instead of async_update")
+
+
 def test_eulerbot_default_init(MockEulerBot):
     """Test that EulerBot has expected initial values"""
     assert MockEulerBot
@@ -36,6 +75,107 @@ def test_direct_message_property_list(MockEulerBot, dm):
     assert dm in dms
 
 
+def test_direct_message_list_is_loaded_once(MockEulerBot):
+    """Test that im.list is only requested the first time dms is used"""
+    eulerbot.slackbot.SlackClient.api_call.return_value = TD.slackbot.get(
+        'im_list')
+    for i in range(5):
+        assert isinstance(MockEulerBot.dms, set)
+    im_calls = [c for c in eulerbot.slackbot.SlackClient.api_call.mock_calls
+                if c[1] == ('im.list',)]
+    assert len(im_calls) == 1
+
+
+def test_direct_message_list_load_failure_retries(MockEulerBot):
+    """Test that a failed im.list is retried on the next lookup"""
+    eulerbot.slackbot.SlackClient.api_call.return_value = {'ok': False}
+    assert not MockEulerBot.dms
+    assert not MockEulerBot._dms_loaded
+    eulerbot.slackbot.SlackClient.api_call.return_value = TD.slackbot.get(
+        'im_list')
+    assert 'D024BE7RE' in MockEulerBot.dms
+
+
+@pytest.mark.parametrize("event", [
+    {'type': 'im_created', 'user': 'U1', 'channel': {'id': 'DNEW'}},
+    {'type': 'im_open', 'user': 'U1', 'channel': 'DNEW'},
+], ids=['im_created', 'im_open'])
+def test_direct_message_opened_events(MockEulerBot, event):
+    """Test that new direct message channels are tracked from events"""
+    eulerbot.slackbot.SlackClient.api_call.return_value = TD.slackbot.get(
+        'im_list')
+    assert 'DNEW' not in MockEulerBot.dms
+    MockEulerBot.handle_event(event)
+    assert 'DNEW' in MockEulerBot.dms
+    assert MockEulerBot._get_event_type(
+        {'type': 'message', 'channel': 'DNEW', 'text': ''}) == 'direct'
+
+
+def test_direct_message_close_event(MockEulerBot):
+    """Test that closed direct message channels are forgotten"""
+    eulerbot.slackbot.SlackClient.api_call.return_value = TD.slackbot.get(
+        'im_list')
+    assert 'D024BE7RE' in MockEulerBot.dms
+    MockEulerBot.handle_event(
+        {'type': 'im_close', 'user': 'U1', 'channel': 'D024BE7RE'})
+    assert 'D024BE7RE' not in MockEulerBot.dms
+
+
+@pytest.mark.parametrize("event_type", ['team_join', 'user_change'])
+def test_user_events_update_directory(MockEulerBot, event_type):
+    """Test that user events are applied to the user directory"""
+    MockEulerBot.iter_slack_users = MagicMock(autospec=True)
+    MockEulerBot.iter_slack_users.return_value = \
+        TD.slackbot.get('user_list')['members']
+    MockEulerBot.resync_users()
+    assert len(MockEulerBot.directory) == 2
+    MockEulerBot.handle_event({
+        'type': event_type,
+        'user': {'id': 'UNEW', 'name': 'newuser',
+                 'profile': {'email': 'new@dom'}}
+    })
+    assert MockEulerBot.directory.by_email('new@dom').uid == 'UNEW'
+    assert MockEulerBot.iter_slack_users.call_count == 1
+
+
+def test_warm_up_starts_integrations(monkeypatch, mocker):
+    """Test that EULERBOT_WARM_UP warms up integrations on start."""
+    mocker.patch.object(eulerbot.slackbot.SlackClient, 'api_call')
+    mocker.patch('eulerbot.integrations.support.ChannelSupport.warm_up')
+    monkeypatch.setenv('EULERBOT_WARM_UP', 'true')
+    b = eulerbot.eulerbot.EulerBot()
+    assert b.warm_up
+    b.integrations['channel'][0].warm_up.assert_called_once_with()
+
+
+def test_connected_bot_starts_integrations(EulerBotAsyncRTM):
+    """Test that integrations are started once the bot is connected."""
+    b = EulerBotAsyncRTM
+    integration = MagicMock(spec=['update', 'start'])
+    b._integrations['channel'].append(integration)
+    b.run()
+    integration.start.assert_called_once_with()
+
+
+def test_process_event_uses_integration_dispatch(MockEulerBot):
+    """Test that integrations providing dispatch queue their own work."""
+    integration = MagicMock(spec=['update', 'dispatch'])
+    MockEulerBot._integrations['channel'].append(integration)
+    event = {'channel': 'C1', 'user': 'U1', 'text': 'hi'}
+    MockEulerBot.process_event(event, 'channel')
+    integration.dispatch.assert_called_once_with(event)
+    assert integration.update.call_count == 0
+
+
+def test_unconnected_bot_starts_no_integrations(EulerBotMockedRTM):
+    """Test that integrations are not started without a connection."""
+    b = EulerBotMockedRTM
+    b.sc.rtm_connect.return_value = False
+    b.start_integrations = MagicMock()
+    b.run()
+    assert b.start_integrations.call_count == 0
+
+
 def test_eulerbot_rtm_connection_failure(EulerBotMockedRTM):
     """Test EulerBot exits if it fails to connect to RTM API"""
     b = EulerBotMockedRTM
@@ -79,8 +219,9 @@ def test_eulerbot_run_rtm_event_types(_time, event_type, EulerBotMockedRTM):
     b.sc.rtm_read.return_value = rv
     b.sc.rtm_connect.return_value = True
     b.process_event = MagicMock(autospec=True)
-    b.slack_users = MagicMock(autospec=True)
-    b.slack_users.return_value = TD.slackbot.get('user_list')['members']
+    b.iter_slack_users = MagicMock(autospec=True)
+    b.iter_slack_users.return_value = \
+        TD.slackbot.get('user_list')['members']
 
     with pytest.raises(AssertionError):
         b.run()
@@ -101,8 +242,10 @@ def test_eulerbot_parse_message_types(event, EulerBotMockedRTM):
     eulerbot.slackbot.SlackClient.api_call.return_value = TD.slackbot.get(
         'im_list')
     b = EulerBotMockedRTM
-    b.slack_users = MagicMock(autospec=True)
-    b.slack_users.return_value = TD.slackbot.get('user_list')['members']
+    b.iter_slack_users = MagicMock(autospec=True)
+    b.iter_slack_users.return_value = \
+        TD.slackbot.get('user_list')['members']
+    b.resync_users()
     check = event.get('text')
     assert b._get_event_type(event) in check
 
@@ -115,9 +258,10 @@ def test_eulerbot_run_rtm_event_type_processing(_time, event,
     b = EulerBotMockedRTM
     b.sc.rtm_read.return_value = [event]
 
-    b.slack_users = MagicMock(autospec=True)
+    b.iter_slack_users = MagicMock(autospec=True)
     b.process_event = MagicMock(autospec=True)
-    b.slack_users.return_value = TD.slackbot.get('user_list')['members']
+    b.iter_slack_users.return_value = \
+        TD.slackbot.get('user_list')['members']
 
     with pytest.raises(AssertionError):
         b.run()
@@ -136,6 +280,7 @@ def test_eulerbot_process_event_integrations(event_type,
     b.integrations[event_type].clear()
     b.integrations[event_type].append(TD.MockIntegration())
     b.process_event(event, event_type)
+    b.dispatcher.join()
     for integration in b.integrations[event_type]:
         assert integration.call_count == 1
 
@@ -166,9 +311,70 @@ def test_eulerbot_ignores_messages_from_slackbot(EulerBotMockedRTM):
         'text': 'testing message'
     }
     b.sc.rtm_read.return_value = [event]
-    b.slack_users = MagicMock(autospec=True)
+    b.iter_slack_users = MagicMock(autospec=True)
     b.process_event = MagicMock(autospec=True)
     b._get_event_type = MagicMock(autospec=True)
-    b.slack_users.return_value = TD.slackbot.get('user_list')['members']
+    b.iter_slack_users.return_value = \
+        TD.slackbot.get('user_list')['members']
     b.run()
     assert b._get_event_type.call_count == 0
+
+
+def test_eulerbot_run_async_connection_failure(EulerBotAsyncRTM):
+    """Test the asyncio loop exits if it fails to connect to RTM API"""
+    b = EulerBotAsyncRTM
+    b.sc.rtm_connect.return_value = False
+    b.sync_loop = False
+    b.run()
+    b.sc.rtm_connect.assert_called_once_with()
+    assert b.sc.rtm_read.call_count == 0
+
+
+@pytest.mark.parametrize("event_type", ["message", "hello", "", None])
+def test_eulerbot_run_async_event_types(event_type, EulerBotAsyncRTM):
+    """Test that the asyncio loop only processes message events"""
+    b = EulerBotAsyncRTM
+    b.events = [{'type': event_type, 'param1': 'value1', 'text': 'foo'}]
+    b.integrations['channel'].append(TD.MockIntegration())
+    b.run_async()
+    assert b.events_received == 1
+    if event_type == 'message':
+        assert b.events_processed == 1
+        assert b.integrations['channel'][0].call_count == 1
+    else:
+        assert b.events_processed == 0
+        assert b.integrations['channel'][0].call_count == 0
+
+
+def test_eulerbot_run_async_skips_slackbot(EulerBotAsyncRTM):
+    """Test that the asyncio loop skips messages from slackbot"""
+    b = EulerBotAsyncRTM
+    b.events = [{'type': 'message', 'user': 'USLACKBOT', 'text': 'foo'},
+                {'type': 'message', 'user': 'U1', 'text': 'bar'}]
+    b.integrations['channel'].append(TD.MockIntegration())
+    b.run_async()
+    assert b.events_received == 2
+    assert b.events_processed == 1
+    assert b.integrations['channel'][0].call_count == 1
+
+
+def test_eulerbot_run_async_awaits_async_integrations(EulerBotAsyncRTM):
+    """Test that integrations with async_update are awaited"""
+    b = EulerBotAsyncRTM
+    b.events = TD.eulerbot.get('message_events')[:1]
+    integration = MockAsyncIntegration()
+    b.integrations['channel'].append(integration)
+    b.run_async()
+    assert integration.call_count == 1
+
+
+def test_eulerbot_run_async_survives_failing_integration(EulerBotAsyncRTM):
+    """Test that a failing integration does not stop the others"""
+    b = EulerBotAsyncRTM
+    b.events = TD.eulerbot.get('message_events')[:1]
+    failing = MagicMock(spec=['update'])
+    failing.update.side_effect = ValueError('broken')
+    b.integrations['channel'].extend([failing, TD.MockIntegration()])
+    b.run_async()
+    assert failing.update.call_count == 1
+    assert b.integrations['channel'][1].call_count == 1
@@ -16,6 +16,31 @@ def test_slackuser_default_object():
     assert u._profile == {}
 
 
+def test_slackuser_is_slotted():
+    """Test that SlackUser does not carry a per instance __dict__"""
+    u = eulerbot.slackbot.SlackUser()
+    assert not hasattr(u, '__dict__')
+    with pytest.raises(AttributeError):
+        u.nickname = 'goat'
+
+
+def test_slackuser_profile_is_projected():
+    """Test that only the configured profile fields are kept"""
+    u = eulerbot.slackbot.SlackUser()
+    u.profile = TD.slackbot.get('user_list')['members'][0]['profile']
+    assert u.profile == {'email': 'testinggoat@slack.com',
+                         'real_name': 'Testing Goat'}
+
+
+def test_slackuser_profile_fields_are_configurable(monkeypatch):
+    """Test that the projected profile fields can be changed"""
+    monkeypatch.setattr(eulerbot.slackbot.SlackUser, 'profile_fields',
+                        ('phone',))
+    u = eulerbot.slackbot.SlackUser()
+    u.profile = TD.slackbot.get('user_list')['members'][0]['profile']
+    assert u.profile == {'phone': '+1 (123) 456 7890'}
+
+
 def test_slackbot_default_initialization(monkeypatch):
     """Test that slackbot default initialization is correct."""
     monkeypatch.delenv('SLACKBOT_BOT_NAME', raising=False)
@@ -71,10 +96,48 @@ def test_slackbot_api_call_cached_results(slackbot):
         'api_call')
     assert eulerbot.slackbot.SlackClient.api_call.call_count == 0
     for i in range(30):
-        slackbot._api_method("testmethod")
+        slackbot._api_method("team.info")
     assert eulerbot.slackbot.SlackClient.api_call.call_count == 1
     eulerbot.slackbot.SlackClient.api_call.assert_called_once_with(
-        "testmethod")
+        "team.info")
+
+
+def test_slackbot_api_call_cache_is_keyed_by_arguments(slackbot):
+    """Test that calls with different arguments are cached separately"""
+    eulerbot.slackbot.SlackClient.api_call.side_effect = lambda m, **kw: {
+        'ok': True, 'user': kw.get('user')}
+    assert slackbot._api_method('users.info', user='U1')['user'] == 'U1'
+    assert slackbot._api_method('users.info', user='U2')['user'] == 'U2'
+    assert slackbot._api_method('users.info', user='U1')['user'] == 'U1'
+    assert eulerbot.slackbot.SlackClient.api_call.call_count == 2
+    assert slackbot.api_cache.hits == 1
+    assert slackbot.api_cache.misses == 2
+
+
+@pytest.mark.parametrize("method", [
+    'chat.postMessage', 'chat.update', 'reactions.add', 'im.open',
+    'files.upload', 'chat.meMessage', 'chat.unfurl', 'dnd.endDnd',
+    'test.method'])
+def test_slackbot_api_call_write_methods_are_not_cached(slackbot, method):
+    """Test that methods not known to be reads are never cached"""
+    eulerbot.slackbot.SlackClient.api_call.return_value = TD.slackbot.get(
+        'api_call')
+    slackbot._api_method(method, channel='C1')
+    slackbot._api_method(method, channel='C1')
+    assert eulerbot.slackbot.SlackClient.api_call.call_count == 2
+    assert len(slackbot.api_cache) == 0
+
+
+@pytest.mark.parametrize("method, ttl", [
+    ('users.list', 3600),
+    ('im.list', 600),
+    ('chat.postMessage', 0),
+    ('files.upload', 0),
+    ('test.method', 0),
+])
+def test_slackbot_api_ttl_policy(slackbot, method, ttl):
+    """Test the per method cache time to live"""
+    assert slackbot._api_ttl(method) == ttl
 
 
 def test_slackbot_api_call_cache_bypass(slackbot):
@@ -90,7 +153,7 @@ def test_slackbot_api_call_cache_bypass(slackbot):
 @pytest.mark.slow
 def test_slackbot_api_call_cache_timeout(slackbot):
     """Test that cache timeout invalidates API cache."""
-    slackbot.expiretime = 10
+    slackbot.api_cache_ttl = {'test.timeout': 10}
     eulerbot.slackbot.SlackClient.api_call.return_value = TD.slackbot.get(
         'api_call')
     assert eulerbot.slackbot.SlackClient.api_call.call_count == 0
@@ -151,28 +214,33 @@ def test_slackbot_users_property_cache(slackbot):
     """Test that slackbot users property is cached."""
     eulerbot.slackbot.SlackClient.api_call.return_value = TD.slackbot.get(
         'user_list')
-    assert not slackbot._users
+    assert not slackbot._directory
     slackbot.users
     assert 'slackbot.users' in slackbot.cache
     slackbot.users
-    assert slackbot._users
+    assert slackbot._directory
 
 
 @pytest.mark.slow
 def test_slackbot_users_property_cache_timeout(slackbot):
-    """Test that the user property cache value timeout"""
+    """Test that the users are resynced in the background once the resync
+    interval passes."""
+    slackbot.user_resync = 10
     eulerbot.slackbot.SlackClient.api_call.return_value = TD.slackbot.get(
         'user_list')
     assert 'slackbot.users' not in slackbot.cache
-    slackbot.users
+    users = slackbot.users
     assert 'slackbot.users' in slackbot.cache
-    time.sleep(61)
+    time.sleep(11)
     assert 'slackbot.users' not in slackbot.cache
-    slackbot.cache.remove('slackclient.api.users.list')
-    eulerbot.slackbot.SlackClient.api_call.return_value = {}
-    slackbot.users
-    assert isinstance(slackbot._users, list)
-    assert len(slackbot._users) == 0
+    data = copy.deepcopy(TD.slackbot.get('user_list'))
+    del data['members'][1:]
+    eulerbot.slackbot.SlackClient.api_call.return_value = data
+    assert slackbot.users
+    slackbot._resync_thread.join()
+    assert slackbot.users is not users
+    assert 'slackbot.users' in slackbot.cache
+    assert len(slackbot._directory) == 1
 
 
 def test_slackbot_uid_property_can_find_slackbots_uid(slackbot):
@@ -196,6 +264,33 @@ def test_slackbot_uid_property_is_cached(slackbot):
     assert uid
 
 
+def test_slackbot_uid_prefers_rtm_login_data(slackbot):
+    """Test that the bot's id from rtm.start is used when connected"""
+    slackbot.sc.server.login_data = {'self': {'id': 'UBOT', 'name': 'x'}}
+    assert slackbot.uid == 'UBOT'
+    assert eulerbot.slackbot.SlackClient.api_call.call_count == 0
+
+
+def test_slackbot_uid_matches_part_of_a_user_name(slackbot):
+    """Test that the bot is found by a user name containing its name"""
+    users = copy.deepcopy(TD.slackbot.get('user_list'))
+    users['members'][0]['name'] = 'testgoat-bot'
+    users['members'][0]['profile']['real_name'] = 'Goat Bot'
+    eulerbot.slackbot.SlackClient.api_call.return_value = users
+    assert slackbot.uid == users['members'][0]['id']
+
+
+def test_slackbot_uid_not_found_is_logged(slackbot, mocker):
+    """Test that an unknown bot uid is logged as an error"""
+    users = copy.deepcopy(TD.slackbot.get('user_list'))
+    users['members'] = users['members'][1:]
+    eulerbot.slackbot.SlackClient.api_call.return_value = users
+    slackbot.logger = MagicMock()
+    assert slackbot.uid is None
+    assert slackbot.logger.error.call_count == 1
+    assert 'slackbot.uid' not in slackbot.cache
+
+
 def test_slackbot_post_message_method(slackbot):
     """Test post_message method operates as expected."""
     response = TD.slackbot.get('post_message')
@@ -230,3 +325,282 @@ def test_slackbot_post_message_method_with_keyword_args(slackbot):
         mrkdwn=True,
         Cache=False
     )
+
+
+@pytest.fixture
+def SlackUsers():
+    """Return a list of SlackUsers built from the user list test data"""
+    users = []
+    for member in TD.slackbot.get('user_list')['members']:
+        u = eulerbot.slackbot.SlackUser()
+        u.uid = member.get('id')
+        u.name = member.get('real_name')
+        u.username = member.get('name')
+        u.profile = member.get('profile')
+        users.append(u)
+    return users
+
+
+def test_user_directory_indexes(SlackUsers):
+    """Test that the user directory finds users by uid, email and name"""
+    d = eulerbot.slackbot.UserDirectory(SlackUsers)
+    assert len(d) == len(SlackUsers)
+    assert d.by_uid('U023BECGF').username == 'testgoat'
+    assert d.by_email('testinggoat@slack.com').uid == 'U023BECGF'
+    assert d.by_name('testgoat').uid == 'U023BECGF'
+    assert d.by_name('Testing Goat').uid == 'U023BECGF'
+    assert 'U023BECGF' in d
+    assert d.by_uid('nobody') is None
+    assert d.by_email('nobody@dom') is None
+
+
+def test_user_directory_rebuild_replaces_users(SlackUsers):
+    """Test that rebuilding the directory replaces the old indexes"""
+    d = eulerbot.slackbot.UserDirectory(SlackUsers)
+    version = d.version
+    d.rebuild(SlackUsers[1:])
+    assert d.version == version + 1
+    assert d.by_uid('U023BECGF') is None
+    assert d.by_email('testinggoat@slack.com') is None
+    assert len(list(d)) == len(SlackUsers) - 1
+
+
+def test_slackbot_directory_property(slackbot):
+    """Test that the directory is rebuilt when the users are refreshed"""
+    eulerbot.slackbot.SlackClient.api_call.return_value = TD.slackbot.get(
+        'user_list')
+    d = slackbot.directory
+    assert isinstance(d, eulerbot.slackbot.UserDirectory)
+    assert len(d) == len(TD.slackbot.get('user_list')['members'])
+    assert d.by_email('testinggoat@slack.com').uid == 'U023BECGF'
+
+
+def test_slackbot_failed_user_list_is_retried_after_backoff(slackbot):
+    """Test that a failed user list is not requested again on every lookup
+    and is retried in the background once the backoff passes"""
+    eulerbot.slackbot.SlackClient.api_call.return_value = {}
+    for i in range(5):
+        assert slackbot.users == []
+    assert eulerbot.slackbot.SlackClient.api_call.call_count == 1
+    slackbot.cache.remove('slackbot.users')
+    eulerbot.slackbot.SlackClient.api_call.return_value = TD.slackbot.get(
+        'user_list')
+    slackbot.users
+    slackbot._resync_thread.join()
+    assert len(slackbot.users) == 2
+
+
+def test_slackbot_failed_resync_backs_off(slackbot):
+    """Test that lookups while Slack keeps failing start no resyncs"""
+    slackbot.user_retry = 60
+    eulerbot.slackbot.SlackClient.api_call.return_value = TD.slackbot.get(
+        'user_list')
+    slackbot.users
+    slackbot.cache.remove('slackbot.users')
+    eulerbot.slackbot.SlackClient.api_call.return_value = {}
+    for i in range(5):
+        assert len(slackbot.users) == 2
+        if slackbot._resync_thread:
+            slackbot._resync_thread.join()
+    assert eulerbot.slackbot.SlackClient.api_call.call_count == 2
+
+
+def test_slackbot_users_are_loaded_once(slackbot):
+    """Test that users.list is not requested again while users are fresh"""
+    eulerbot.slackbot.SlackClient.api_call.return_value = TD.slackbot.get(
+        'user_list')
+    for i in range(10):
+        slackbot.users
+    assert eulerbot.slackbot.SlackClient.api_call.call_count == 1
+
+
+def test_slackbot_users_background_resync(slackbot):
+    """Test that an expired user list is resynced in the background"""
+    eulerbot.slackbot.SlackClient.api_call.return_value = TD.slackbot.get(
+        'user_list')
+    users = slackbot.users
+    slackbot.cache.remove('slackbot.users')
+    data = copy.deepcopy(TD.slackbot.get('user_list'))
+    del data['members'][1:]
+    eulerbot.slackbot.SlackClient.api_call.return_value = data
+    assert slackbot.users
+    slackbot._resync_thread.join()
+    assert slackbot.users is not users
+    assert len(slackbot.users) == 1
+    assert len(slackbot.directory) == 1
+
+
+def test_slackbot_failed_resync_keeps_users(slackbot):
+    """Test that a failed resync does not throw away the known users"""
+    eulerbot.slackbot.SlackClient.api_call.return_value = TD.slackbot.get(
+        'user_list')
+    slackbot.users
+    eulerbot.slackbot.SlackClient.api_call.return_value = {}
+    slackbot.resync_users()
+    assert len(slackbot.users) == 2
+    assert 'slackbot.users' in slackbot.cache
+
+
+def pages(members, size=1):
+    """Return users.list pages of `size` members each"""
+    result = []
+    for i in range(0, len(members), size):
+        cursor = 'page{}'.format(i + size) if i + size < len(members) else ''
+        result.append({'ok': True, 'members': members[i:i + size],
+                       'response_metadata': {'next_cursor': cursor}})
+    return result
+
+
+def test_slackbot_failed_page_keeps_users(slackbot):
+    """Test that a resync failing part way keeps the full directory"""
+    members = copy.deepcopy(TD.slackbot.get('user_list')['members'])
+    eulerbot.slackbot.SlackClient.api_call.return_value = \
+        TD.slackbot.get('user_list')
+    slackbot.users
+    fresh = pages(members)
+    eulerbot.slackbot.SlackClient.api_call.return_value = None
+    eulerbot.slackbot.SlackClient.api_call.side_effect = [
+        fresh[0], {'ok': False, 'error': 'invalid_cursor'}]
+    slackbot.resync_users()
+    assert len(slackbot.users) == 2
+    assert slackbot.directory.by_email('testinggoat@slack.com')
+    eulerbot.slackbot.SlackClient.api_call.side_effect = [
+        {'ok': False, 'error': 'invalid_auth'}]
+    assert slackbot.slack_users() == []
+
+
+def test_slackbot_rate_limited_page_is_retried(slackbot, mocker):
+    """Test that a rate limited page waits for Retry-After and retries"""
+    members = TD.slackbot.get('user_list')['members']
+    fresh = pages(members)
+    mocker.patch('eulerbot.slackbot.time.sleep')
+    slackbot.sc.server.api_requester.retry_after['users.list'] = 3.0
+    eulerbot.slackbot.SlackClient.api_call.side_effect = [
+        fresh[0], {'ok': False, 'error': 'ratelimited'}, fresh[1]]
+    assert len(slackbot.users) == 2
+    eulerbot.slackbot.time.sleep.assert_called_once_with(3.0)
+    calls = eulerbot.slackbot.SlackClient.api_call.call_args_list
+    assert calls[1] == calls[2]
+
+
+def test_slackbot_rate_limited_resync_gives_up(slackbot, mocker):
+    """Test that a resync stops once the page retries are used up"""
+    mocker.patch('eulerbot.slackbot.time.sleep')
+    slackbot.user_page_retries = 2
+    eulerbot.slackbot.SlackClient.api_call.return_value = {
+        'ok': False, 'error': 'ratelimited'}
+    assert slackbot.users == []
+    assert eulerbot.slackbot.SlackClient.api_call.call_count == 3
+
+
+def test_pooled_requester_records_retry_after():
+    """Test that a 429 response records the wait Slack asked for"""
+    session = MagicMock()
+    session.post.return_value = MagicMock(status_code=429,
+                                          headers={'Retry-After': '7'})
+    requester = eulerbot.slackbot.PooledSlackRequest(session)
+    requester.do('token', 'users.list', {'limit': 200})
+    assert requester.retry_after == {'users.list': 7.0}
+
+
+def test_slackbot_slack_users_follows_cursor(slackbot):
+    """Test that every users.list page is requested"""
+    members = TD.slackbot.get('user_list')['members']
+    eulerbot.slackbot.SlackClient.api_call.side_effect = [
+        {'ok': True, 'members': members[:1],
+         'response_metadata': {'next_cursor': 'page2'}},
+        {'ok': True, 'members': members[1:],
+         'response_metadata': {'next_cursor': ''}},
+    ]
+    users = slackbot.slack_users()
+    assert [u['id'] for u in users] == [m['id'] for m in members]
+    calls = eulerbot.slackbot.SlackClient.api_call.call_args_list
+    assert len(calls) == 2
+    assert 'cursor' not in calls[0][1]
+    assert calls[1][1]['cursor'] == 'page2'
+
+
+def test_slackbot_users_skips_deleted_members(slackbot):
+    """Test that deactivated users are not loaded"""
+    data = copy.deepcopy(TD.slackbot.get('user_list'))
+    data['members'][1]['deleted'] = True
+    eulerbot.slackbot.SlackClient.api_call.return_value = data
+    assert [u.uid for u in slackbot.users] == ['U023BECGF']
+
+
+def test_slackbot_update_user(slackbot):
+    """Test that a changed user is patched into the directory"""
+    eulerbot.slackbot.SlackClient.api_call.return_value = TD.slackbot.get(
+        'user_list')
+    slackbot.users
+    member = copy.deepcopy(TD.slackbot.get('user_list')['members'][0])
+    member['profile']['email'] = 'newgoat@slack.com'
+    slackbot.update_user(member)
+    assert len(slackbot.users) == 2
+    assert slackbot.directory.by_email('testinggoat@slack.com') is None
+    assert slackbot.directory.by_email('newgoat@slack.com').uid == \
+        'U023BECGF'
+    assert eulerbot.slackbot.SlackClient.api_call.call_count == 1
+
+
+def test_slackbot_update_user_adds_and_removes(slackbot):
+    """Test that joined users are added and deactivated users removed"""
+    eulerbot.slackbot.SlackClient.api_call.return_value = TD.slackbot.get(
+        'user_list')
+    slackbot.users
+    slackbot.update_user({'id': 'UNEW', 'name': 'newuser',
+                          'profile': {'email': 'new@dom'}})
+    assert slackbot.directory.by_email('new@dom').uid == 'UNEW'
+    assert len(slackbot.users) == 3
+    slackbot.update_user({'id': 'UNEW', 'deleted': True})
+    assert slackbot.directory.by_uid('UNEW') is None
+    assert len(slackbot.users) == 2
+
+
+def test_slackbot_update_user_before_load_is_ignored(slackbot):
+    """Test that user events received before the first load are ignored"""
+    slackbot.update_user({'id': 'UNEW', 'name': 'newuser'})
+    assert not slackbot._directory
+    assert 'UNEW' not in slackbot._directory
+
+
+def test_user_directory_version_ignores_unindexed_changes(SlackUsers):
+    """Test that the version only changes with indexed attributes"""
+    d = eulerbot.slackbot.UserDirectory(SlackUsers)
+    version = d.version
+    user = eulerbot.slackbot.SlackUser()
+    user.uid = SlackUsers[0].uid
+    user.name = SlackUsers[0].name
+    user.username = SlackUsers[0].username
+    user.profile = SlackUsers[0].profile
+    user.admin = True
+    d.upsert(user)
+    assert d.version == version
+    assert d.by_uid(user.uid) is user
+    user = eulerbot.slackbot.SlackUser()
+    user.uid = SlackUsers[0].uid
+    user.profile = {'email': 'other@dom'}
+    d.upsert(user)
+    assert d.version == version + 1
+
+
+def test_slackbot_uses_pooled_requester(slackbot):
+    """Test that Web API calls go through the pooled session."""
+    requester = slackbot.sc.server.api_requester
+    assert isinstance(requester, eulerbot.slackbot.PooledSlackRequest)
+
+
+def test_pooled_slack_request_posts_through_session():
+    """Test that requests are encoded like slackclient's own requester."""
+    session = MagicMock()
+    r = eulerbot.slackbot.PooledSlackRequest(session)
+    r.do('xoxb-token', 'chat.postMessage',
+         {'channel': 'C1', 'attachments': [{'text': 'hi'}]}, timeout=3)
+    args, kwargs = session.post.call_args
+    assert args == ('https://slack.com/api/chat.postMessage',)
+    assert kwargs['data'] == {'channel': 'C1',
+                              'attachments': '[{"text": "hi"}]',
+                              'token': 'xoxb-token'}
+    assert kwargs['timeout'] == 3
+    assert kwargs['files'] is None
+    assert 'slackclient' in kwargs['headers']['user-agent']
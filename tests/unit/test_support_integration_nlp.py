@@ -1,11 +1,14 @@
 """Language Processor
 
 Test the NLP of the support integration."""
+import os
 import pytest
 import spacy
 import string
+import threading
 import testing_data as TD
-from eulerbot.integrations.support import LanguageParser
+from eulerbot.integrations.support import LanguageParser, NLPPool
+from unittest.mock import MagicMock
 
 pytestmark = pytest.mark.support_nlp
 
@@ -26,6 +29,30 @@ def LP():
     return LanguageParser()
 
 
+class FakeChunk(object):
+    """Noun chunk with a text and a root dependency"""
+    def __init__(self, text, dep):
+        self.text = text
+        self.root = MagicMock(dep_=dep)
+
+
+class FakeParser(object):
+    """Parser whose subject is the pid of the process that parsed"""
+    def __call__(self, text):
+        return MagicMock(noun_chunks=[FakeChunk(str(os.getpid()), 'nsubj'),
+                                      FakeChunk(text, 'dobj')])
+
+
+@pytest.fixture
+def Pool():
+    """Return an NLP pool of two workers over a fake parser."""
+    lp = LanguageParser()
+    lp._parser = FakeParser()
+    pool = NLPPool(lp, processes=2)
+    yield pool
+    pool.shutdown()
+
+
 def text_blob_id(param):
     """Return a test id for large text blobs."""
     return "Slack event text: {}...".format(param[-10:-1])
@@ -47,6 +74,111 @@ def test_nlp_parser_property_loads_correct_model(mocker, monkeypatch):
     spacy.load.assert_called_once_with('test_model')
 
 
+@pytest.mark.parametrize("version, options", [
+    ('1.7.3', {'entity': False, 'matcher': False, 'add_vectors': False}),
+    ('2.0.18', {'disable': ['ner', 'textcat']}),
+])
+def test_nlp_slim_pipeline_loads_only_parser(mocker, monkeypatch, version,
+                                             options):
+    """Test that the slim pipeline leaves out unused components."""
+    monkeypatch.setenv('SLACKBOT_SUPPORT_NLP_SLIM', 'true')
+    monkeypatch.setattr(spacy.about, '__version__', version)
+    mocker.patch('spacy.load', return_value='spacy')
+    lp = LanguageParser()
+    assert lp.parser
+    spacy.load.assert_called_once_with(lp.model, **options)
+
+
+def test_nlp_warm_up_loads_and_parses(mocker):
+    """Test that a warm up loads the model and parses once."""
+    nlp = MagicMock()
+    mocker.patch('spacy.load', return_value=nlp)
+    lp = LanguageParser()
+    assert not lp.ready
+    lp.warm_up()
+    assert lp.ready
+    nlp.assert_called_once_with(lp.warm_up_text)
+
+
+def test_nlp_background_warm_up_reports_loading(mocker):
+    """Test the loading flag while the model loads in the background."""
+    release = threading.Event()
+    mocker.patch('spacy.load', side_effect=lambda *a: release.wait(5))
+    lp = LanguageParser()
+    lp.start_warm_up()
+    assert lp.loading
+    assert not lp.ready
+    release.set()
+    lp._warm_up_thread.join()
+    assert lp.ready
+    assert not lp.loading
+    assert spacy.load.call_count == 1
+
+
+def test_nlp_warm_up_failure_is_logged(mocker):
+    """Test that a model that fails to load does not raise."""
+    mocker.patch('spacy.load', side_effect=IOError('no model'))
+    lp = LanguageParser()
+    lp.logger.error = MagicMock()
+    lp.warm_up()
+    assert not lp.ready
+    lp.logger.error.assert_called_once()
+
+
+@pytest.mark.parametrize("version, workers", [
+    ('1.7.3', 'n_threads'),
+    ('2.0.18', 'n_threads'),
+    ('2.2.4', 'n_process'),
+])
+def test_nlp_pipe_options(monkeypatch, version, workers):
+    """Test that pipe parallelism follows the spacy version."""
+    monkeypatch.setenv('SLACKBOT_SUPPORT_NLP_BATCH_SIZE', '8')
+    monkeypatch.setenv('SLACKBOT_SUPPORT_NLP_WORKERS', '2')
+    monkeypatch.setattr(spacy.about, '__version__', version)
+    assert LanguageParser().pipe_options == {'batch_size': 8, workers: 2}
+
+
+def test_nlp_parse_many_uses_one_pipe(LPMS):
+    """Test that several texts are parsed with a single pipe call."""
+    LPMS._parser = MagicMock()
+    LPMS._parser.pipe.side_effect = lambda texts, **kw: [
+        MagicMock(noun_chunks=[]) for t in texts]
+    r = LPMS.parse_many(['help me, <http://x.dom|x>', 'please help'])
+    assert r == [('No subject found', None)] * 2
+    LPMS._parser.pipe.assert_called_once_with(
+        ['help me ', 'please help'], **LPMS.pipe_options)
+    assert LPMS._parser.call_count == 0
+
+
+def test_nlp_pool_parses_in_worker_processes(Pool):
+    """Test that texts are parsed out of process with the parent's
+    parser."""
+    subject, obj = Pool.submit('restart the <http://x.dom|web> servers!')\
+        .result(timeout=30)
+    assert subject != str(os.getpid())
+    assert obj == 'restart the  servers'
+    assert Pool.ready
+
+
+def test_nlp_pool_loads_model_before_forking(mocker):
+    """Test that the model is loaded once, in the parent."""
+    mocker.patch('spacy.load', return_value=FakeParser())
+    pool = NLPPool(LanguageParser(), processes=1)
+    pool.start()
+    assert pool.submit('help').result(timeout=30)[1] == 'help'
+    pool.shutdown()
+    assert spacy.load.call_count == 1
+    assert not pool.ready
+
+
+def test_nlp_pool_background_start(Pool):
+    """Test that the pool can start in the background."""
+    Pool.start_warm_up()
+    Pool._warm_up_thread.join()
+    assert Pool.ready
+    assert not Pool.loading
+
+
 def test_parsing_remove_punctuation(LPMS):
     """Test that remove_punctuation works as expected."""
     s = "This is a sentence; however, it doesn't {} work".format(
@@ -85,6 +217,34 @@ def test_doc_property_loads_the_document(LPMS, mocker):
     assert LPMS._doc == 'doc parsed'
 
 
+def test_analyze_returns_subject_and_object_without_state():
+    """Test that analyze parses without storing the document."""
+    lp = LanguageParser()
+    lp._parser = FakeParser()
+    subject, obj = lp.analyze('restart the web servers!')
+    assert subject == str(os.getpid())
+    assert obj == 'restart the web servers'
+    assert lp.doc is None
+
+
+def test_analyze_is_safe_across_threads():
+    """Test that concurrent analyze calls each get their own result."""
+    lp = LanguageParser()
+    lp._parser = FakeParser()
+    texts = ['help with server {}'.format(i) for i in range(50)]
+    results = {}
+
+    def analyze(text):
+        results[text] = lp.analyze(text)[1]
+
+    threads = [threading.Thread(target=analyze, args=(t,)) for t in texts]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == {t: t for t in texts}
+
+
 def test_noun_chunks_returns_empty_dict_with_no_text(LPMS):
     """Test that property for doc returns and empty list if no
     test has been parsed."""
@@ -114,6 +274,15 @@ def test_nlp_subject_parsing(LP, blob):
     assert isinstance(r, str)
 
 
+@pytest.mark.spacy
+@pytest.mark.parametrize("blob", TD.SupportChannel.get('text_blobs'),
+                         ids=text_blob_id)
+def test_nlp_analyze_matches_doc_parsing(LP, blob):
+    r = LP.analyze(blob)
+    LP.doc = blob
+    assert r == (LP.subject(), LP.sobject())
+
+
 @pytest.mark.spacy
 @pytest.mark.parametrize("blob", TD.SupportChannel.get('text_blobs'),
                          ids=text_blob_id)
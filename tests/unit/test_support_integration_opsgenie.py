@@ -4,7 +4,8 @@ Test the Support OpsGenie integration."""
 import pytest
 import testing_data as TD
 import requests
-from eulerbot.integrations.support import OpsGenieSchedule
+from eulerbot.integrations.support import OnCallTimeline, OpsGenieSchedule
+from unittest.mock import MagicMock
 
 pytestmark = pytest.mark.support_opsgenie
 
@@ -21,6 +22,10 @@ def mocked_request_get(*args, **kwargs):
     if args[0] == 'https://api.opsgenie.com/v1.1/json/schedule/fail':
         return MockResponse(TD.SupportChannel.get('opsgenie')['error'], 403)
 
+    if args[0] == 'https://api.opsgenie.com/v1.1/json/schedule/timeline':
+        return MockResponse(TD.SupportChannel.get('opsgenie')['timeline'],
+                            200)
+
     if args[0].startswith('https://api.opsgenie.com/v1.1/json/schedule'):
         return MockResponse(TD.SupportChannel.get('opsgenie')['oncall'], 200)
 
@@ -33,15 +38,16 @@ def mocked_request_get(*args, **kwargs):
 @pytest.fixture
 def OGS(mocker, monkeypatch):
     """Return an instance of the OpsGenieSchedule class"""
-    mocker.patch('requests.get', autospec=True)
-    requests.get.side_effect = mocked_request_get
     monkeypatch.setenv('OPSGENIE_API_KEY', 'api_key')
-    return OpsGenieSchedule()
+    o = OpsGenieSchedule()
+    o.session = MagicMock(autospec=True)
+    o.session.get.side_effect = mocked_request_get
+    return o
 
 
 def test_request_fails_with_bad_payload_type(OGS):
     r = OGS._request('test', 'payload')
-    assert requests.get.call_count == 0
+    assert OGS.session.get.call_count == 0
     assert r is None
 
 
@@ -51,7 +57,8 @@ def test_request_builds_correct_url(OGS):
     url = 'https://api.opsgenie.com/v1.1/json/schedule/test'
     OGS._request('test', payload)
     payload['apiKey'] = 'api_key'
-    requests.get.assert_called_once_with(url, payload)
+    OGS.session.get.assert_called_once_with(url, params=payload,
+                                            timeout=OGS.timeout)
 
 
 def test_request_returns_dict_with_status_200(OGS):
@@ -82,16 +89,138 @@ def test_oncalls_returns_list_of_on_call_teams(OGS):
     """test that on_calls returns a list of teams"""
     r = OGS.on_calls()
     assert isinstance(r, list)
-    requests.get.assert_called_once_with(
+    OGS.session.get.assert_called_once_with(
         'https://api.opsgenie.com/v1.1/json/schedule/whoIsOnCall',
-        {'apiKey': 'api_key'})
+        params={'apiKey': 'api_key'}, timeout=OGS.timeout)
 
 
 def test_oncalls_failure_returns_none(mocker, monkeypatch):
     """Test that a failed opsgenie lookup returns none"""
     monkeypatch.setenv('OPSGENIE_API_KEY', 'api_key')
-    mocker.patch('requests.get', autospec=True)
-    requests.get.return_value = mocked_request_get('fail_request')
     o = OpsGenieSchedule()
+    o.session = MagicMock(autospec=True)
+    o.session.get.return_value = mocked_request_get('fail_request')
     r = o.on_calls()
     assert r is None
+
+
+def test_request_timeout_returns_none(OGS):
+    """Test that a request that times out returns none."""
+    OGS.session.get.side_effect = requests.exceptions.Timeout('slow')
+    assert OGS._request('test', {}) is None
+    assert not OGS.available
+
+
+def test_outage_opens_breaker(OGS):
+    """Test that OpsGenie is not called once the circuit is open."""
+    OGS.session.get.side_effect = requests.exceptions.ConnectionError('down')
+    for i in range(OGS.breaker.failures + 2):
+        OGS.on_calls()
+    assert OGS.session.get.call_count == OGS.breaker.failures
+
+
+def test_server_error_counts_as_failure(OGS):
+    """Test that 5xx responses count against the breaker."""
+    OGS.session.get.side_effect = None
+    OGS.session.get.return_value = mocked_request_get('fail_request')
+    OGS.on_calls()
+    assert not OGS.available
+
+
+def test_oncall_requests_only_the_team_schedule(OGS):
+    """Test that on_call asks OpsGenie for a single schedule."""
+    OGS.on_call('Team2')
+    OGS.session.get.assert_called_once_with(
+        'https://api.opsgenie.com/v1.1/json/schedule/whoIsOnCall',
+        params={'name': 'Team2', 'apiKey': 'api_key'}, timeout=OGS.timeout)
+
+
+def test_team_on_calls_indexes_schedule(OGS):
+    """Test that the parsed schedule is kept by team name."""
+    assert OGS.team_on_calls('Team2') == ['user@team2.dom']
+    assert OGS.schedules == {'Team2': ['user@team2.dom']}
+
+
+def test_oncall_without_participants_returns_unknown(OGS):
+    """Test that a schedule nobody is on call for returns unknown."""
+    assert OGS.on_call('Team1') == 'unknown'
+
+
+@pytest.mark.parametrize("result", [
+    {'oncall': {'name': 'Team2',
+                'participants': [{'name': 'user@team2.dom'}]}},
+    {'name': 'Team2', 'participants': [{'name': 'user@team2.dom'}]},
+    TD.SupportChannel.get('opsgenie')['oncall'],
+])
+def test_index_parses_single_and_full_results(OGS, result):
+    """Test that single and full whoIsOnCall answers are indexed."""
+    assert OGS._index(result)['Team2'] == ['user@team2.dom']
+
+
+def test_index_of_failed_request_is_empty(OGS):
+    """Test that errors and empty answers index to nothing."""
+    assert OGS._index(None) == {}
+    assert OGS._index(TD.SupportChannel.get('opsgenie')['error']) == {}
+
+
+def test_timeline_index_answers_overlaps():
+    """Test lookups in a timeline with overlapping periods."""
+    t = OnCallTimeline([(0, 10, 'a'), (10, 20, 'b'), (5, 12, 'c')])
+    assert t.at(0) == ['a']
+    assert t.at(5) == ['a', 'c']
+    assert t.at(10) == ['b', 'c']
+    assert t.at(12) == ['b']
+    assert t.at(20) == []
+    assert t.at(-1) == []
+    assert t.covers(19.9)
+    assert not t.covers(20)
+
+
+def test_empty_timeline_covers_nothing():
+    t = OnCallTimeline()
+    assert t.start is None
+    assert not t.covers(0)
+    assert t.at(0) == []
+
+
+def test_timeline_request(OGS):
+    """Test that the timeline of one schedule is requested."""
+    OGS.timeline('Team2', 24)
+    OGS.session.get.assert_called_once_with(
+        'https://api.opsgenie.com/v1.1/json/schedule/timeline',
+        params={'name': 'Team2', 'intervalUnit': 'days', 'interval': 1,
+                'apiKey': 'api_key'},
+        timeout=OGS.timeout)
+
+
+def test_timeline_is_parsed(OGS):
+    """Test that rotations and overrides are indexed in seconds."""
+    t = OGS.timeline('Team2', 24)
+    assert t.start == 1500000000
+    assert t.end == 1500086400
+    assert t.at(1500000000) == ['user@team2.dom']
+    assert t.at(1500015000) == ['user@team2.dom', 'cover@team2.dom']
+    assert t.at(1500050000) == ['other@team2.dom']
+
+
+def test_timeline_requests_whole_days(OGS):
+    """Test that the timeline is requested in days, rounded up."""
+    OGS.timeline('Team2', 36)
+    params = OGS.session.get.call_args[1]['params']
+    assert params['intervalUnit'] == 'days'
+    assert params['interval'] == 2
+
+
+def test_timeline_is_trimmed_to_hours(OGS):
+    """Test that periods past the requested hours are dropped or cut."""
+    t = OGS.timeline('Team2', 6)
+    assert t.start == 1500000000
+    assert t.end == 1500021600
+    assert t.at(1500015000) == ['user@team2.dom', 'cover@team2.dom']
+    assert t.at(1500050000) == []
+
+
+def test_timeline_failure_returns_none(OGS):
+    OGS.session.get.side_effect = None
+    OGS.session.get.return_value = mocked_request_get('fail_request')
+    assert OGS.timeline('Team2', 24) is None